@@ -0,0 +1,145 @@
+from datetime import timedelta
+
+import motion_intervals
+
+# Sliding-window activity counters for the dwell rule. One ring buffer of
+# per-minute buckets per room holds motion reports (0 and 1, like the polling
+# mode and motion_intervals.samples_in count them) and seconds of motion;
+# running totals are adjusted as reports arrive and buckets expire, so reading
+# the window is O(1). Motion seconds accrue between consecutive reports of an
+# active room when they are at most dwell.gap_min apart.
+
+BUCKET_SEC = 60
+
+def window_size(minutes):
+    return max(1, int(minutes * 60 // BUCKET_SEC))
+
+class ActivityWindow:
+    def __init__(self, minutes, gap_sec):
+        self.size = window_size(minutes)
+        self.gap_sec = gap_sec
+        self._bucket = [None] * self.size   # bucket number stored in each slot
+        self._reports = [0.0] * self.size
+        self._seconds = [0.0] * self.size
+        self.reports = 0.0
+        self.seconds = 0.0
+        self._head = None                   # newest bucket number seen
+        self._last_ts = None                # epoch of the last report
+        self._last_value = 0
+
+    def _slot(self, b):
+        i = b % self.size
+        if self._bucket[i] != b:
+            self.reports -= self._reports[i]
+            self.seconds -= self._seconds[i]
+            self._bucket[i], self._reports[i], self._seconds[i] = b, 0.0, 0.0
+        return i
+
+    def advance(self, now):
+        """Expire buckets that fell out of the window ending at now (epoch)."""
+        b = int(now // BUCKET_SEC)
+        if self._head is None:
+            self._head = b
+            return
+        if b <= self._head:
+            return
+        for n in range(max(self._head + 1, b - self.size + 1), b + 1):
+            self._slot(n)
+        self._head = b
+
+    def _add_seconds(self, start, end):
+        start = max(start, (self._head - self.size + 1) * BUCKET_SEC)
+        while start < end:
+            b = int(start // BUCKET_SEC)
+            stop = min(end, (b + 1) * BUCKET_SEC)
+            i = self._slot(b)
+            self._seconds[i] += stop - start
+            self.seconds += stop - start
+            start = stop
+
+    def _add_reports(self, start, end, n):
+        """n reports of one episode: its first at start, its last at end, the rest
+        spread evenly in between; the part before the window is dropped."""
+        low = (self._head - self.size + 1) * BUCKET_SEC
+        if n == 1 or end <= start:
+            points, interior = [(end, n)], 0
+        else:
+            points, interior = [(start, 1), (end, 1)], n - 2
+        for ts, k in points:
+            if ts >= low:
+                i = self._slot(int(ts // BUCKET_SEC))
+                self._reports[i] += k
+                self.reports += k
+        if interior <= 0:
+            return
+        rate = interior / (end - start)
+        start = max(start, low)
+        while start < end:
+            b = int(start // BUCKET_SEC)
+            stop = min(end, (b + 1) * BUCKET_SEC)
+            i = self._slot(b)
+            self._reports[i] += rate * (stop - start)
+            self.reports += rate * (stop - start)
+            start = stop
+
+    def add(self, ts, value):
+        """Fold one motion report (epoch, 0/1) in; late reports outside the window are dropped."""
+        self.advance(ts)
+        if int(ts // BUCKET_SEC) <= self._head - self.size:
+            return
+        if self._last_value and self._last_ts is not None and 0 < ts - self._last_ts <= self.gap_sec:
+            self._add_seconds(self._last_ts, ts)
+        i = self._slot(int(ts // BUCKET_SEC))
+        self._reports[i] += 1
+        self.reports += 1
+        self._last_ts, self._last_value = ts, int(bool(value))
+
+    def catch_up(self, reports):
+        """Fold in (epoch, value) reports that arrived while the seed query ran; the
+        ones not newer than the seeded data are already part of it."""
+        for ts, value in reports:
+            if self._last_ts is None or ts > self._last_ts:
+                self.add(ts, value)
+
+    def totals(self, now):
+        """(motion reports, motion seconds) in the window ending at now."""
+        self.advance(now)
+        return round(self.reports), self.seconds
+
+def continuous(seconds, minutes, gap_sec):
+    """Motion for the whole window apart from gaps; never true for a window that
+    is not longer than one gap, or without any motion."""
+    need = 60 * minutes - gap_sec
+    return need > 0 and seconds >= need
+
+def seed_rows(con, room, minutes, now):
+    """motion_intervals rows of the room that reach into the window ending at now."""
+    since = now - timedelta(minutes=minutes)
+    return con.execute("""
+        SELECT start_utc, end_utc, is_open, samples FROM motion_intervals
+         WHERE room = ? AND (end_utc >= ? OR is_open = 1)
+      ORDER BY end_utc
+    """, (room, motion_intervals.iso_utc(since))).fetchall()
+
+def from_rows(rows, minutes, gap_sec, now):
+    """Window pre-filled from seed_rows(). Each episode's reports are taken as evenly
+    spread over its span (prorated like motion_intervals.samples_in); its span counts
+    as motion seconds only if that spacing is within gap_sec, as add() would see it."""
+    w = ActivityWindow(minutes, gap_sec)
+    since = now - timedelta(minutes=minutes)
+    w.advance(since.timestamp())
+    for start, end, is_open, samples in rows:
+        first = motion_intervals.parse_utc(start).timestamp()
+        e = min(motion_intervals.parse_utc(end), now).timestamp()
+        s = max(first, since.timestamp())
+        w.advance(e)
+        if e > s and samples > 1 and (e - first) / (samples - 1) <= gap_sec:
+            w._add_seconds(s, e)
+        w._add_reports(first, e, samples)
+        w._last_ts, w._last_value = e, int(is_open)
+    w.advance(now.timestamp())
+    return w
+
+def seed(con, room, minutes, gap_sec, now):
+    """seed_rows() and from_rows() in one go."""
+    return from_rows(seed_rows(con, room, minutes, now), minutes, gap_sec, now)
@@ -1,13 +1,37 @@
-from flask import Flask, jsonify, request, abort
-import sqlite3, os, time, json
+from flask import Flask, jsonify, request, abort, g
+import os, time, json
+import hmac, hashlib
 from datetime import datetime
-from flask import make_response
-from prealert_config import load_config, save_config, get_room_cfg
-
-DB_PATH = "/home/pi/DYPLOM/device/raspberry/events.db"
+from flask import make_response, Response, stream_with_context
+from prealert_config import load_config, update_config, get_room_cfg, rule_settings, ensure_settings_schema, night_spec
+import storage
+import motion_intervals
+import raw_archive
+import spool
+import room_state
+import device_status
+import live_feed
+import response_cache
+import timestamps
 
 app = Flask(__name__)
+with storage.writer() as _con:
+    motion_intervals.ensure_schema(_con)
+    raw_archive.ensure_schema(_con)
+    room_state.ensure_schema(_con)
+    device_status.ensure_schema(_con)
+    timestamps.ensure_schema(_con, log=print)
+    ensure_settings_schema(_con)
 API_TOKEN = os.getenv("API_TOKEN", "").strip()
+# API_AUTH_DEBUG=1 logs rejected requests (never the token values)
+AUTH_DEBUG = os.getenv("API_AUTH_DEBUG", "0") == "1"
+# EventSource cannot send headers, and a token in the URL ends up in access and
+# proxy logs. The dashboard therefore asks POST /api/stream/token (normal auth)
+# for a stream token and opens /api/stream?st=<it>. The stream token is an HMAC
+# of its expiry keyed with API_TOKEN, so any worker accepts it without shared
+# state, and it is useless API_STREAM_TOKEN_TTL seconds later. It is only
+# checked when a stream connects, open streams are not cut off.
+STREAM_TOKEN_TTL = int(os.getenv("API_STREAM_TOKEN_TTL", "60"))
 
 def log(msg):
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}", flush=True)
@@ -15,37 +39,66 @@ def log(msg):
 def now_iso():
     return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
 
+def db():
+    """Read-only connection for this request, borrowed from the pool on first use."""
+    if "db" not in g:
+        g.db = storage.read_pool().acquire()
+    return g.db
+
+@app.teardown_request
+def release_db(exc):
+    con = g.pop("db", None)
+    if con is not None:
+        storage.read_pool().release(con)
+
 def row_query(query, args=(), one=False):
-    con = sqlite3.connect(DB_PATH)
-    con.row_factory = sqlite3.Row
-    cur = con.execute(query, args)
-    rows = cur.fetchall()
-    con.close()
+    rows = db().execute(query, args).fetchall()
     return (rows[0] if rows else None) if one else rows
 
 def exec_query(query, args=()):
-    con = sqlite3.connect(DB_PATH)
-    cur = con.execute(query, args)
-    con.commit()
-    last_id = cur.lastrowid
-    con.close()
+    _, last_id = storage.write(query, args)
     return last_id
 
 def exec_write(query, args=()):
-    con = sqlite3.connect(DB_PATH)
-    cur = con.execute(query, args)
-    con.commit()
-    affected = cur.rowcount
-    last_id = cur.lastrowid
-    con.close()
-    return affected, last_id
+    return storage.write(query, args)
+
+_devices_columns = None
 
 def devices_has_column(col):
-    con = sqlite3.connect(DB_PATH)
-    cur = con.execute("PRAGMA table_info(devices)")
-    cols = [r[1] for r in cur.fetchall()]
-    con.close()
-    return col in cols
+    global _devices_columns
+    if _devices_columns is None:
+        _devices_columns = {r[1] for r in row_query("PRAGMA table_info(devices)")}
+    return col in _devices_columns
+
+# List endpoints return at most API_PAGE_MAX rows per request. The body stays a
+# plain JSON array for existing clients, the cursor for the next page is sent
+# in X-Next-Cursor; ?envelope=1 returns {"items": [...], "next_cursor": ...}.
+PAGE_MAX = int(os.getenv("API_PAGE_MAX", "500"))
+EXPORT_CHUNK = 1000
+
+def page_limit(default):
+    limit = request.args.get("limit", default, type=int)
+    return max(1, min(limit, PAGE_MAX))
+
+def paged(items, next_cursor):
+    if request.args.get("envelope") == "1":
+        resp = jsonify({"items": items, "next_cursor": next_cursor})
+    else:
+        resp = jsonify(items)
+    if next_cursor is not None:
+        resp.headers["X-Next-Cursor"] = str(next_cursor)
+    return resp
+
+def stream_json(rows, filename):
+    """Stream an iterable of dicts as one JSON array without materializing it."""
+    def generate():
+        yield "["
+        for i, row in enumerate(rows):
+            yield ("," if i else "") + json.dumps(row)
+        yield "]"
+    resp = Response(stream_with_context(generate()), mimetype="application/json")
+    resp.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return resp
 
 def ensure_room(conn, name):
     cur = conn.cursor()
@@ -54,10 +107,22 @@ def ensure_room(conn, name):
     row = cur.fetchone()
     return row[0] if row else None
 
-def require_token():
-    import os
-    print(f"[AUTH DEBUG] Header={request.headers.get('X-API-Key')} Env={os.getenv('API_TOKEN')}", flush=True)
-    token_env = os.getenv("API_TOKEN", "").strip()
+def _stream_sig(exp):
+    return hmac.new(API_TOKEN.encode(), f"stream:{exp}".encode(), hashlib.sha256).hexdigest()[:32]
+
+def stream_token(now=None):
+    exp = int((now or time.time()) + STREAM_TOKEN_TTL)
+    return f"{exp}.{_stream_sig(exp)}"
+
+def stream_token_valid(value, now=None):
+    exp, _, sig = (value or "").partition(".")
+    if not API_TOKEN or not exp.isdigit() or int(exp) < (now or time.time()):
+        return False
+    return hmac.compare_digest(sig, _stream_sig(int(exp)))
+
+def require_token(allow_stream_token=False):
+    """allow_stream_token: also accept ?st=<stream token> (see STREAM_TOKEN_TTL)."""
+    token_env = API_TOKEN
     hdr = request.headers.get("Authorization", "")
     key = request.headers.get("X-API-Key", "")
     token = ""
@@ -66,17 +131,33 @@ def require_token():
         token = hdr.split(" ", 1)[1].strip()
     elif key:
         token = key.strip()
+    elif allow_stream_token and stream_token_valid(request.args.get("st", "").strip()):
+        return
 
     if token_env and token == token_env:
         return
 
+    if AUTH_DEBUG:
+        log(f"[AUTH] rejected {request.method} {request.path}: "
+            f"{'no token' if not token else 'wrong token'}{'' if token_env else ', API_TOKEN unset'}")
     abort(401, description="Unauthorized")
 
+def cached(max_age=None):
+    """Response cache for GET views (see response_cache.py); also checks the token."""
+    return response_cache.cached(require_token, max_age=max_age)
+
+@app.after_request
+def invalidate_cache(resp):
+    if request.method in ("POST", "PUT", "DELETE"):
+        response_cache.invalidate()
+    return resp
+
 @app.after_request
 def add_cors(resp):
     resp.headers["Access-Control-Allow-Origin"] = "*"
     resp.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type, X-API-Key"
     resp.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
+    resp.headers["Access-Control-Expose-Headers"] = "ETag, X-Next-Cursor"
     return resp
 
 @app.route("/", methods=["GET"])
@@ -86,41 +167,58 @@ def root():
 @app.route("/api/messages", methods=["GET"])
 def get_messages():
     require_token()
-    limit = int(request.args.get("limit", 10))
-    data = row_query(
-        """
-        SELECT ts_utc, topic, payload
-          FROM messages_raw
-      ORDER BY id DESC
-         LIMIT ?
-        """,
-        (limit,),
-    )
-    return jsonify([dict(r) for r in data])
+    limit = page_limit(10)
+    cursor = request.args.get("cursor") or request.args.get("before_id")
+    try:
+        rows, next_cursor = raw_archive.page_messages(db(), limit, cursor)
+    except ValueError:
+        abort(400, description="invalid cursor")
+    return paged(rows, next_cursor)
+
+@app.route("/api/messages/export", methods=["GET"])
+def export_messages():
+    """Every stored raw message, newest first, streamed page by page."""
+    require_token()
+    con = db()
+
+    def rows():
+        cursor = None
+        while True:
+            page, cursor = raw_archive.page_messages(con, EXPORT_CHUNK, cursor)
+            yield from page
+            if cursor is None:
+                return
+    return stream_json(rows(), "messages.json")
+
+@app.route("/api/ingest/status", methods=["GET"])
+def get_ingest_status():
+    require_token()
+    return jsonify({"spool": spool.read_status(spool.default_dir(storage.DB_PATH))})
 
 @app.route("/api/health/latest", methods=["GET"])
+@cached()
 def get_latest_health():
-    require_token()
     data = row_query(
         """
-        SELECT device_id, MAX(ts_utc) AS last_hb, MAX(uptime_ms) AS last_uptime
-          FROM heartbeats
-      GROUP BY device_id
+        SELECT device_id, last_seen_utc AS last_hb, last_uptime_ms AS last_uptime,
+               last_ip, boot_utc, reboots
+          FROM device_status
       ORDER BY last_hb DESC;
         """
     )
     return jsonify([dict(r) for r in data])
 
 @app.route("/api/devices", methods=["GET"])
+@cached()
 def get_devices():
-    require_token()
     sql = """
     SELECT
       d.device_id,
       COALESCE(d.room, r.name) AS room,
-      (SELECT MAX(ts_utc) FROM heartbeats h WHERE h.device_id = d.device_id) AS last_hb
+      s.last_seen_utc AS last_hb
     FROM devices d
     LEFT JOIN rooms r ON d.room_id = r.id
+    LEFT JOIN device_status s ON s.device_id = d.device_id
     ORDER BY last_hb DESC;
     """
     data = row_query(sql)
@@ -138,8 +236,7 @@ def register_device():
     if not device_id or not room:
         abort(400, description="device_id and room are required")
 
-    con = sqlite3.connect(DB_PATH)
-    try:
+    with storage.writer() as con:
         if devices_has_column("room"):
             con.execute("""
                 INSERT INTO devices(device_id, room)
@@ -155,9 +252,6 @@ def register_device():
             """, (device_id, room_id))
         else:
             abort(500, description="devices table has no room/room_id column")
-        con.commit()
-    finally:
-        con.close()
 
     return jsonify({"ok": True, "device_id": device_id, "room": room})
 
@@ -171,36 +265,28 @@ def unregister_device(device_id):
     if not device_id:
         abort(400, description="device_id required")
 
-    con = sqlite3.connect(DB_PATH)
-    try:
+    with storage.writer() as con:
         if devices_has_column("room"):
             con.execute("UPDATE devices SET room=NULL WHERE device_id=?", (device_id,))
         elif devices_has_column("room_id"):
             con.execute("UPDATE devices SET room_id=NULL WHERE device_id=?", (device_id,))
         else:
             abort(500, description="devices table has no room/room_id column")
-        con.commit()
-    finally:
-        con.close()
 
     return jsonify({"ok": True, "device_id": device_id, "unregistered": True})
 
-@app.route("/api/alerts", methods=["GET"])
-def get_alerts():
-    require_token()
-    status = request.args.get("status")             
-    room_contains = request.args.get("room")        
-    a_type = request.args.get("type")              
-    since = request.args.get("since")               
+ALERT_COLUMNS = """id, ts_utc, room, device_id, type, severity, status, details,
+             created_at, closed_at, ack_at, ack_by, notified_at"""
+
+def alert_filters():
+    """WHERE clause + args for the /api/alerts query parameters."""
+    status = request.args.get("status")
+    room_contains = request.args.get("room")
+    a_type = request.args.get("type")
+    since = request.args.get("since")
     last_minutes = request.args.get("last_minutes", type=int) or 0
-    limit = int(request.args.get("limit", 500))
 
-    sql = """
-      SELECT id, ts_utc, room, device_id, type, severity, status, details,
-             created_at, closed_at, ack_at, ack_by, notified_at
-        FROM alerts
-       WHERE 1=1
-    """
+    sql = " WHERE 1=1"
     args = []
 
     if status in ("open", "closed"):
@@ -216,17 +302,57 @@ def get_alerts():
         args.append(a_type)
 
     if last_minutes > 0:
-        sql += " AND datetime(ts_utc) >= datetime('now', ?)"
-        args.append(f"-{last_minutes} minutes")
+        sql += " AND ts_ms >= ?"
+        args.append(timestamps.ago_ms(last_minutes * 60))
     elif since:
-        sql += " AND ts_utc >= ?"
-        args.append(since)
-
-    sql += " ORDER BY id DESC LIMIT ?"
-    args.append(limit)
+        since_ms = timestamps.to_ms(since)
+        if since_ms is None:
+            abort(400, description="since must be an ISO timestamp")
+        sql += " AND ts_ms >= ?"
+        args.append(since_ms)
+    return sql, args
 
-    data = row_query(sql, tuple(args))
-    return jsonify([dict(r) for r in data])
+@app.route("/api/alerts", methods=["GET"])
+@cached(max_age=5)
+def get_alerts():
+    """Newest first; before_id / after_id page by id (after_id pages oldest first)."""
+    limit = page_limit(500)
+    before_id = request.args.get("before_id", type=int)
+    after_id = request.args.get("after_id", type=int)
+    where, args = alert_filters()
+    if after_id is not None:
+        where += " AND id > ?"
+        args.append(after_id)
+        order = "ASC"
+    else:
+        if before_id is not None:
+            where += " AND id < ?"
+            args.append(before_id)
+        order = "DESC"
+
+    data = [dict(r) for r in row_query(
+        f"SELECT {ALERT_COLUMNS} FROM alerts{where} ORDER BY id {order} LIMIT ?", (*args, limit + 1))]
+    next_cursor = data[limit - 1]["id"] if len(data) > limit else None
+    return paged(data[:limit], next_cursor)
+
+@app.route("/api/alerts/export", methods=["GET"])
+def export_alerts():
+    """All matching alerts (same filters as /api/alerts), streamed oldest first."""
+    require_token()
+    where, args = alert_filters()
+    con = db()
+
+    def rows():
+        last = 0
+        while True:
+            chunk = con.execute(f"SELECT {ALERT_COLUMNS} FROM alerts{where} AND id > ? ORDER BY id LIMIT ?",
+                                (*args, last, EXPORT_CHUNK)).fetchall()
+            for r in chunk:
+                yield dict(r)
+            if len(chunk) < EXPORT_CHUNK:
+                return
+            last = chunk[-1]["id"]
+    return stream_json(rows(), "alerts.json")
 
 @app.route("/api/alerts/<int:alert_id>/ack", methods=["POST"])
 def ack_alert(alert_id):
@@ -256,10 +382,13 @@ def close_alert(alert_id):
     return jsonify({"ok": True, "updated": affected > 0})
 
 @app.route("/api/rule-settings", methods=["GET"])
+@cached()
 def get_rule_settings():
-    require_token()
-    rows = row_query("SELECT key, value FROM rule_settings ORDER BY key")
-    return jsonify({r["key"]: r["value"] for r in rows})
+    settings = rule_settings(db())
+    return jsonify({k: settings[k] for k in sorted(settings)})
+
+# values the rules engine parses; a bad one is refused here instead of there
+RULE_SETTING_CHECKS = {"night.window": night_spec}
 
 @app.route("/api/rule-settings", methods=["PUT", "POST"])
 def upsert_rule_settings():
@@ -269,20 +398,22 @@ def upsert_rule_settings():
     payload = request.get_json() or {}
     if not isinstance(payload, dict):
         abort(400, description="Expected object with key:value pairs")
-
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    for k, v in payload.items():
-        cur.execute(
+    for key, check in RULE_SETTING_CHECKS.items():
+        if key in payload:
+            try:
+                check(payload[key])
+            except ValueError as e:
+                abort(400, description=f"{key}: {e}")
+
+    with storage.writer() as con:
+        con.executemany(
             """
             INSERT INTO rule_settings(key, value)
             VALUES (?, ?)
             ON CONFLICT(key) DO UPDATE SET value=excluded.value
             """,
-            (str(k), str(v)),
+            [(str(k), str(v)) for k, v in payload.items()],
         )
-    con.commit()
-    con.close()
     return jsonify({"ok": True, "updated": len(payload)})
 
 @app.post("/api/alerts/close-bulk")
@@ -301,8 +432,8 @@ def close_bulk():
         args.append(status)
 
     if older_than_minutes > 0:
-        sql += " AND datetime(ts_utc) <= datetime('now', ?)"
-        args.append(f"-{older_than_minutes} minutes")
+        sql += " AND ts_ms <= ?"
+        args.append(timestamps.ago_ms(older_than_minutes * 60))
 
     if a_type:
         sql += " AND type=?"
@@ -312,24 +443,12 @@ def close_bulk():
     return jsonify({"ok": True, "closed": affected, "closed_at": now})
 
 @app.route("/api/rooms", methods=["GET"])
+@cached(max_age=5)
 def get_rooms():
-    require_token()
     cfg = load_config()
     now = int(time.time())
 
-    sql = """
-    SELECT 
-        r.name AS room,
-        MAX(e.ts_utc) AS last_motion,
-        COUNT(CASE WHEN e.ts_utc >= datetime('now', '-1 day') THEN 1 END) AS motions_today
-      FROM rooms r
- LEFT JOIN devices d ON d.room = r.name
- LEFT JOIN motion_events e ON e.device_id = d.device_id
-  GROUP BY r.name
-  ORDER BY r.name;
-    """
-
-    rows = row_query(sql)
+    rows = room_state.overview(db())
     res = []
     for r in rows:
         room_name = r["room"]
@@ -337,12 +456,9 @@ def get_rooms():
             continue
 
         last_motion_ts = 0
-        try:
-            if r["last_motion"]:
-                dt = datetime.fromisoformat(r["last_motion"])
-                last_motion_ts = int(dt.timestamp())
-        except Exception:
-            pass
+        dt = motion_intervals.parse_utc(r["last_motion"])
+        if dt:
+            last_motion_ts = int(dt.timestamp())
 
         merged = get_room_cfg(room_name, cfg)
         inactivity = merged.get("inactivity_sec", 30 * 60)
@@ -356,6 +472,9 @@ def get_rooms():
             "room": room_name,
             "motions_today": r["motions_today"] or 0,
             "last_motion_ts": last_motion_ts,
+            "active_now": bool(r["active_now"]),
+            "device_count": r["device_count"],
+            "last_hb": r["last_hb"],
             "elapsed_sec": elapsed,
             "prealert": prealert,
             "alert_active": alert_active,
@@ -368,17 +487,19 @@ def get_rooms():
 def set_room_settings(room):
     require_token()
     body = request.get_json(force=True, silent=True) or {}
-    cfg = load_config()
-    cfg.setdefault("default", {
-        "inactivity_sec": 30 * 60,
-        "prealert_offset_sec": 5 * 60,
-        "enabled": True
-    })
-    cfg[room] = cfg.get(room, {})
-    for k in ("inactivity_sec", "prealert_offset_sec", "enabled", "night_block", "night_window"):
-        if k in body:
-            cfg[room][k] = body[k]
-    save_config(cfg)
+
+    def change(cfg):
+        cfg.setdefault("default", {
+            "inactivity_sec": 30 * 60,
+            "prealert_offset_sec": 5 * 60,
+            "enabled": True
+        })
+        cfg[room] = cfg.get(room, {})
+        for k in ("inactivity_sec", "prealert_offset_sec", "enabled", "night_block", "night_window"):
+            if k in body:
+                cfg[room][k] = body[k]
+
+    cfg = update_config(change)
     log(f"[ROOM SETTINGS] Updated config for {room}: {cfg[room]}")
     return jsonify({"ok": True, "room": room, "config": get_room_cfg(room, cfg)})
 
@@ -426,25 +547,40 @@ def get_room_settings(room):
 @app.route("/api/events/recent", methods=["GET"])
 def api_recent_events():
     require_token()
-    sql = """
-      SELECT e.device_id, e.ts_utc, d.room
-        FROM motion_events e
-        LEFT JOIN devices d ON e.device_id = d.device_id
-       ORDER BY e.ts_utc DESC
-        LIMIT 20
-    """
-    rows = row_query(sql)
+    rows = motion_intervals.recent(db(), 20)
     result = {}
     for r in rows:
         room = r["room"] or "Unknown"
         if room not in result:
             result[room] = []
         result[room].append({
-            "ts": r["ts_utc"],
-            "text": f"Motion ({r['device_id']})"
+            "ts": r["start_utc"],
+            "end": None if r["is_open"] else r["end_utc"],
+            "text": f"Motion ({r['device_id']})",
+            "device": r["device_id"],
         })
     return jsonify(result)
 
+@app.route("/api/cache/stats", methods=["GET"])
+def get_cache_stats():
+    require_token()
+    return jsonify(response_cache.stats())
+
+@app.route("/api/stream/token", methods=["POST"])
+def api_stream_token():
+    require_token()
+    return jsonify({"token": stream_token(), "ttl": STREAM_TOKEN_TTL})
+
+@app.route("/api/stream", methods=["GET"])
+def api_stream():
+    """SSE feed of motion, room and alert changes (see live_feed.py)."""
+    require_token(allow_stream_token=True)
+    last_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    resp = Response(stream_with_context(live_feed.subscribe(last_id)), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
 @app.before_request
 def cors_preflight():
     if request.method == "OPTIONS":
@@ -0,0 +1,86 @@
+import os
+import time
+import argparse
+import threading
+import urllib.request
+import urllib.error
+
+# Load test for serve.py: C clients issue the dashboard's GET mix back to
+# back for D seconds and report req/s and latency percentiles. Each client
+# sends the ETag it got last time, like a browser does, unless --no-etag.
+#
+#   EVENTS_DB=/tmp/copy.db API_TOKEN=k python serve.py --workers 2 --threads 8 &
+#   python bench_api.py --url http://127.0.0.1:5000 --token k -c 16 -d 30
+#
+# Target (documented in serve.py): >= 300 req/s at p99 <= 100 ms, 16 clients.
+
+PATHS = [
+    "/api/rooms",
+    "/api/alerts?status=open&limit=500",
+    "/api/devices",
+    "/api/health/latest",
+    "/api/events/recent",
+    "/api/messages?limit=10",
+    "/api/rule-settings",
+]
+
+def build_args(argv=None):
+    p = argparse.ArgumentParser(description="Measure API throughput and latency")
+    p.add_argument("--url", default=os.getenv("API_URL", "http://127.0.0.1:5000"))
+    p.add_argument("--token", default=os.getenv("API_TOKEN", ""))
+    p.add_argument("-c", "--clients", type=int, default=16)
+    p.add_argument("-d", "--duration", type=float, default=30)
+    p.add_argument("--no-etag", action="store_true", help="never send If-None-Match")
+    return p.parse_args(argv)
+
+def client(args, deadline, latencies, errors, offset):
+    etags = {}
+    i = offset
+    while time.monotonic() < deadline:
+        path = PATHS[i % len(PATHS)]
+        i += 1
+        req = urllib.request.Request(args.url + path, headers={"X-API-Key": args.token})
+        if not args.no_etag and path in etags:
+            req.add_header("If-None-Match", etags[path])
+        t0 = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=10) as resp:
+                resp.read()
+                if resp.headers.get("ETag"):
+                    etags[path] = resp.headers["ETag"]
+        except urllib.error.HTTPError as e:
+            if e.code != 304:
+                errors.append(e.code)
+                continue
+        except OSError as e:
+            errors.append(str(e))
+            continue
+        latencies.append(time.perf_counter() - t0)
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+def main(argv=None):
+    args = build_args(argv)
+    latencies, errors = [], []
+    deadline = time.monotonic() + args.duration
+    threads = [threading.Thread(target=client, args=(args, deadline, latencies, errors, n))
+               for n in range(args.clients)]
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+    lat = sorted(latencies)
+    print(f"clients={args.clients} duration={elapsed:.1f}s requests={len(lat)} errors={len(errors)}")
+    print(f"throughput={len(lat) / elapsed:.1f} req/s")
+    print("latency ms: p50={:.1f} p90={:.1f} p99={:.1f} max={:.1f}".format(
+        *(percentile(lat, p) * 1000 for p in (0.5, 0.9, 0.99)), (lat[-1] if lat else 0) * 1000))
+    if errors:
+        print(f"first errors: {errors[:5]}")
+
+if __name__ == "__main__":
+    main()
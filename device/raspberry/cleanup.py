@@ -1,22 +1,28 @@
 import os
-import sqlite3
 from datetime import datetime, UTC
 
-DB_PATH = "/home/pi/DYPLOM/device/raspberry/events.db"
+import storage
+import motion_intervals
+import raw_archive
+import room_state
+import timestamps
+
 RETENTION_DAYS = int(os.getenv("ALERT_RETENTION_DAYS", "7"))
 
 def log(msg):
     print(f"[{datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S')}] {msg}", flush=True)
 
 def main():
-    conn = sqlite3.connect(DB_PATH)
+    conn = storage.connect()
+    timestamps.ensure_schema(conn, log)
     cur = conn.cursor()
 
     cur.execute("""
         DELETE FROM alerts
         WHERE status='closed'
+          AND ts_ms < ?
           AND COALESCE(closed_at, ts_utc) < datetime('now', ?);
-    """, (f'-{RETENTION_DAYS} days',))
+    """, (timestamps.ago_ms(RETENTION_DAYS * 86400), f'-{RETENTION_DAYS} days'))
     deleted_alerts = cur.rowcount
 
     cur.execute("""
@@ -28,30 +34,41 @@ def main():
     conn.commit()
 
     RAW_DAYS = int(os.getenv("RAW_RETENTION_DAYS", "14"))
+    cutoff_ms = timestamps.ago_ms(RAW_DAYS * 86400)
     cur.execute("""
         DELETE FROM messages_raw
-        WHERE datetime(ts_utc) < datetime('now', ?);
-    """, (f'-{RAW_DAYS} days',))
+        WHERE ts_ms < ?;
+    """, (cutoff_ms,))
     deleted_raw = cur.rowcount
+    raw_cutoff = motion_intervals.iso_utc(motion_intervals.window_start(RAW_DAYS * 24 * 60))
+    deleted_raw += raw_archive.purge_before(conn, raw_cutoff)
 
     cur.execute("""
         DELETE FROM heartbeats
-        WHERE datetime(ts_utc) < datetime('now', ?);
-    """, (f'-{RAW_DAYS} days',))
+        WHERE ts_ms < ?;
+    """, (cutoff_ms,))
     deleted_hb = cur.rowcount
 
     cur.execute("""
         DELETE FROM motion_events
-        WHERE datetime(ts_utc) < datetime('now', ?);
-    """, (f'-{RAW_DAYS} days',))
+        WHERE ts_ms < ?;
+    """, (cutoff_ms,))
     deleted_motion = cur.rowcount
 
+    cur.execute("""
+        DELETE FROM motion_intervals
+        WHERE is_open = 0 AND end_utc < ?;
+    """, (raw_cutoff,))
+    deleted_intervals = cur.rowcount
+    room_state.purge_hourly(conn)
+
     conn.commit()
     conn.execute("VACUUM")
     conn.close()
 
     log(f"Cleanup done: alerts={deleted_alerts}, notif_log={deleted_notif}, "
-        f"raw={deleted_raw}, heartbeats={deleted_hb}, motion={deleted_motion}")
+        f"raw={deleted_raw}, heartbeats={deleted_hb}, motion={deleted_motion}, "
+        f"intervals={deleted_intervals}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,97 @@
+from datetime import timedelta
+
+import motion_intervals
+
+# One row per device with its latest heartbeat, upserted by the logger at
+# ingest time. Liveness checks (rules engine, /api/health/latest, /api/devices)
+# read it instead of MAX(ts_utc) over the whole heartbeats table.
+# A reboot is an uptime_ms that went backwards; boot_utc is derived from it.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS device_status (
+  device_id TEXT PRIMARY KEY,
+  last_seen_utc TEXT NOT NULL,
+  last_ip TEXT,
+  last_uptime_ms INTEGER,
+  boot_utc TEXT,
+  reboots INTEGER NOT NULL DEFAULT 0,
+  last_kept_utc TEXT              -- last heartbeat row written to heartbeats
+);
+"""
+
+def ensure_schema(con):
+    con.executescript(SCHEMA)
+
+def rebuild(con, log=print):
+    """Fill device_status from the heartbeats history once, if it is still empty."""
+    if con.execute("SELECT 1 FROM device_status LIMIT 1").fetchone():
+        return False
+    con.execute("""
+        INSERT INTO device_status(device_id, last_seen_utc, last_ip, last_uptime_ms, last_kept_utc)
+        SELECT h.device_id, replace(h.ts_utc, ' ', 'T'), h.ip, h.uptime_ms, replace(h.ts_utc, ' ', 'T')
+          FROM heartbeats h
+          JOIN (SELECT device_id, MAX(id) AS id FROM heartbeats GROUP BY device_id) m ON m.id = h.id
+    """)
+    con.commit()
+    n = con.execute("SELECT COUNT(*) FROM device_status").fetchone()[0]
+    if n:
+        log(f"[DEVICE_STATUS] rebuilt device_status for {n} device(s)")
+    return True
+
+def load(con):
+    """{device_id: [last_seen, ip, uptime_ms, last_kept]} for the logger's downsampling."""
+    rows = con.execute("SELECT device_id, last_seen_utc, last_ip, last_uptime_ms, last_kept_utc FROM device_status")
+    return {dev: [seen, ip, up, kept] for dev, seen, ip, up, kept in rows}
+
+def observe(state, ts_utc, dev, ip, uptime_ms, keep_every_sec):
+    """Fold one heartbeat into state; returns (keep_row, rebooted, boot_utc).
+
+    A row is kept for the first heartbeat of a device, on IP change, on reboot
+    and then at most once per keep_every_sec (0 keeps every heartbeat).
+    boot_utc is only set when it is (re)learned: first heartbeat or reboot."""
+    try:
+        uptime_ms = int(uptime_ms) if uptime_ms is not None else None
+    except (TypeError, ValueError):
+        uptime_ms = None
+    cur = state.get(dev)
+    if cur is None:
+        state[dev] = [ts_utc, ip, uptime_ms, ts_utc]
+        return True, False, boot_time(ts_utc, uptime_ms)
+    rebooted = uptime_ms is not None and cur[2] is not None and uptime_ms < cur[2]
+    keep = keep_every_sec <= 0 or rebooted or ip != cur[1]
+    if not keep:
+        kept = motion_intervals.parse_utc(cur[3])
+        now = motion_intervals.parse_utc(ts_utc)
+        keep = kept is None or now is None or (now - kept).total_seconds() >= keep_every_sec
+    cur[0], cur[1], cur[2] = ts_utc, ip, uptime_ms
+    if keep:
+        cur[3] = ts_utc
+    return keep, rebooted, boot_time(ts_utc, uptime_ms) if rebooted else None
+
+def boot_time(ts_utc, uptime_ms):
+    ts = motion_intervals.parse_utc(ts_utc)
+    if ts is None or uptime_ms is None:
+        return None
+    return motion_intervals.iso_utc(ts - timedelta(milliseconds=uptime_ms))
+
+def apply(con, rows):
+    """Upsert (device_id, ts, ip, uptime_ms, boot_utc, reboots, kept_ts) rows. Caller commits."""
+    if not rows:
+        return
+    con.executemany("""
+        INSERT INTO device_status(device_id, last_seen_utc, last_ip, last_uptime_ms,
+                                  boot_utc, reboots, last_kept_utc)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(device_id) DO UPDATE SET
+          last_seen_utc = excluded.last_seen_utc,
+          last_ip = excluded.last_ip,
+          last_uptime_ms = excluded.last_uptime_ms,
+          boot_utc = COALESCE(excluded.boot_utc, boot_utc),
+          reboots = reboots + excluded.reboots,
+          last_kept_utc = COALESCE(excluded.last_kept_utc, last_kept_utc)
+        WHERE excluded.last_seen_utc >= last_seen_utc
+    """, rows)
+
+def last_seen_all(con):
+    rows = con.execute("SELECT device_id, last_seen_utc FROM device_status")
+    return {dev: motion_intervals.parse_utc(ts) for dev, ts in rows}
@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import queue
+import urllib.request
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Notification dispatch: every (alert, channel) pair becomes a row in
+# notification_queue. Channels come from alerts.channels (comma separated),
+# falling back to NOTIFY_CHANNELS. Due rows are sent by a small worker pool per
+# channel, so a slow or unreachable channel only delays itself. Failures are
+# retried with exponential backoff until NOTIFY_MAX_ATTEMPTS, unless the sender
+# reports the failure as final; results are written back by the dispatcher
+# thread in one transaction per drain. Email rows remember the recipients that
+# already got the alert (delivered), so a retry does not send them a copy.
+
+DEFAULT_CHANNELS = os.getenv("NOTIFY_CHANNELS", "email")
+MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "8"))
+BACKOFF_SEC = float(os.getenv("NOTIFY_BACKOFF_SEC", "30"))
+BACKOFF_MAX_SEC = float(os.getenv("NOTIFY_BACKOFF_MAX_SEC", "3600"))
+WORKERS = {
+    "email": int(os.getenv("NOTIFY_WORKERS_EMAIL", "2")),
+    "webhook": int(os.getenv("NOTIFY_WORKERS_WEBHOOK", "4")),
+    "mqtt": int(os.getenv("NOTIFY_WORKERS_MQTT", "1")),
+}
+WEBHOOK_URL = os.getenv("NOTIFY_WEBHOOK_URL", "")
+WEBHOOK_TIMEOUT = float(os.getenv("NOTIFY_WEBHOOK_TIMEOUT", "10"))
+MQTT_HOST = os.getenv("NOTIFY_MQTT_HOST", "localhost")
+MQTT_PORT = int(os.getenv("NOTIFY_MQTT_PORT", "1883"))
+MQTT_USER = os.getenv("NOTIFY_MQTT_USER", "iot")
+MQTT_PASS = os.getenv("NOTIFY_MQTT_PASS", "iot")
+MQTT_TOPIC = os.getenv("NOTIFY_MQTT_TOPIC", "iot/eldercare/{room}/alert")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notification_queue (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  alert_id INTEGER NOT NULL,
+  channel TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'pending',   -- pending | sent | failed
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_at REAL NOT NULL,                    -- epoch seconds
+  last_error TEXT,
+  delivered TEXT,                           -- email: recipients reached, comma separated
+  UNIQUE (alert_id, channel)
+);
+CREATE INDEX IF NOT EXISTS idx_queue_pending ON notification_queue(next_at) WHERE status = 'pending';
+"""
+
+ALERT_COLUMNS = "a.id, COALESCE(a.rule, a.type) AS rule, a.room, a.device_id, a.details, a.severity, a.ts_utc"
+
+def ensure_schema(con):
+    con.executescript(SCHEMA)
+    if "delivered" not in {r[1] for r in con.execute("PRAGMA table_info(notification_queue)")}:
+        con.execute("ALTER TABLE notification_queue ADD COLUMN delivered TEXT")
+        con.commit()
+
+def log(msg):
+    print(f"[DISPATCH] {msg}", flush=True)
+
+def channels_of(value):
+    return [c.strip().lower() for c in (value or DEFAULT_CHANNELS).split(",") if c.strip()]
+
+def backoff(attempts):
+    return min(BACKOFF_MAX_SEC, BACKOFF_SEC * 2 ** max(0, attempts - 1))
+
+def send_webhook(alerts):
+    if not WEBHOOK_URL:
+        return False, "NOTIFY_WEBHOOK_URL not set"
+    body = json.dumps({"alerts": alerts}).encode("utf-8")
+    req = urllib.request.Request(WEBHOOK_URL, data=body, method="POST",
+                                 headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=WEBHOOK_TIMEOUT) as resp:
+            return 200 <= resp.status < 300, f"Webhook HTTP {resp.status}"
+    except Exception as e:
+        return False, f"Webhook failed: {e}"
+
+_mqtt = threading.local()
+
+def send_mqtt(alerts):
+    import paho.mqtt.client as mqtt  # only needed when the channel is used
+    try:
+        client = getattr(_mqtt, "client", None)
+        if client is None or not client.is_connected():
+            client = mqtt.Client()
+            client.username_pw_set(MQTT_USER, MQTT_PASS)
+            client.connect(MQTT_HOST, MQTT_PORT, 60)
+            client.loop_start()
+            _mqtt.client = client
+        for a in alerts:
+            info = client.publish(MQTT_TOPIC.format(room=a["room"] or "unknown", rule=a["rule"]),
+                                  json.dumps(a), qos=1)
+            info.wait_for_publish(timeout=10)
+            if not info.is_published():
+                return False, "MQTT publish not acknowledged"
+        return True, "MQTT published"
+    except Exception as e:
+        _mqtt.client = None
+        return False, f"MQTT failed: {e}"
+
+class Dispatcher:
+    """Owns the per-channel pools; all DB access stays on the caller's thread."""
+
+    def __init__(self, senders, digest_sec=0):
+        self.senders = senders          # {channel: fn(list of alert dicts) -> (ok, info[, final])}
+        self.digest_sec = digest_sec    # > 0: email rows wait and go out as one digest
+        self.workers = {ch: max(1, WORKERS.get(ch, 1)) for ch in senders}
+        self.pools = {ch: ThreadPoolExecutor(max_workers=n, thread_name_prefix=f"notify-{ch}")
+                      for ch, n in self.workers.items()}
+        self.inflight = {ch: 0 for ch in senders}
+        self.busy = set()               # queue row ids being sent
+        self.results = queue.Queue()
+
+    def enqueue_new(self, conn, now=None):
+        """Queue one row per channel for open alerts that were never queued."""
+        now = now or time.time()
+        rows = conn.execute("""
+            SELECT a.id, a.channels FROM alerts a
+             WHERE a.status = 'open' AND (a.notified_at IS NULL OR a.notified_at = '')
+               AND NOT EXISTS (SELECT 1 FROM notification_queue q WHERE q.alert_id = a.id)
+        """).fetchall()
+        jobs = []
+        for alert_id, channels in rows:
+            for ch in channels_of(channels):
+                delay = self.digest_sec if ch == "email" else 0
+                jobs.append((alert_id, ch, now + delay))
+        if jobs:
+            conn.executemany("INSERT OR IGNORE INTO notification_queue(alert_id, channel, next_at) VALUES (?, ?, ?)",
+                             jobs)
+            conn.commit()
+        return len(jobs)
+
+    def submit_due(self, conn, now=None):
+        """Hand due rows to their channel pools. In digest mode all pending email
+        rows go out together once the oldest one is due."""
+        now = now or time.time()
+        digest = self.digest_sec > 0
+        rows = conn.execute(f"""
+            SELECT q.id AS qid, q.channel, q.attempts, q.next_at, q.delivered, {ALERT_COLUMNS}
+              FROM notification_queue q JOIN alerts a ON a.id = q.alert_id
+             WHERE q.status = 'pending' AND (q.next_at <= ? OR (? AND q.channel = 'email'))
+          ORDER BY q.next_at
+        """, (now, digest)).fetchall()
+        batches = {}
+        for r in rows:
+            if r["qid"] in self.busy:
+                continue
+            batches.setdefault(r["channel"], []).append(r)
+        if digest and "email" in batches and batches["email"][0]["next_at"] > now:
+            del batches["email"]
+        submitted = 0
+        for ch, jobs in batches.items():
+            if ch not in self.senders:
+                for r in jobs:
+                    self.results.put((r["qid"], r["id"], ch, r["attempts"], False, f"unknown channel {ch}", True,
+                                      r["delivered"]))
+                continue
+            groups = [jobs] if ch == "email" and digest else [[r] for r in jobs]
+            for group in groups:
+                if self.inflight[ch] >= self.workers[ch]:
+                    break
+                self.inflight[ch] += 1
+                self.busy.update(r["qid"] for r in group)
+                self.pools[ch].submit(self._send, ch, group)
+                submitted += len(group)
+        return submitted
+
+    def _send(self, ch, group):
+        alerts = [{k: r[k] for k in ("id", "rule", "room", "device_id", "details", "severity", "ts_utc")}
+                  for r in group]
+        if ch == "email":
+            for a, r in zip(alerts, group):
+                a["delivered"] = [t for t in (r["delivered"] or "").split(",") if t]
+        try:
+            ok, info, *rest = self.senders[ch](alerts)
+        except Exception as e:
+            ok, info, rest = False, f"{ch} failed: {e}", []
+        final = bool(rest and rest[0])
+        for a, r in zip(alerts, group):
+            delivered = ",".join(a.get("delivered", ())) or r["delivered"]
+            self.results.put((r["qid"], r["id"], ch, r["attempts"], ok, info, final, delivered))
+        self.results.put((None, None, ch, None, None, None, None, None))  # frees the worker slot
+
+    def pending_results(self):
+        return not self.results.empty()
+
+    def drain(self, conn, now=None):
+        """Write finished sends back: queue rows, notifications_log, alerts.notified_at."""
+        now = now or time.time()
+        done, retry, failed, logs, notified = [], [], [], [], []
+        while True:
+            try:
+                qid, alert_id, ch, attempts, ok, info, final, delivered = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if qid is None:
+                self.inflight[ch] -= 1
+                continue
+            self.busy.discard(qid)
+            attempts += 1
+            logs.append((alert_id, ch, 1 if ok else 0, info))
+            if ok:
+                done.append((attempts, delivered, qid))
+                notified.append((alert_id,))
+            elif final or attempts >= MAX_ATTEMPTS:
+                failed.append((attempts, info, delivered, qid))
+                log(f"alert #{alert_id} via {ch} gave up after {attempts} attempt(s): {info}")
+            else:
+                retry.append((attempts, now + backoff(attempts), info, delivered, qid))
+        if not logs:
+            return 0
+        conn.executemany("""
+            UPDATE notification_queue SET status = 'sent', attempts = ?, last_error = NULL, delivered = ? WHERE id = ?
+        """, done)
+        conn.executemany("""
+            UPDATE notification_queue SET attempts = ?, next_at = ?, last_error = ?, delivered = ? WHERE id = ?
+        """, retry)
+        conn.executemany("""
+            UPDATE notification_queue SET status = 'failed', attempts = ?, last_error = ?, delivered = ? WHERE id = ?
+        """, failed)
+        conn.executemany("INSERT INTO notifications_log (alert_id, channel, ok, details) VALUES (?, ?, ?, ?)",
+                         logs)
+        conn.executemany("""
+            UPDATE alerts SET notified_at = datetime('now')
+             WHERE id = ? AND (notified_at IS NULL OR notified_at = '')
+        """, notified)
+        conn.commit()
+        return len(logs)
+
+    def next_due(self, conn):
+        """Epoch of the next pending row that is not being sent, or None."""
+        busy = self.busy
+        for qid, next_at in conn.execute(
+                "SELECT id, next_at FROM notification_queue WHERE status = 'pending' ORDER BY next_at"):
+            if qid not in busy:
+                return next_at
+        return None
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.shutdown(wait=True)
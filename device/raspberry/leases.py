@@ -0,0 +1,82 @@
+import zlib
+
+# Shard leases for a multi-process rules engine. Rooms and devices are split
+# into N shards by crc32; every shard has one row in engine_leases and only
+# the process whose lease is current evaluates it. A lease is renewed as the
+# first write of every rules cycle, so the alert changes of that cycle commit
+# in the same transaction as the renewal: a process that lost its lease
+# rolls back instead of writing. generation is bumped on every takeover and
+# acts as a fencing token. wanted_by lets a returning preferred owner ask a
+# standby that adopted its shard to hand it back.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS engine_leases (
+  shard INTEGER PRIMARY KEY,
+  owner TEXT,
+  expires_at REAL NOT NULL DEFAULT 0,   -- epoch seconds
+  generation INTEGER NOT NULL DEFAULT 0,
+  wanted_by TEXT
+);
+"""
+
+class LeaseLost(Exception):
+    """Raised by the engine when a renewal found a shard taken over; the cycle is rolled back."""
+
+def partition_of(key, count):
+    return zlib.crc32(key.encode("utf-8")) % count if count > 1 else 0
+
+def ensure_schema(con, count):
+    con.executescript(SCHEMA)
+    con.executemany("INSERT OR IGNORE INTO engine_leases(shard) VALUES (?)",
+                    [(i,) for i in range(count)])
+    con.commit()
+
+def acquire(con, shard, owner, ttl, now):
+    """Take the shard if it is free, expired or already ours; returns the generation or None."""
+    cur = con.execute("""
+        UPDATE engine_leases
+           SET owner = ?, expires_at = ?, generation = generation + 1, wanted_by = NULL
+         WHERE shard = ? AND (owner IS NULL OR owner = ? OR expires_at < ?)
+    """, (owner, now + ttl, shard, owner, now))
+    if cur.rowcount == 0:
+        return None
+    return con.execute("SELECT generation FROM engine_leases WHERE shard = ?", (shard,)).fetchone()[0]
+
+def renew(con, owned, owner, ttl, now):
+    """Extend every lease in owned {shard: generation}; returns the shards that were lost."""
+    lost = set()
+    for shard, generation in owned.items():
+        cur = con.execute("""
+            UPDATE engine_leases SET expires_at = ?
+             WHERE shard = ? AND owner = ? AND generation = ?
+        """, (now + ttl, shard, owner, generation))
+        if cur.rowcount == 0:
+            lost.add(shard)
+    return lost
+
+def release(con, shard, owner, now):
+    con.execute("UPDATE engine_leases SET owner = NULL, expires_at = ? WHERE shard = ? AND owner = ?",
+                (now, shard, owner))
+
+def want(con, shard, owner):
+    """Ask the current holder of shard to hand it back to owner."""
+    con.execute("UPDATE engine_leases SET wanted_by = ? WHERE shard = ? AND owner != ? AND wanted_by IS NOT ?",
+                (owner, shard, owner, owner))
+
+def wanted(con, owner):
+    """Shards held by owner that another process asked for."""
+    return {r[0] for r in con.execute(
+        "SELECT shard FROM engine_leases WHERE owner = ? AND wanted_by IS NOT NULL", (owner,))}
+
+def expired(con, owner, ttl, now):
+    """Shards free for adoption; one asked for by another process is left to it
+    unless that process did not pick it up within a TTL either."""
+    return [r[0] for r in con.execute("""
+        SELECT shard FROM engine_leases
+         WHERE (owner IS NULL OR expires_at < ?)
+           AND (wanted_by IS NULL OR wanted_by = ? OR expires_at < ?)
+      ORDER BY shard
+    """, (now, owner, now - ttl))]
+
+def status(con):
+    return con.execute("SELECT shard, owner, expires_at, generation, wanted_by FROM engine_leases ORDER BY shard").fetchall()
@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import secrets
+import threading
+from collections import deque
+
+import storage
+
+# Server-Sent Events feed for /api/stream. One thread per API process watches
+# PRAGMA data_version on its own connection and, only when another connection
+# committed, reads what changed: motion from motion_intervals (new episodes by
+# id, open ones diffed by sample count), room_state rows and open-room flags
+# (diffed against the last snapshot) and alerts that were opened, acknowledged
+# or closed (diffed against the open set). Motion comes from the intervals, not
+# motion_events, because the logger always writes them (LOGGER_MOTION_EVENTS=0
+# turns motion_events off): a new episode is a 1 at its start, a grown one a 1
+# at its latest report, a closed one a 0 at its end. Several reports between
+# two polls collapse into one event. Events
+# get ids "<boot>-<seq>" and go into one shared ring buffer; every client
+# blocks on a Condition and replays from its Last-Event-ID. A client that fell
+# out of the buffer, or reconnects after an API restart, gets a "reset" event
+# and should refetch. The boot id is unique per process: under gunicorn every
+# worker has its own buffer and sequence, so an id from another worker must
+# not be mistaken for one of ours.
+
+POLL_SEC = float(os.getenv("STREAM_POLL_SEC", "0.5"))
+BUFFER = int(os.getenv("STREAM_BUFFER", "2000"))
+KEEPALIVE_SEC = float(os.getenv("STREAM_KEEPALIVE_SEC", "15"))
+MOTION_BATCH = 500
+
+BOOT = f"{int(time.time()):x}.{os.getpid():x}.{secrets.token_hex(4)}"
+
+_cond = threading.Condition()
+_events = deque(maxlen=BUFFER)   # (seq, kind, payload)
+_seq = 0
+_thread = None
+
+def log(msg):
+    print(f"[STREAM] {msg}", flush=True)
+
+def publish(kind, payload):
+    global _seq
+    with _cond:
+        _seq += 1
+        _events.append((_seq, kind, payload))
+        _cond.notify_all()
+
+def parse_event_id(value):
+    """Sequence number to resume after; None if it belongs to another boot."""
+    boot, _, seq = value.partition("-")
+    if boot != BOOT or not seq.isdigit():
+        return None
+    return int(seq)
+
+def format_event(seq, kind, payload):
+    return f"id: {BOOT}-{seq}\nevent: {kind}\ndata: {json.dumps(payload)}\n\n"
+
+def _room_snapshot(con):
+    return {r["room"]: dict(r) for r in con.execute("""
+        SELECT s.room, s.last_motion_utc, s.device_count,
+               EXISTS(SELECT 1 FROM motion_intervals i
+                       WHERE i.is_open = 1 AND i.room = s.room) AS active_now
+          FROM room_state s
+    """)}
+
+def _motion(row, value, ts):
+    return {"id": row["id"], "ts_utc": ts, "device_id": row["device_id"],
+            "room": row["room"], "value": value}
+
+def _interval_changes(con, last_id, open_ivs):
+    """Motion events since the last poll. open_ivs {id: samples} is updated in place;
+    returns (events, newest interval id)."""
+    events = []
+    still_open = {}
+    ids = list(open_ivs)
+    if ids:
+        marks = ",".join("?" * len(ids))
+        for r in con.execute(f"""
+            SELECT id, device_id, room, start_utc, end_utc, is_open, samples
+              FROM motion_intervals WHERE id IN ({marks}) ORDER BY id
+        """, ids):
+            if not r["is_open"]:
+                events.append(_motion(r, 0, r["end_utc"]))
+                continue
+            if r["samples"] != open_ivs[r["id"]]:
+                events.append(_motion(r, 1, r["end_utc"]))
+            still_open[r["id"]] = r["samples"]
+    for r in con.execute("""
+        SELECT id, device_id, room, start_utc, end_utc, is_open, samples
+          FROM motion_intervals WHERE id > ? ORDER BY id LIMIT ?
+    """, (last_id, MOTION_BATCH)):
+        last_id = r["id"]
+        events.append(_motion(r, 1, r["start_utc"]))
+        if not r["is_open"]:
+            events.append(_motion(r, 0, r["end_utc"]))
+            continue
+        if r["samples"] > 1:
+            events.append(_motion(r, 1, r["end_utc"]))
+        still_open[r["id"]] = r["samples"]
+    open_ivs.clear()
+    open_ivs.update(still_open)
+    return events, last_id
+
+def _alert_rows(con, ids):
+    marks = ",".join("?" * len(ids))
+    return con.execute(f"""
+        SELECT id, ts_utc, room, device_id, COALESCE(rule, type) AS rule, severity, status,
+               details, ack_at, ack_by, closed_at
+          FROM alerts
+         WHERE status = 'open' {f"OR id IN ({marks})" if ids else ""}
+    """, tuple(ids)).fetchall()
+
+def _run():
+    con = storage.connect_ro()
+    rooms = version = None
+    while True:
+        try:
+            if rooms is None:
+                last_motion = con.execute("SELECT COALESCE(MAX(id), 0) FROM motion_intervals").fetchone()[0]
+                open_ivs = dict(con.execute(
+                    "SELECT id, samples FROM motion_intervals WHERE is_open = 1").fetchall())
+                alerts = {r["id"]: (r["status"], r["ack_at"]) for r in _alert_rows(con, [])}
+                rooms = _room_snapshot(con)
+            current = con.execute("PRAGMA data_version").fetchone()[0]
+            if current == version:
+                time.sleep(POLL_SEC)
+                continue
+            version = current
+
+            events, last_motion = _interval_changes(con, last_motion, open_ivs)
+            for event in events:
+                publish("motion", event)
+            if con.execute("SELECT 1 FROM motion_intervals WHERE id > ? LIMIT 1", (last_motion,)).fetchone():
+                version = None  # more than one batch behind: go again without sleeping
+
+            snap = _room_snapshot(con)
+            for room, row in snap.items():
+                if rooms.get(room) != row:
+                    publish("room", row)
+            rooms = snap
+
+            seen = {}
+            for r in _alert_rows(con, list(alerts)):
+                state = (r["status"], r["ack_at"])
+                before = alerts.get(r["id"])
+                if before != state:
+                    change = "opened" if before is None else "closed" if r["status"] != "open" else "acked"
+                    publish("alert", {**dict(r), "change": change})
+                if r["status"] == "open":
+                    seen[r["id"]] = state
+            alerts = seen
+        except Exception as e:
+            log(f"[ERROR] {e}")
+            time.sleep(POLL_SEC * 4)
+
+def start():
+    """Start the feed thread once per process (on the first subscriber)."""
+    global _thread
+    with _cond:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name="live-feed", daemon=True)
+            _thread.start()
+
+def subscribe(last_event_id=None):
+    """Generator of SSE text chunks for one client, replaying after last_event_id."""
+    start()
+    after = parse_event_id(last_event_id) if last_event_id else _seq
+    yield "retry: 3000\n\n"
+    if after is None:
+        with _cond:
+            after = _seq
+        yield format_event(after, "reset", {"reason": "unknown event id"})
+    while True:
+        with _cond:
+            if not _events or _events[-1][0] <= after:
+                _cond.wait(KEEPALIVE_SEC)
+            oldest = _events[0][0] if _events else _seq + 1
+            if after + 1 < oldest and after < _seq:
+                pending = [(_seq, "reset", {"reason": "fell behind"})]
+            else:
+                pending = [e for e in _events if e[0] > after]
+        if not pending:
+            yield ": keepalive\n\n"
+            continue
+        for seq, kind, payload in pending:
+            yield format_event(seq, kind, payload)
+        after = pending[-1][0]
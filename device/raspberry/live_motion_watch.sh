@@ -1,9 +1,43 @@
+
 DB="/home/pi/DYPLOM/device/raspberry/events.db"
+API="${API:-http://localhost:5000}"
+API_TOKEN="${API_TOKEN:-}"
 
 echo "🔴 Starting Live Motion Stream..."
 echo "Press Ctrl+C to stop."
 echo
 
+show() {
+    local ts=$1 dev=$2 val=$3
+    if [[ "$val" == "1" ]]; then
+        echo -e "🟢 [$ts] Motion detected on $dev"
+    else
+        echo -e "⚪ [$ts] No motion on $dev"
+    fi
+}
+
+# Preferred: follow the API's /api/stream (one shared feed, no DB polling).
+if command -v curl >/dev/null && curl -sf -o /dev/null -H "X-API-Key: $API_TOKEN" "$API/api/rule-settings"; then
+    echo "(following $API/api/stream)"
+    event=""
+    curl -sN -H "X-API-Key: $API_TOKEN" "$API/api/stream" | while IFS= read -r line; do
+        case "$line" in
+            event:*) event="${line#event: }" ;;
+            data:*)
+                if [[ "$event" == "motion" ]]; then
+                    data="${line#data: }"
+                    ts=$(sed -n 's/.*"ts_utc": "\([^"]*\)".*/\1/p' <<< "$data")
+                    dev=$(sed -n 's/.*"device_id": "\([^"]*\)".*/\1/p' <<< "$data")
+                    val=$(sed -n 's/.*"value": \([0-9]*\).*/\1/p' <<< "$data")
+                    show "$ts" "$dev" "$val"
+                fi
+                ;;
+        esac
+    done
+    exit 0
+fi
+
+# Fallback when the API is not running: poll the database directly.
 last_id=0
 
 while true; do
@@ -11,13 +45,8 @@ while true; do
     if [[ -n "$rows" ]]; then
         while IFS='|' read -r id ts dev val; do
             last_id=$id
-            if [[ "$val" == "1" ]]; then
-                echo -e "🟢 [$ts] Motion detected on $dev"
-            else
-                echo -e "⚪ [$ts] No motion on $dev"
-            fi
+            show "$ts" "$dev" "$val"
         done <<< "$rows"
     fi
     sleep 0.5
 done
-
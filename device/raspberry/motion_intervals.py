@@ -0,0 +1,182 @@
+from datetime import datetime, timedelta, UTC
+
+# Run-length encoded motion: one row per motion episode instead of one row per
+# reported state. A 1 opens (or extends) the device's interval, a 0 closes it
+# (a 0 with no open interval is dropped).
+# end_utc is the time of the last report that belonged to the interval, so
+# MAX(end_utc) per room is the "last motion" the rules engine works with.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS motion_intervals (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  device_id TEXT NOT NULL,
+  room TEXT,
+  start_utc TEXT NOT NULL,
+  end_utc TEXT NOT NULL,
+  is_open INTEGER NOT NULL DEFAULT 1,
+  samples INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_intervals_room_end ON motion_intervals(room, end_utc);
+CREATE INDEX IF NOT EXISTS idx_intervals_open ON motion_intervals(device_id) WHERE is_open = 1;
+CREATE INDEX IF NOT EXISTS idx_intervals_open_room ON motion_intervals(room) WHERE is_open = 1;
+"""
+
+ISO = "%Y-%m-%dT%H:%M:%S"
+
+def iso_utc(dt):
+    """Format an aware/naive UTC datetime the way the logger stores ts_utc."""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(UTC).replace(tzinfo=None)
+    return dt.strftime(ISO)
+
+def parse_utc(ts):
+    if not ts:
+        return None
+    try:
+        dt = datetime.fromisoformat(ts)
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=UTC)
+    return dt.astimezone(UTC)
+
+def ensure_schema(con):
+    con.executescript(SCHEMA)
+
+def load_open(con):
+    """{device_id: (interval_id, room)} for intervals that are still open."""
+    rows = con.execute("SELECT id, device_id, room FROM motion_intervals WHERE is_open = 1")
+    return {dev: (iid, room) for iid, dev, room in rows}
+
+def apply_edge(con, open_map, ts_utc, device_id, room, value, shared=False):
+    """Fold one motion report into motion_intervals; open_map is updated in place.
+    shared: other ingest workers write intervals too (a device that changed rooms
+    may have been handled by another partition)."""
+    cur = open_map.get(device_id)
+    if cur is not None and cur[1] != room:
+        # device moved to another room: close the old episode first
+        con.execute("UPDATE motion_intervals SET is_open = 0 WHERE id = ?", (cur[0],))
+        open_map.pop(device_id)
+        cur = None
+
+    if value:
+        if cur is not None and con.execute("""
+            UPDATE motion_intervals SET end_utc = ?, samples = samples + 1 WHERE id = ? AND is_open = 1
+        """, (ts_utc, cur[0])).rowcount:
+            return
+        if shared:
+            # an episode left open by another ingest worker must not stay open next to the new one
+            con.execute("UPDATE motion_intervals SET is_open = 0 WHERE device_id = ? AND is_open = 1",
+                        (device_id,))
+        c = con.execute("""
+            INSERT INTO motion_intervals(device_id, room, start_utc, end_utc, is_open, samples)
+            VALUES (?, ?, ?, ?, 1, 1)
+        """, (device_id, room, ts_utc, ts_utc))
+        open_map[device_id] = (c.lastrowid, room)
+    elif cur is not None:
+        con.execute("""
+            UPDATE motion_intervals SET end_utc = ?, is_open = 0, samples = samples + 1 WHERE id = ?
+        """, (ts_utc, cur[0]))
+        open_map.pop(device_id)
+    # a 0 without a preceding 1 (e.g. after a reboot) is not an episode: skipped
+
+def backfill(con, log=print):
+    """Build motion_intervals from motion_events once, if it is still empty."""
+    con.commit()
+    con.execute("BEGIN IMMEDIATE")  # logger and rules engine may both get here at startup
+    if con.execute("SELECT 1 FROM motion_intervals LIMIT 1").fetchone():
+        con.rollback()
+        return 0
+    rows = con.execute("""
+        SELECT m.ts_utc, m.device_id, d.room, m.value
+          FROM motion_events m
+     LEFT JOIN devices d ON d.device_id = m.device_id
+      ORDER BY m.id
+    """)
+    open_map = {}
+    n = 0
+    for ts, dev, room, value in rows.fetchall():
+        apply_edge(con, open_map, ts.replace(" ", "T"), dev, room, value)
+        n += 1
+    con.commit()
+    if n:
+        log(f"[INTERVALS] backfilled motion_intervals from {n} motion_events")
+    return n
+
+def last_motion(con, room):
+    row = con.execute("SELECT MAX(end_utc) FROM motion_intervals WHERE room = ?", (room,)).fetchone()
+    return parse_utc(row[0]) if row else None
+
+def last_motion_by_room(con):
+    rows = con.execute("SELECT room, MAX(end_utc) FROM motion_intervals GROUP BY room")
+    return {room: parse_utc(ts) for room, ts in rows if room}
+
+def last_start_by_room(con, since):
+    """Newest report of value 1 per room at or after since. An open episode's end
+    is its latest 1; a closed one ended with a 0, so only its start is known to be a 1."""
+    rows = con.execute("""
+        SELECT room, MAX(CASE WHEN is_open = 1 THEN end_utc ELSE start_utc END)
+          FROM motion_intervals
+         WHERE end_utc >= ? AND (is_open = 1 OR start_utc >= ?)
+      GROUP BY room
+    """, (iso_utc(since), iso_utc(since)))
+    return {room: parse_utc(ts) for room, ts in rows if room}
+
+def is_active(con, room):
+    row = con.execute("""
+        SELECT 1 FROM motion_intervals WHERE is_open = 1 AND room = ? LIMIT 1
+    """, (room,)).fetchone()
+    return row is not None
+
+def samples_in(start_utc, end_utc, samples, since):
+    """Reports of one episode at or after since. The end report is counted exactly;
+    for an episode that started before since, only the reports between its first
+    and last one are prorated by overlap (assumed evenly spread)."""
+    start, end = parse_utc(start_utc), parse_utc(end_utc)
+    if end < since:
+        return 0.0
+    if start >= since or end <= start:
+        return float(samples)
+    interior = max(0, samples - 2)
+    return 1 + interior * (end - since).total_seconds() / (end - start).total_seconds()
+
+def samples_since(con, room, since):
+    """Number of motion reports (0 and 1) in [since, now]."""
+    rows = con.execute("""
+        SELECT start_utc, end_utc, samples FROM motion_intervals
+         WHERE room = ? AND end_utc >= ?
+    """, (room, iso_utc(since))).fetchall()
+    return round(sum(samples_in(start, end, n, since) for start, end, n in rows))
+
+def samples_by_room(con, since_iso):
+    """(room, start_utc, end_utc, samples) of episodes ending at or after since_iso;
+    cut each one with samples_in()."""
+    return con.execute("""
+        SELECT room, start_utc, end_utc, samples FROM motion_intervals WHERE end_utc >= ?
+    """, (since_iso,)).fetchall()
+
+def motion_seconds(con, room, since, now=None):
+    """Seconds of motion in [since, now]; open intervals count up to now."""
+    now = now or datetime.now(UTC)
+    rows = con.execute("""
+        SELECT start_utc, end_utc, is_open FROM motion_intervals
+         WHERE room = ? AND (end_utc >= ? OR is_open = 1)
+    """, (room, iso_utc(since))).fetchall()
+    total = 0.0
+    for start, end, is_open in rows:
+        s = max(parse_utc(start), since)
+        e = now if is_open else min(parse_utc(end), now)
+        if e > s:
+            total += (e - s).total_seconds()
+    return total
+
+def recent(con, limit=20):
+    return con.execute("""
+        SELECT device_id, room, start_utc, end_utc, is_open
+          FROM motion_intervals
+      ORDER BY id DESC
+         LIMIT ?
+    """, (limit,)).fetchall()
+
+def window_start(minutes, now=None):
+    return (now or datetime.now(UTC)) - timedelta(minutes=minutes)
@@ -1,16 +1,78 @@
-import os, re, json, sqlite3, time
+import os, re, json, sqlite3, time, queue, signal, threading, zlib, argparse
+import multiprocessing
 from datetime import datetime, UTC
 import paho.mqtt.client as mqtt
 
-DB_PATH = "/home/pi/DYPLOM/device/raspberry/events.db"
+import storage
+import motion_intervals
+import raw_archive
+import spool
+import room_state
+import device_status
+import timestamps
+
 BROKER_HOST = "localhost"
 BROKER_PORT = 1883
 TOPICS = [("iot/eldercare/+/motion/#", 0)]
 MQTT_USER="iot"
 MQTT_PASS="iot"
 
-def db_connect():
-    return sqlite3.connect(DB_PATH, timeout=10)
+# Ingest pipeline: on_message only parses and enqueues, a single writer thread
+# drains the queue and commits in batches (flush on size or on time limit).
+BATCH_MAX = int(os.getenv("LOGGER_BATCH_MAX", "500"))
+FLUSH_MS = int(os.getenv("LOGGER_FLUSH_MS", "200"))
+QUEUE_MAX = int(os.getenv("LOGGER_QUEUE_MAX", "50000"))
+VERBOSE = os.getenv("LOGGER_VERBOSE", "1") == "1"
+# motion_intervals is always maintained; the per-report motion_events log
+# can be switched off once nothing reads it any more.
+KEEP_MOTION_EVENTS = os.getenv("LOGGER_MOTION_EVENTS", "1") == "1"
+
+# Device/room registry: rooms/devices are only written when a device is new
+# or its room changed. Reloaded periodically to pick up API-side changes.
+REGISTRY_REFRESH_SEC = int(os.getenv("LOGGER_REGISTRY_REFRESH_SEC", "60"))
+TOPIC_CACHE_MAX = 10000
+_TOPIC_RE = re.compile(r"^iot/eldercare/([^/]+)/")
+_topic_rooms = {}
+_known_rooms = set()
+_device_rooms = {}
+_registry_loaded_at = 0.0
+_open_intervals = None  # {device_id: (interval_id, room)}, None = reload
+
+# Heartbeat downsampling: device_status always gets the latest heartbeat, the
+# heartbeats history only keeps a row on first sight, IP change, reboot or
+# once per LOGGER_HB_KEEP_MIN minutes (0 = keep every heartbeat).
+HB_KEEP_MIN = float(os.getenv("LOGGER_HB_KEEP_MIN", "10"))
+_device_state = None  # device_status.load() cache, None = reload
+
+# Disk spool: if a batch cannot be written within LOGGER_WRITE_BUDGET_MS (DB
+# locked by VACUUM, API writes...) it is appended to an on-disk segment and
+# replayed in order once the lock clears. LOGGER_SPOOL=0 restores blocking retries.
+SPOOL_ENABLED = os.getenv("LOGGER_SPOOL", "1") == "1"
+WRITE_BUDGET_MS = int(os.getenv("LOGGER_WRITE_BUDGET_MS", "250"))
+SPOOL_RETRY_SEC = float(os.getenv("LOGGER_SPOOL_RETRY_SEC", "5"))
+_spool = None
+
+# Worker pool (--workers N): every worker process has its own queue, writer
+# and spool. With PARTITION=hash the pool process holds the only MQTT
+# subscription and routes each raw message to the worker owning
+# crc32(room) % N, so the broker sends every message once, it is parsed once,
+# and a device is always handled by one process in arrival order.
+# PARTITION=share gives each worker its own client on an MQTT 5 / mosquitto
+# shared subscription instead; the broker balances per message, so per-device
+# order is not kept. SQLite still has a single writer: workers wait for each
+# other's commits, so in a pool the wait before spooling is
+# LOGGER_WRITE_BUDGET_MS x N. More workers help when parsing, not writing, is
+# the bottleneck.
+PARTITION = os.getenv("LOGGER_PARTITION", "hash")
+SHARE_GROUP = os.getenv("LOGGER_SHARE_GROUP", "loggers")
+_worker = (0, 1)  # (index, count)
+
+_queue = queue.Queue(maxsize=QUEUE_MAX)
+_stop = threading.Event()
+_STOP = object()
+
+def db_connect(busy_timeout=None):
+    return storage.connect(row_factory=None, busy_timeout=busy_timeout)
 
 def init_db_minimal():
     conn = db_connect(); cur = conn.cursor()
@@ -37,53 +99,94 @@ def init_db_minimal():
         value INTEGER NOT NULL CHECK (value IN (0,1))
     )""")
     cur.execute("""CREATE INDEX IF NOT EXISTS idx_motion_dev_ts ON motion_events(device_id, ts_utc)""")
-    conn.commit(); conn.close()
+    conn.commit()
+    motion_intervals.ensure_schema(conn)
+    motion_intervals.backfill(conn)
+    raw_archive.ensure_schema(conn)
+    timestamps.ensure_schema(conn)
+    room_state.ensure_schema(conn)
+    room_state.rebuild(conn)
+    device_status.ensure_schema(conn)
+    device_status.rebuild(conn)
+    conn.execute("CREATE TABLE IF NOT EXISTS spool_replayed(segment TEXT PRIMARY KEY)")
+    conn.commit()
+    conn.close()
 
-def upsert_device_and_room(conn, topic, device_id):
-    m = re.match(r"^iot/eldercare/([^/]+)/", topic)
+def topic_room(topic):
+    """Room name from the topic; parsed once per distinct topic."""
+    try:
+        return _topic_rooms[topic]
+    except KeyError:
+        pass
+    m = _TOPIC_RE.match(topic)
     room_name = m.group(1) if m else None
+    if len(_topic_rooms) >= TOPIC_CACHE_MAX:
+        _topic_rooms.clear()
+    _topic_rooms[topic] = room_name
+    return room_name
+
+def load_registry(conn):
+    """(Re)load the known rooms and device->room mapping into memory."""
+    global _registry_loaded_at
+    _known_rooms.clear()
+    _device_rooms.clear()
+    _known_rooms.update(r[0] for r in conn.execute("SELECT name FROM rooms"))
+    _device_rooms.update(conn.execute("SELECT device_id, room FROM devices"))
+    _registry_loaded_at = time.monotonic()
+
+def invalidate_registry():
+    """Forget cached mappings (e.g. after a rollback); they are re-upserted."""
+    global _registry_loaded_at, _open_intervals, _device_state
+    _known_rooms.clear()
+    _device_rooms.clear()
+    _registry_loaded_at = 0.0
+    _open_intervals = None
+    _device_state = None
+    raw_archive.forget_topics()
+
+def upsert_device_and_room(conn, topic, device_id):
+    room_name = topic_room(topic)
     if not device_id or not room_name:
         return
+    if _device_rooms.get(device_id) == room_name:
+        return
     cur = conn.cursor()
-    cur.execute("INSERT OR IGNORE INTO rooms(name) VALUES(?)", (room_name,))
+    if room_name not in _known_rooms:
+        cur.execute("INSERT OR IGNORE INTO rooms(name) VALUES(?)", (room_name,))
+        _known_rooms.add(room_name)
     cur.execute("""
         INSERT INTO devices(device_id, room)
         VALUES(?, ?)
         ON CONFLICT(device_id) DO UPDATE SET room=excluded.room
     """, (device_id, room_name))
-    conn.commit()
+    _device_rooms[device_id] = room_name
 
 
-def insert_raw(conn, ts_utc, topic, device_id, payload):
-    conn.execute(
-        "INSERT INTO messages_raw(ts_utc, topic, device_id, payload) VALUES(?,?,?,?)",
-        (ts_utc, topic, device_id, payload))
+def insert_raw(conn, rows):
+    raw_archive.store(conn, rows)
 
-def insert_hb(conn, ts_utc, device_id, ip, uptime_ms):
-    conn.execute(
-        "INSERT INTO heartbeats(ts_utc, device_id, ip, uptime_ms) VALUES(?,?,?,?)",
-        (ts_utc, device_id, ip, uptime_ms))
+def insert_hb(conn, rows):
+    conn.executemany(
+        "INSERT INTO heartbeats(ts_utc, device_id, ip, uptime_ms, ts_ms) VALUES(?,?,?,?,?)",
+        [(*r, timestamps.to_ms(r[0])) for r in rows])
 
-def insert_motion(conn, ts_utc, device_id, value):
-    conn.execute(
-        "INSERT INTO motion_events(ts_utc, device_id, value) VALUES(?,?,?)",
-        (ts_utc, device_id, int(value)))
+def insert_motion(conn, rows):
+    conn.executemany(
+        "INSERT INTO motion_events(ts_utc, device_id, value, ts_ms) VALUES(?,?,?,?)",
+        [(*r, timestamps.to_ms(r[0])) for r in rows])
 
 def utc_now_naive_iso():
     return datetime.now(UTC).replace(tzinfo=None).isoformat(timespec="seconds")
 
-def on_connect(client, userdata, flags, rc):
-    print("MQTT connected rc=", rc)
-    for t, q in TOPICS:
-        client.subscribe(t)
-        print("Subscribed:", t)
-
-def on_message(client, userdata, msg):
-    ts_utc = utc_now_naive_iso()
-    payload_str = msg.payload.decode("utf-8", "ignore")
-    topic = msg.topic
-    print(f"[MQTT] {topic} => {payload_str}")
+def parse_motion(motion_raw):
+    if isinstance(motion_raw, bool):
+        return 1 if motion_raw else 0
+    if isinstance(motion_raw, str):
+        return 1 if motion_raw.lower() in ("1", "true", "on") else 0
+    return int(motion_raw) if motion_raw is not None else 0
 
+def parse_record(ts_utc, topic, payload_str):
+    """Turn one MQTT message into a record for the writer (no DB access here)."""
     device_id = None
     try:
         data = json.loads(payload_str)
@@ -92,64 +195,412 @@ def on_message(client, userdata, msg):
     except Exception:
         data = None
 
-    conn = db_connect()
+    rec = {"ts": ts_utc, "topic": topic, "device_id": device_id,
+           "payload": payload_str, "kind": None, "dev": None}
+
+    if topic.endswith("/motion/health") and isinstance(data, dict):
+        dev = data.get("device")
+        if dev:
+            rec.update(kind="hb", dev=dev, ip=data.get("ip"), uptime_ms=data.get("uptime_ms"))
+
+    elif topic.endswith("/motion/state") and isinstance(data, dict):
+        dev = data.get("device")
+        if not dev:
+            parts = topic.split("/")
+            if len(parts) >= 3:
+                dev = parts[2]
+        if dev:
+            try:
+                rec.update(kind="motion", dev=dev, motion=parse_motion(data.get("motion")))
+            except (TypeError, ValueError) as e:
+                print("[LOGGER] bad motion value:", e)
+    return rec
+
+def write_batch(conn, batch):
+    """Write a batch of parsed records; the caller commits."""
+    global _open_intervals, _device_state
+    if _open_intervals is None:
+        _open_intervals = motion_intervals.load_open(conn)
+    if _device_state is None:
+        _device_state = device_status.load(conn)
+    raw_rows, hb_rows, motion_rows = [], [], []
+    room_motion, room_hours, room_hb = {}, {}, {}
+    status = {}
+    for rec in batch:
+        raw_rows.append((rec["ts"], rec["topic"], rec["device_id"], rec["payload"]))
+        if rec["kind"] is None:
+            continue
+        upsert_device_and_room(conn, rec["topic"], rec["dev"])
+        room = topic_room(rec["topic"])
+        if rec["kind"] == "hb":
+            dev = rec["dev"]
+            keep, rebooted, boot = device_status.observe(
+                _device_state, rec["ts"], dev, rec["ip"], rec["uptime_ms"], HB_KEEP_MIN * 60)
+            if keep:
+                hb_rows.append((rec["ts"], dev, rec["ip"], rec["uptime_ms"]))
+            if rebooted and VERBOSE:
+                print(f"[LOGGER] reboot detected: {dev}")
+            prev = status.get(dev)
+            status[dev] = (dev, rec["ts"], rec["ip"], rec["uptime_ms"],
+                           boot or (prev[4] if prev else None),
+                           int(rebooted) + (prev[5] if prev else 0),
+                           rec["ts"] if keep else (prev[6] if prev else None))
+            if room:
+                room_hb[room] = max(room_hb.get(room, ""), rec["ts"])
+        else:
+            motion_rows.append((rec["ts"], rec["dev"], rec["motion"]))
+            motion_intervals.apply_edge(conn, _open_intervals, rec["ts"], rec["dev"],
+                                        room, rec["motion"], shared=_worker[1] > 1)
+            if room:
+                room_motion[room] = max(room_motion.get(room, ""), rec["ts"])
+                key = (room, room_state.hour_key(rec["ts"]))
+                room_hours[key] = room_hours.get(key, 0) + 1
+
+    insert_raw(conn, raw_rows)
+    insert_hb(conn, hb_rows)
+    if KEEP_MOTION_EVENTS:
+        insert_motion(conn, motion_rows)
+    room_state.apply(conn, room_motion, room_hours, room_hb)
+    device_status.apply(conn, list(status.values()))
+    return len(raw_rows), len(hb_rows), len(motion_rows)
+
+def db_busy(e):
+    """True for the transient SQLITE_BUSY / SQLITE_LOCKED errors worth retrying."""
+    msg = str(e).lower()
+    return isinstance(e, sqlite3.OperationalError) and ("locked" in msg or "busy" in msg)
+
+def write_each(conn, batch):
+    """Fallback for a batch that failed with a non-lock error: skip only bad records."""
+    for rec in batch:
+        try:
+            write_batch(conn, [rec])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            invalidate_registry()
+            print("[LOGGER] DB error, record dropped:", e, rec["topic"])
+
+def flush(conn, batch):
+    if _spool is not None and _spool.pending():
+        # backlog on disk: keep arrival order by queueing behind it
+        _spool.append(batch)
+        return
+    while True:
+        try:
+            n_raw, n_hb, n_motion = write_batch(conn, batch)
+            conn.commit()
+            if VERBOSE:
+                print(f"[LOGGER] batch committed: raw={n_raw}, heartbeats={n_hb}, motion={n_motion}")
+            return
+        except Exception as e:
+            conn.rollback()
+            invalidate_registry()
+            if not db_busy(e):
+                print("[LOGGER] DB error in batch, falling back to per-record writes:", e)
+                write_each(conn, batch)
+                return
+            # locked / busy: spool the batch (or retry without a spool), nothing is dropped
+            if _spool is not None:
+                print(f"[LOGGER] DB busy ({e}), spooling {len(batch)} record(s) to disk")
+                _spool.append(batch)
+                return
+            print("[LOGGER] DB busy, retrying batch:", e)
+            time.sleep(0.5)
+
+def replay_spool(conn):
+    """Drain spooled segments into SQLite oldest-first. False if the DB is still locked."""
+    _spool.seal()
+    for name in _spool.segments():
+        try:
+            records = _spool.read(name)
+        except OSError as e:
+            print(f"[LOGGER] spool segment {name} unreadable, retrying later: {e}")
+            return False
+        try:
+            done = conn.execute("SELECT 1 FROM spool_replayed WHERE segment=?", (name,)).fetchone()
+            if not done:
+                write_batch(conn, records)
+                # marker in the same transaction: a crash before the file is
+                # removed cannot replay the segment twice
+                conn.execute("INSERT INTO spool_replayed(segment) VALUES(?)", (name,))
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            invalidate_registry()
+            if db_busy(e):
+                print(f"[LOGGER] spool replay deferred, DB still busy: {e} "
+                      f"(depth={_spool.depth}, age={_spool.age_sec()}s)")
+                return False
+            print("[LOGGER] spool replay error, writing segment per record:", e)
+            write_each(conn, records)
+        _spool.remove(name, len(records))
+        try:
+            conn.execute("DELETE FROM spool_replayed WHERE segment=?", (name,))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+        print(f"[LOGGER] spool segment {name} replayed ({len(records)} records, "
+              f"depth={_spool.depth})")
+    return True
+
+def writer_loop():
+    # workers of a pool take turns on the one SQLite write lock
+    conn = db_connect(busy_timeout=WRITE_BUDGET_MS * _worker[1] if _spool is not None else None)
+    batch = []
+    deadline = None
+    next_replay = 0.0
     try:
-        insert_raw(conn, ts_utc, topic, device_id, payload_str)
-
-        if topic.endswith("/motion/health") and isinstance(data, dict):
-            dev = data.get("device")
-            if dev:
-                upsert_device_and_room(conn, topic, dev)
-                insert_hb(conn, ts_utc, dev, data.get("ip"), data.get("uptime_ms"))
-                print(f"[LOGGER] heartbeat from {dev}")
-
-        elif topic.endswith("/motion/state") and isinstance(data, dict):
-            dev = data.get("device")
-            if not dev:
-                parts = topic.split("/")
-                if len(parts) >= 3:
-                    dev = parts[2]
-
-            if dev:
-                upsert_device_and_room(conn, topic, dev)
-                motion_raw = data.get("motion")
-
-                if isinstance(motion_raw, bool):
-                    motion = 1 if motion_raw else 0
-                elif isinstance(motion_raw, str):
-                    motion = 1 if motion_raw.lower() in ("1", "true", "on") else 0
-                else:
-                    motion = int(motion_raw) if motion_raw is not None else 0
-
-                insert_motion(conn, ts_utc, dev, motion)
-                print(f"[LOGGER] motion_event inserted: dev={dev}, motion={motion}")
-
-        conn.commit()
-    except Exception as e:
-        print("[LOGGER] DB error:", e)
+        while True:
+            if time.monotonic() - _registry_loaded_at > REGISTRY_REFRESH_SEC and not batch:
+                try:
+                    load_registry(conn)
+                    room_state.purge_hourly(conn)
+                    conn.commit()
+                except sqlite3.Error as e:
+                    conn.rollback()
+                    invalidate_registry()
+                    print("[LOGGER] registry reload failed:", e)
+            if _spool is not None and _spool.pending() and not batch \
+                    and time.monotonic() >= next_replay:
+                if not replay_spool(conn):
+                    next_replay = time.monotonic() + SPOOL_RETRY_SEC
+
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if _spool is not None and _spool.pending():
+                wait_replay = max(0.0, next_replay - time.monotonic())
+                timeout = wait_replay if timeout is None else min(timeout, wait_replay)
+            try:
+                item = _queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                break
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + FLUSH_MS / 1000.0
+
+            if batch and (len(batch) >= BATCH_MAX or time.monotonic() >= deadline):
+                flush(conn, batch)
+                batch, deadline = [], None
+
+        # drain whatever is still queued before exiting
+        while True:
+            try:
+                item = _queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+        if batch:
+            flush(conn, batch)
+        if _spool is not None and _spool.pending():
+            # last attempt; anything left stays on disk and is replayed on next start
+            replay_spool(conn)
     finally:
+        if _spool is not None:
+            _spool.close()
         conn.close()
 
+def partition_of(room, count):
+    """Stable room -> worker index (crc32, identical in every process)."""
+    if count <= 1 or not room:
+        return 0
+    return zlib.crc32(room.encode("utf-8")) % count
 
-def main():
-    if not os.path.exists(DB_PATH):
-        print("DB not found, creating:", DB_PATH)
-        open(DB_PATH, "a").close()
-    init_db_minimal()
+def subscriptions():
+    if _worker[1] > 1 and PARTITION == "share":
+        return [(f"$share/{SHARE_GROUP}/{t}", q) for t, q in TOPICS]
+    return TOPICS
 
-    client = mqtt.Client()
-    client.username_pw_set(MQTT_USER, MQTT_PASS)
-    client.on_connect = on_connect
-    client.on_message = on_message
+def on_connect(client, userdata, flags, rc):
+    print("MQTT connected rc=", rc)
+    for t, q in subscriptions():
+        client.subscribe(t, q)
+        print("Subscribed:", t)
+
+def enqueue(ts_utc, topic, payload_str):
+    if VERBOSE:
+        print(f"[MQTT] {topic} => {payload_str}")
+    # blocks when the queue is full: back-pressure instead of losing messages
+    _queue.put(parse_record(ts_utc, topic, payload_str))
+
+def on_message(client, userdata, msg):
+    enqueue(utc_now_naive_iso(), msg.topic, msg.payload.decode("utf-8", "ignore"))
+
+def replay_capture(path, deliver):
+    """Broker stand-in: feed a JSONL capture of {"topic", "payload"} lines to
+    deliver(ts, topic, payload), the same path live MQTT messages take."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if _stop.is_set():
+                break
+            if not line.strip():
+                continue
+            m = json.loads(line)
+            payload = m["payload"] if isinstance(m["payload"], str) else json.dumps(m["payload"])
+            deliver(m.get("ts") or utc_now_naive_iso(), m["topic"], payload)
 
+def drain_inbox(inbox):
+    """Worker side of hash routing: parse and enqueue until the pool sends None
+    (or, after SIGTERM, until the inbox is empty)."""
     while True:
         try:
-            client.connect(BROKER_HOST, BROKER_PORT, 60)
-            client.loop_forever()
-        except Exception as e:
-            print("MQTT connect error:", e)
+            item = inbox.get(timeout=0.5)
+        except queue.Empty:
+            if _stop.is_set():
+                return
+            continue
+        if item is None:
+            return
+        enqueue(*item)
+
+def run_worker(index=0, count=1, replay=None, inbox=None):
+    global _spool, _worker
+    _worker = (index, count)
+    tag = f"[LOGGER {index + 1}/{count}]" if count > 1 else "[LOGGER]"
+
+    if SPOOL_ENABLED:
+        spool_dir = spool.default_dir(storage.DB_PATH)
+        if count > 1:
+            spool_dir = os.path.join(spool_dir, f"worker-{index}")
+        _spool = spool.Spool(spool_dir)
+        if _spool.pending():
+            print(f"{tag} spool backlog found: {_spool.status()}")
+
+    writer = threading.Thread(target=writer_loop, name="db-writer")
+    writer.start()
+
+    client = None
+    if not replay and inbox is None:
+        client = mqtt.Client(client_id=f"mqtt-logger-{index}" if count > 1 else "")
+        client.username_pw_set(MQTT_USER, MQTT_PASS)
+        client.on_connect = on_connect
+        client.on_message = on_message
+
+    def shutdown(signum, frame):
+        print(f"{tag} shutdown requested, flushing queue...")
+        _stop.set()
+        if client is not None:
+            client.disconnect()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    try:
+        if replay:
+            replay_capture(replay, enqueue)
+        elif inbox is not None:
+            drain_inbox(inbox)
+        while client is not None and not _stop.is_set():
+            try:
+                client.connect(BROKER_HOST, BROKER_PORT, 60)
+                client.loop_forever()
+            except Exception as e:
+                print("MQTT connect error:", e)
+                time.sleep(3)
+    finally:
+        _queue.put(_STOP)
+        writer.join()
+        print(f"{tag} writer stopped, all queued rows flushed")
+
+def run_pool(count, replay=None):
+    """Supervise `count` worker processes; restart crashed ones, stop all on SIGTERM.
+    In hash mode (and for --replay) this process is the only subscriber and routes
+    every message to the inbox of the worker that owns its room."""
+    procs = {}
+    routed = PARTITION == "hash" or bool(replay)
+    inboxes = [multiprocessing.Queue(QUEUE_MAX) for _ in range(count)] if routed else []
+    client = None
+
+    def route(ts_utc, topic, payload_str):
+        # blocks when that worker's inbox is full: back-pressure, as in one process
+        inboxes[partition_of(topic_room(topic), count)].put((ts_utc, topic, payload_str))
+
+    def spawn(i):
+        p = multiprocessing.Process(target=run_worker, args=(i, count, None, inboxes[i] if routed else None),
+                                    name=f"mqtt-logger-{i}")
+        p.start()
+        procs[i] = p
+        print(f"[LOGGER] worker {i} started pid={p.pid} (partition={PARTITION})")
+
+    def shutdown(signum, frame):
+        _stop.set()
+        if client is not None:
+            client.disconnect()
+        if not routed:
+            for p in procs.values():
+                if p.is_alive():
+                    p.terminate()  # SIGTERM: each worker drains its own queue
+
+    def feed():
+        if replay:
+            replay_capture(replay, route)
+        while client is not None and not _stop.is_set():
+            try:
+                client.connect(BROKER_HOST, BROKER_PORT, 60)
+                client.loop_forever()
+            except Exception as e:
+                print("MQTT connect error:", e)
+                time.sleep(3)
+        for inbox in inboxes:
+            inbox.put(None)  # each worker drains what was routed to it, then stops
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    if routed and not replay:
+        client = mqtt.Client(client_id="mqtt-logger")
+        client.username_pw_set(MQTT_USER, MQTT_PASS)
+        client.on_connect = on_connect
+        client.on_message = lambda c, u, msg: route(utc_now_naive_iso(), msg.topic,
+                                                    msg.payload.decode("utf-8", "ignore"))
+    for i in range(count):
+        spawn(i)
+    feeder = None
+    if routed:
+        feeder = threading.Thread(target=feed, name="mqtt-router", daemon=True)
+        feeder.start()
+    while procs:
+        for i, p in list(procs.items()):
+            p.join(timeout=0.5)
+            if p.exitcode is None:
+                continue
+            if _stop.is_set() or (replay and p.exitcode == 0):
+                procs.pop(i)
+                continue
+            print(f"[LOGGER] worker {i} exited with {p.exitcode}, restarting")
             time.sleep(3)
+            spawn(i)
+    if feeder is not None:
+        feeder.join(timeout=5)
+
+def build_args(argv=None):
+    p = argparse.ArgumentParser(description="MQTT -> SQLite ingest logger")
+    p.add_argument("--workers", type=int, default=int(os.getenv("LOGGER_WORKERS", "1")),
+                   help="number of ingest worker processes")
+    p.add_argument("--partition", choices=["hash", "share"], default=PARTITION,
+                   help="hash: each worker owns a crc32(room) partition (keeps per-device order); "
+                        "share: $share subscription, broker balances per message (no ordering)")
+    p.add_argument("--replay", default="",
+                   help="JSONL capture of {topic, payload} to ingest instead of connecting to MQTT")
+    return p.parse_args(argv)
+
+def main(argv=None):
+    global PARTITION
+    args = build_args(argv)
+    PARTITION = args.partition
+
+    if not os.path.exists(storage.DB_PATH):
+        print("DB not found, creating:", storage.DB_PATH)
+        open(storage.DB_PATH, "a").close()
+    init_db_minimal()
+
+    if args.workers > 1:
+        run_pool(args.workers, args.replay or None)
+    else:
+        run_worker(0, 1, args.replay or None)
 
 if __name__ == "__main__":
     main()
-
@@ -1,41 +1,90 @@
 import os
 import time
+import queue
+import select
+import socket
 import sqlite3
 import smtplib
 from datetime import datetime
 from email.mime.text import MIMEText
 
-DB_PATH = "/home/pi/DYPLOM/device/raspberry/events.db"
+import storage
+import dispatch
+
 CHECK_INTERVAL = 60
 
+# One authenticated SMTP session is kept open across alerts and reconnected
+# when the server dropped it; it is closed after SMTP_IDLE_SEC without mail.
+# NOTIFY_DIGEST_SEC > 0 groups alerts opened within that window into one
+# message per recipient (ALERT_EMAIL may list several, comma separated).
+# Routing, worker pools and retries per channel live in dispatch.py. A retry
+# only goes to the recipients that did not get the alert yet; 5xx refusals
+# are final and not retried.
+SMTP_IDLE_SEC = int(os.getenv("SMTP_IDLE_SEC", "300"))
+SMTP_TIMEOUT = int(os.getenv("SMTP_TIMEOUT", "20"))
+DIGEST_SEC = int(os.getenv("NOTIFY_DIGEST_SEC", "0"))
+
+# Wake-ups: the rules engine sends a UDP datagram to NOTIFY_WAKE_PORT after it
+# committed new alerts; in addition PRAGMA data_version (any commit by another
+# connection) followed by meta.alerts_version is checked every NOTIFY_WATCH_SEC.
+# The CHECK_INTERVAL scan stays as a fallback.
+WAKE_PORT = int(os.getenv("NOTIFY_WAKE_PORT", "47811"))
+WATCH_SEC = float(os.getenv("NOTIFY_WATCH_SEC", "1"))
+
 def log(msg):
     """Print log message with timestamp (visible in journalctl)."""
     print(f"[{datetime.utcnow().isoformat(timespec='seconds')}] {msg}", flush=True)
 
-def get_open_alerts(conn):
-    """Return all open alerts that have not been notified yet."""
-    query = """
-        SELECT id, rule, room, details, severity, ts_utc
-        FROM alerts
-        WHERE status='open' AND (notified_at IS NULL OR notified_at='')
-        ORDER BY id DESC;
-    """
-    return conn.execute(query).fetchall()
-
-def mark_notified(conn, alert_id, ok, details):
-    """Record notification attempt in notifications_log and update alerts table."""
-    conn.execute("""
-        INSERT INTO notifications_log (alert_id, channel, ok, details)
-        VALUES (?, 'email', ?, ?);
-    """, (alert_id, 1 if ok else 0, details))
-    if ok:
-        conn.execute("UPDATE alerts SET notified_at = datetime('now') WHERE id = ?", (alert_id,))
-    conn.commit()
+def recipients(smtp_cfg):
+    return [r.strip() for r in (smtp_cfg["ALERT_EMAIL"] or "").split(",") if r.strip()]
 
-def send_email(alert, smtp_cfg):
-    """Send alert email using SMTP configuration."""
-    subject = f"[ALERT] {alert['rule']} ({alert['severity']})"
-    body = (
+class SmtpSession:
+    """Persistent STARTTLS + login session, reopened on demand."""
+
+    def __init__(self, smtp_cfg):
+        self.cfg = smtp_cfg
+        self.server = None
+        self.last_used = 0.0
+
+    def _open(self):
+        server = smtplib.SMTP(self.cfg["SMTP_HOST"], int(self.cfg["SMTP_PORT"]), timeout=SMTP_TIMEOUT)
+        server.starttls()
+        server.login(self.cfg["SMTP_USER"], self.cfg["SMTP_PASS"])
+        self.server = server
+        log(f"SMTP session opened to {self.cfg['SMTP_HOST']}")
+
+    def send(self, to, msg):
+        """Send one message; a dropped session is reopened and the send retried once."""
+        for attempt in (1, 2):
+            try:
+                if self.server is None:
+                    self._open()
+                self.server.sendmail(self.cfg["SMTP_USER"], [to], msg.as_string())
+                self.last_used = time.monotonic()
+                return
+            except OSError as e:  # smtplib errors are OSErrors too
+                if isinstance(e, smtplib.SMTPException) and not isinstance(e, smtplib.SMTPServerDisconnected):
+                    raise  # refused sender/recipient, bad data: the session itself is fine
+                self.close()
+                if attempt == 2:
+                    raise
+                log(f"SMTP session lost ({e}), reconnecting")
+
+    def close_if_idle(self):
+        if self.server is not None and time.monotonic() - self.last_used > SMTP_IDLE_SEC:
+            self.close()
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self.server = None
+
+def alert_text(alert):
+    return (
         f"Rule: {alert['rule']}\n"
         f"Room: {alert['room']}\n"
         f"Time (UTC): {alert['ts_utc']}\n"
@@ -43,20 +92,147 @@ def send_email(alert, smtp_cfg):
         f"Details: {alert['details']}\n"
     )
 
+def build_message(subject, body, smtp_cfg, to):
     msg = MIMEText(body)
     msg["Subject"] = subject
     msg["From"] = smtp_cfg["SMTP_USER"]
-    msg["To"] = smtp_cfg["ALERT_EMAIL"]
+    msg["To"] = to
+    return msg
 
-    try:
-        server = smtplib.SMTP(smtp_cfg["SMTP_HOST"], int(smtp_cfg["SMTP_PORT"]))
-        server.starttls()
-        server.login(smtp_cfg["SMTP_USER"], smtp_cfg["SMTP_PASS"])
-        server.sendmail(smtp_cfg["SMTP_USER"], [smtp_cfg["ALERT_EMAIL"]], msg.as_string())
-        server.quit()
+def permanent(e):
+    """A 5xx answer: the same message to the same recipient would be refused again."""
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return bool(e.recipients) and all(code >= 500 for code, _ in e.recipients.values())
+    return isinstance(e, smtplib.SMTPResponseException) and e.smtp_code >= 500
+
+def deliver(alerts, to_list, session, message):
+    """Send message(alerts, to) to each recipient, leaving out alerts whose
+    "delivered" list (kept by the dispatcher across retries) already has it, and
+    record the recipients reached there. Returns (ok, errors, final); final is set
+    when every failure was a permanent refusal."""
+    errors, final = [], True
+    for to in to_list:
+        todo = [a for a in alerts if to not in a.get("delivered", ())]
+        if not todo:
+            continue
+        try:
+            session.send(to, message(todo, to))
+        except Exception as e:
+            errors.append(f"{to}: {e}")
+            final = final and permanent(e)
+            continue
+        for a in todo:
+            if "delivered" in a:
+                a["delivered"].append(to)
+    return not errors, "; ".join(errors), final
+
+def send_email(alert, smtp_cfg, session):
+    """Send one alert email to every recipient over the shared session."""
+    subject = f"[ALERT] {alert['rule']} ({alert['severity']})"
+    to_list = recipients(smtp_cfg)
+    if not to_list:
+        return False, "ALERT_EMAIL not set"
+    ok, errors, final = deliver([alert], to_list, session,
+                                lambda todo, to: build_message(subject, alert_text(alert), smtp_cfg, to))
+    if ok:
         return True, "Email sent successfully"
-    except Exception as e:
-        return False, f"Email failed: {e}"
+    return False, f"Email failed: {errors}", final
+
+def send_digest(alerts, smtp_cfg, session):
+    """One message per recipient listing every alert of the digest window it has not had yet."""
+    def message(todo, to):
+        rules = sorted({a["rule"] for a in todo})
+        subject = f"[ALERT] {len(todo)} alert(s): {', '.join(rules)}"
+        body = "\n".join(alert_text(a) for a in sorted(todo, key=lambda a: a["id"]))
+        return build_message(subject, body, smtp_cfg, to)
+
+    to_list = recipients(smtp_cfg)
+    if not to_list:
+        return False, "ALERT_EMAIL not set"
+    ok, errors, final = deliver(alerts, to_list, session, message)
+    if ok:
+        return True, f"Digest of {len(alerts)} alert(s) sent successfully"
+    return False, f"Digest failed: {errors}", final
+
+def email_sender(smtp_cfg, sessions):
+    """Channel function for the dispatcher. Each email worker checks a session out
+    of the sessions queue for the duration of a send, so sessions are never shared."""
+    def send(alerts):
+        try:
+            session = sessions.get_nowait()
+        except queue.Empty:
+            session = SmtpSession(smtp_cfg)
+        try:
+            if DIGEST_SEC > 0:
+                return send_digest(alerts, smtp_cfg, session)
+            return send_email(alerts[0], smtp_cfg, session)
+        finally:
+            sessions.put(session)
+    return send
+
+def close_idle_sessions(sessions):
+    """Close sessions unused for SMTP_IDLE_SEC; checked-out ones are not touched."""
+    idle = []
+    while True:
+        try:
+            idle.append(sessions.get_nowait())
+        except queue.Empty:
+            break
+    for session in idle:
+        session.close_if_idle()
+        sessions.put(session)
+
+def open_wake_socket():
+    if not WAKE_PORT:
+        return None
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", WAKE_PORT))
+        sock.setblocking(False)
+        return sock
+    except OSError as e:
+        log(f"[WARN] wake socket unavailable ({e}), polling only")
+        return None
+
+def db_versions(conn):
+    """(data_version, alerts_version); alerts_version is None on an old schema."""
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'alerts_version'").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    return data_version, row[0] if row else None
+
+def wait_for_alerts(conn, sock, timeout, versions, ready=None):
+    """Sleep up to timeout; return early on a wake datagram, when alerts changed or
+    when ready() turns true. versions is the last (data_version, alerts_version),
+    updated in place."""
+    end = time.monotonic() + timeout
+    while True:
+        left = end - time.monotonic()
+        if left <= 0:
+            return "timeout"
+        if ready is not None and ready():
+            return "results"
+        step = min(left, WATCH_SEC)
+        if sock is not None:
+            readable, _, _ = select.select([sock], [], [], step)
+            if readable:
+                try:
+                    while sock.recv(64):
+                        pass
+                except BlockingIOError:
+                    pass
+                return "signal"
+        else:
+            time.sleep(step)
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != versions[0]:
+            current = db_versions(conn)
+            changed = current[1] != versions[1]
+            versions[:] = current
+            if changed:
+                return "db"
 
 def main():
     smtp_cfg = {
@@ -67,30 +243,51 @@ def main():
         "ALERT_EMAIL": os.getenv("ALERT_EMAIL"),
     }
 
-    log("Notifier started (email-only mode)")
+    log("Notifier started (channels: " + dispatch.DEFAULT_CHANNELS
+        + (f", digest {DIGEST_SEC}s)" if DIGEST_SEC > 0 else ")"))
     log(f"SMTP target: {smtp_cfg['ALERT_EMAIL']} via {smtp_cfg['SMTP_HOST']}")
+    sessions = queue.Queue()
+    disp = dispatch.Dispatcher({
+        "email": email_sender(smtp_cfg, sessions),
+        "webhook": dispatch.send_webhook,
+        "mqtt": dispatch.send_mqtt,
+    }, digest_sec=DIGEST_SEC)
+    sock = open_wake_socket()
+    versions = [None, None]
+    schema_conn = None
 
     while True:
+        sleep = CHECK_INTERVAL
         try:
-            conn = sqlite3.connect(DB_PATH)
-            conn.row_factory = sqlite3.Row
-
-            alerts = get_open_alerts(conn)
-            if not alerts:
-                log("No new alerts to notify.")
-            else:
-                log(f"Found {len(alerts)} new alert(s) to process.")
-                for alert in alerts:
-                    log(f"Sending email for alert #{alert['id']} ({alert['rule']})...")
-                    ok, info = send_email(alert, smtp_cfg)
-                    mark_notified(conn, alert["id"], ok, info)
-                    log(f"Result: {info}")
-
-            conn.close()
+            conn = storage.get_conn()
+            if conn is not schema_conn:
+                dispatch.ensure_schema(conn)
+                schema_conn = conn
+
+            versions[:] = db_versions(conn)
+            written = disp.drain(conn)
+            queued = disp.enqueue_new(conn)
+            submitted = disp.submit_due(conn)
+            if written or queued or submitted:
+                log(f"Queued {queued}, sending {submitted}, recorded {written} result(s).")
+            due = disp.next_due(conn)
+            now = time.time()
+            if due is not None and due > now:
+                sleep = min(sleep, due - now)
+            close_idle_sessions(sessions)
         except Exception as e:
             log(f"[ERROR] {e}")
+            storage.close_conn()
+            time.sleep(sleep)
+            continue
 
-        time.sleep(CHECK_INTERVAL)
+        try:
+            reason = wait_for_alerts(conn, sock, sleep, versions, disp.pending_results)
+            if reason not in ("timeout", "results"):
+                log(f"Woken up ({reason}).")
+        except sqlite3.Error as e:
+            log(f"[ERROR] {e}")
+            storage.close_conn()
 
 if __name__ == "__main__":
     main()
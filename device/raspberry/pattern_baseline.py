@@ -0,0 +1,192 @@
+import math
+import time
+from datetime import datetime, UTC
+
+try:
+    import numpy as np
+except ImportError:  # optional, z-scores fall back to a plain loop
+    np = None
+
+# Per-room activity baseline for the PATTERN_ANOMALY rule: running mean and
+# variance (Welford) of motion reports per hour, per room x weekday x hour of
+# day (local time). Completed hours are folded in from room_motion_hourly
+# (kept by the logger) once per hour; meta.baseline_hour remembers the last
+# folded hour (epoch hours), so nothing is scanned twice; a sharded rules
+# engine uses one meta key per shard. Each slot keeps about window_days/7
+# weeks of memory, but never fewer than MIN_SAMPLES weeks (the default 14 days
+# keeps 3), otherwise a slot could never be used on its own; while a slot has
+# fewer than MIN_SAMPLES values the same hour of all weekdays is pooled instead.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS room_baseline (
+  room TEXT NOT NULL,
+  weekday INTEGER NOT NULL,       -- 0 = Monday, local time
+  hour INTEGER NOT NULL,          -- 0..23, local time
+  n INTEGER NOT NULL DEFAULT 0,
+  mean REAL NOT NULL DEFAULT 0,
+  m2 REAL NOT NULL DEFAULT 0,
+  PRIMARY KEY (room, weekday, hour)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+  key TEXT PRIMARY KEY,
+  value INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO meta(key, value) VALUES ('baseline_hour', 0);
+"""
+
+MIN_SAMPLES = 3
+MIN_STD = 1.0     # counts are integers: never treat a flat history as zero spread
+
+_stats = None     # {(room, weekday, hour): [n, mean, m2]}, None = reload
+_folded = {}      # {meta key: last folded epoch hour}
+_last_eval = {}   # {room: (z, count, mean, std, hour)} of the last folded hour
+
+def ensure_schema(con):
+    con.executescript(SCHEMA)
+
+def current_hour(now=None):
+    return int((now or time.time()) // 3600)
+
+def slot(h):
+    local = datetime.fromtimestamp(h * 3600)
+    return local.weekday(), local.hour
+
+def hour_key(h):
+    return datetime.fromtimestamp(h * 3600, UTC).strftime("%Y-%m-%dT%H")
+
+def memory(window_days):
+    """Samples kept per weekday x hour slot (at least MIN_SAMPLES)."""
+    return max(MIN_SAMPLES, round(window_days / 7))
+
+def update(n, mean, m2, x, cap):
+    if n >= cap:
+        # keep roughly the last `cap` samples: shrink the old weight first
+        m2 *= (cap - 1) / cap
+        n = cap - 1
+    n += 1
+    d = x - mean
+    mean += d / n
+    m2 += d * (x - mean)
+    return n, mean, m2
+
+def forget():
+    """Drop the in-memory copy, e.g. after a rollback."""
+    global _stats
+    _stats = None
+    _folded.clear()
+
+def _load(con, key):
+    global _stats
+    if _stats is None:
+        _stats = {(room, wd, h): [n, mean, m2] for room, wd, h, n, mean, m2 in
+                  con.execute("SELECT room, weekday, hour, n, mean, m2 FROM room_baseline")}
+    if key not in _folded:
+        con.execute("""
+            INSERT OR IGNORE INTO meta(key, value) SELECT ?, value FROM meta WHERE key = 'baseline_hour'
+        """, (key,))
+        _folded[key] = con.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0]
+
+def due(key="baseline_hour", now=None):
+    """True once an hour completed that is not folded into the baseline yet."""
+    return _folded.get(key) is None or _folded[key] < current_hour(now) - 1
+
+def next_fold_at(now=None):
+    return (current_hour(now) + 1) * 3600
+
+def _expected(room, wd, h):
+    """(n, mean, std) of the slot, or of the pooled hour of day while the slot is young."""
+    n, mean, m2 = _stats.get((room, wd, h), (0, 0.0, 0.0))
+    if n < MIN_SAMPLES:
+        parts = [_stats[k] for k in ((room, d, h) for d in range(7)) if k in _stats]
+        n = sum(p[0] for p in parts)
+        if n == 0:
+            return 0, 0.0, MIN_STD
+        mean = sum(p[0] * p[1] for p in parts) / n
+        m2 = sum(p[2] + p[0] * (p[1] - mean) ** 2 for p in parts)
+    std = math.sqrt(m2 / (n - 1)) if n > 1 else 0.0
+    return n, mean, max(std, MIN_STD)
+
+def zscores(counts, means, stds):
+    """Vectorized (count - mean) / std over all rooms."""
+    if np is not None:
+        return (np.asarray(counts, dtype=float) - np.asarray(means)) / np.asarray(stds)
+    return [(c - m) / s for c, m, s in zip(counts, means, stds)]
+
+def fold(con, rooms, window_days, key="baseline_hour", now=None):
+    """Fold completed hours into the baseline. Returns {room: (z, count, mean, std, hour)}
+    for the newest folded hour (scored against the baseline before it was added),
+    {} if nothing was due. Caller commits."""
+    _load(con, key)
+    upto = current_hour(now) - 1
+    if _folded[key] >= upto:
+        return {}
+    cap = memory(window_days)
+    start = max(_folded[key] + 1, upto - 47)  # room_motion_hourly keeps 48 h
+    if not _folded[key]:
+        start = upto
+    counts = {}
+    for room, hour, n in con.execute("""
+        SELECT room, hour, count FROM room_motion_hourly WHERE hour >= ? AND hour <= ?
+    """, (hour_key(start), hour_key(upto))):
+        counts[(room, hour)] = n
+
+    result = {}
+    touched = {}
+    for h in range(start, upto + 1):
+        wd, hod = slot(h)
+        hk = hour_key(h)
+        if h == upto:
+            scored = [(room, counts.get((room, hk), 0)) + _expected(room, wd, hod) for room in rooms]
+            scored = [s for s in scored if s[2] >= MIN_SAMPLES]
+            if scored:
+                z = zscores([s[1] for s in scored], [s[3] for s in scored], [s[4] for s in scored])
+                result = {s[0]: (float(zi), s[1], s[3], s[4], hod) for s, zi in zip(scored, z)}
+        for room in rooms:
+            k = (room, wd, hod)
+            st = _stats.get(k, [0, 0.0, 0.0])
+            _stats[k] = list(update(*st, counts.get((room, hk), 0), cap))
+            touched[k] = _stats[k]
+
+    con.executemany("""
+        INSERT INTO room_baseline(room, weekday, hour, n, mean, m2) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(room, weekday, hour) DO UPDATE SET n = excluded.n, mean = excluded.mean, m2 = excluded.m2
+    """, [(*k, *v) for k, v in touched.items()])
+    con.execute("UPDATE meta SET value = ? WHERE key = ?", (upto, key))
+    _folded[key] = upto
+    for room in rooms:
+        _last_eval.pop(room, None)
+    _last_eval.update(result)
+    return result
+
+def last_eval():
+    return _last_eval
+
+def rebuild(con, window_days, log=print, now=None):
+    """Build the baseline from motion_events in bulk, once, if it is still empty."""
+    if con.execute("SELECT 1 FROM room_baseline LIMIT 1").fetchone():
+        return False
+    upto = current_hour(now) - 1
+    cap = memory(window_days)
+    since = upto - cap * 7 * 24
+    counts = {}
+    for room, ts, n in con.execute("""
+        SELECT d.room, m.ts_ms / 3600000, COUNT(*)
+          FROM motion_events m JOIN devices d ON d.device_id = m.device_id
+         WHERE m.ts_ms >= ? AND d.room IS NOT NULL
+      GROUP BY 1, 2
+    """, (since * 3600000,)):
+        counts.setdefault(room, {})[ts] = n
+    stats = {}
+    for room, by_hour in counts.items():
+        # zero-fill from the first hour the room reported anything
+        for h in range(min(by_hour), upto + 1):
+            wd, hod = slot(h)
+            st = stats.get((room, wd, hod), (0, 0.0, 0.0))
+            stats[(room, wd, hod)] = update(*st, by_hour.get(h, 0), cap)
+    con.executemany("INSERT INTO room_baseline(room, weekday, hour, n, mean, m2) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(*k, *v) for k, v in stats.items()])
+    con.execute("UPDATE meta SET value = ? WHERE key = 'baseline_hour'", (upto,))
+    con.commit()
+    forget()
+    log(f"[PATTERN] baseline rebuilt for {len(counts)} room(s) from {cap} week(s) of history")
+    return True
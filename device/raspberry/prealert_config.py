@@ -1,7 +1,15 @@
+import os
+import copy
 import json
+import threading
 from pathlib import Path
 from datetime import datetime, time
 
+try:
+    import fcntl
+except ImportError:  # not on Windows: updates are then only serialized within a process
+    fcntl = None
+
 CONFIG_PATH = Path("/home/pi/DYPLOM/device/raspberry/prealert_config.json")
 
 DEFAULT = {
@@ -14,31 +22,137 @@ DEFAULT = {
   }
 }
 
+# Configuration cache shared by the API and the rules engine.
+# prealert_config.json is re-parsed only when its mtime/size changes (one stat
+# per call otherwise); merged room configs and night windows are memoized.
+# rule_settings is cached behind meta.rule_settings_version, bumped by triggers.
+# Returned dicts are shared: modify through update_config(), which holds an
+# fcntl lock on prealert_config.json.lock across load, change and save, so two
+# API workers updating different rooms at once do not drop each other's change.
+_lock = threading.Lock()
+_update_lock = threading.Lock()
+_file = {"stamp": None, "cfg": None, "rooms": {}}
+_night_windows = {}
+_settings = {"version": None, "values": {}}
+
+SETTINGS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+  key TEXT PRIMARY KEY,
+  value INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO meta(key, value) VALUES ('rule_settings_version', 0);
+CREATE TRIGGER IF NOT EXISTS trg_rule_settings_version_ins AFTER INSERT ON rule_settings
+BEGIN
+  UPDATE meta SET value = value + 1 WHERE key = 'rule_settings_version';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_rule_settings_version_upd AFTER UPDATE ON rule_settings
+BEGIN
+  UPDATE meta SET value = value + 1 WHERE key = 'rule_settings_version';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_rule_settings_version_del AFTER DELETE ON rule_settings
+BEGIN
+  UPDATE meta SET value = value + 1 WHERE key = 'rule_settings_version';
+END;
+"""
+
+def _stamp():
+    try:
+        st = CONFIG_PATH.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
 def load_config():
-    if not CONFIG_PATH.exists():
+    stamp = _stamp()
+    if stamp is None:
         save_config(DEFAULT)
         return DEFAULT
-    return json.loads(CONFIG_PATH.read_text())
+    with _lock:
+        if stamp == _file["stamp"]:
+            return _file["cfg"]
+    cfg = json.loads(CONFIG_PATH.read_text())
+    with _lock:
+        _file.update(stamp=stamp, cfg=cfg, rooms={})
+    return cfg
 
 def save_config(cfg):
-    CONFIG_PATH.write_text(json.dumps(cfg, indent=2))
+    """Write atomically (tmp file + rename) so readers never see a partial file."""
+    tmp = CONFIG_PATH.with_name(f"{CONFIG_PATH.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(json.dumps(cfg, indent=2))
+    os.replace(tmp, CONFIG_PATH)
+    with _lock:
+        _file.update(stamp=_stamp(), cfg=cfg, rooms={})
+
+def update_config(change):
+    """Apply change(cfg) to a copy of the current config and save it, under the
+    cross-process config lock. Returns the saved config."""
+    with _update_lock:
+        lock_path = CONFIG_PATH.with_name(CONFIG_PATH.name + ".lock")
+        with open(lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)  # released when the file is closed
+            cfg = copy.deepcopy(load_config())
+            change(cfg)
+            save_config(cfg)
+    return cfg
+
+def config_stamp():
+    """Changes whenever prealert_config.json is rewritten."""
+    return _stamp()
 
 def get_room_cfg(room, cfg=None):
     cfg = cfg or load_config()
+    with _lock:
+        if cfg is _file["cfg"] and room in _file["rooms"]:
+            return _file["rooms"][room]
     room_cfg = cfg.get(room, {})
     merged = cfg.get("default", {}).copy()
     merged.update(room_cfg)
+    with _lock:
+        if cfg is _file["cfg"]:
+            _file["rooms"][room] = merged
     return merged
 
-def in_night_window(cfg):
+def night_window(nw):
+    """(from, to) as datetime.time, parsed once per distinct window."""
+    key = (nw.get("from", "23:00"), nw.get("to", "07:00"))
+    win = _night_windows.get(key)
+    if win is None:
+        tf = lambda s: datetime.strptime(s, "%H:%M").time()
+        win = _night_windows[key] = (tf(key[0]), tf(key[1]))
+    return win
+
+def night_spec(spec):
+    """'HH:MM-HH:MM' (rule_settings night.window) -> (from, to); ValueError if malformed."""
+    parts = str(spec).split("-")
+    if len(parts) != 2:
+        raise ValueError(f"expected HH:MM-HH:MM, got {spec!r}")
+    return night_window({"from": parts[0].strip(), "to": parts[1].strip()})
+
+def in_night_window(cfg, now=None):
     if not cfg.get("night_block", False):
         return False
-    nw = cfg.get("night_window", {"from":"23:00","to":"07:00"})
-    tf = lambda s: datetime.strptime(s, "%H:%M").time()
-    t_from = tf(nw["from"]); t_to = tf(nw["to"])
-    now = datetime.now().time()
+    t_from, t_to = night_window(cfg.get("night_window") or {})
+    now = now or datetime.now().time()
     if t_from < t_to:
         return t_from <= now < t_to
     else:
         return now >= t_from or now < t_to
 
+def ensure_settings_schema(con):
+    con.executescript(SETTINGS_SCHEMA)
+
+def settings_version(con):
+    row = con.execute("SELECT value FROM meta WHERE key = 'rule_settings_version'").fetchone()
+    return row[0] if row else None
+
+def rule_settings(con):
+    """rule_settings as a dict; re-read only when the version counter moved."""
+    version = settings_version(con)
+    with _lock:
+        if version is not None and version == _settings["version"]:
+            return _settings["values"]
+    values = {k: v for k, v in con.execute("SELECT key, value FROM rule_settings")}
+    with _lock:
+        _settings.update(version=version, values=values)
+    return values
@@ -0,0 +1,198 @@
+import os
+import zlib
+from fnmatch import fnmatch
+
+import timestamps
+
+# Raw MQTT archive. Two storage modes, selected with RAW_ARCHIVE_MODE:
+#   text    - legacy messages_raw table, full JSON text per row (default)
+#   compact - messages_archive: interned topic ids + zlib payload blob
+#   off     - raw messages are not stored at all
+# Readers (page_messages, count_messages, last_ts) look at both tables, so
+# switching modes on a live DB keeps /api/messages and validation working.
+MODE = os.getenv("RAW_ARCHIVE_MODE", "text")
+
+# Per-topic keep policy, first match wins: "all", "none" or "every:N"
+# (keep one message in N). Example: "*/motion/health=every:10,*=all"
+POLICY = os.getenv("RAW_KEEP_POLICY", "*=all")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS raw_topics (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  topic TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages_archive (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  ts_utc TEXT NOT NULL,
+  topic_id INTEGER NOT NULL REFERENCES raw_topics(id),
+  device_id TEXT,
+  payload BLOB NOT NULL,
+  ts_ms INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_archive_topic_ts ON messages_archive(topic_id, ts_utc);
+"""
+
+# Preset dictionary: our payloads are tiny JSON objects with the same keys,
+# plain zlib would not shrink them at all without it.
+ZDICT = (b'"rssi": "fw": "status": "online", "timestamp": "20'
+         b'"ip": "192.168.0.", "uptime_ms": '
+         b'{"motion": false, "device": "esp8266_test"}'
+         b'{"motion": true, "device": "esp8266_')
+_PLAIN, _ZLIB = b"t", b"z"
+
+_topic_ids = {}
+_counters = {}
+
+def parse_policy(spec):
+    rules = []
+    for part in spec.split(","):
+        if "=" not in part:
+            continue
+        pattern, action = (x.strip() for x in part.split("=", 1))
+        if action.startswith("every:"):
+            rules.append((pattern, max(1, int(action.split(":", 1)[1]))))
+        elif action == "none":
+            rules.append((pattern, 0))
+        else:
+            rules.append((pattern, 1))
+    return rules
+
+_policy = parse_policy(POLICY)
+
+def keep(topic):
+    """Apply the keep policy for one message of this topic."""
+    for pattern, every in _policy:
+        if fnmatch(topic, pattern):
+            break
+    else:
+        return True
+    if every <= 1:
+        return every == 1
+    n = _counters.get(topic, 0)
+    _counters[topic] = n + 1
+    return n % every == 0
+
+def pack(payload):
+    data = payload.encode("utf-8")
+    c = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=ZDICT)
+    packed = c.compress(data) + c.flush()
+    if len(packed) < len(data):
+        return _ZLIB + packed
+    return _PLAIN + data
+
+def unpack(blob):
+    if blob is None:
+        return None
+    if isinstance(blob, str):
+        return blob
+    blob = bytes(blob)
+    if blob[:1] == _ZLIB:
+        d = zlib.decompressobj(-15, zdict=ZDICT)
+        return (d.decompress(blob[1:]) + d.flush()).decode("utf-8", "ignore")
+    return blob[1:].decode("utf-8", "ignore")
+
+def ensure_schema(con):
+    con.executescript(SCHEMA)
+
+def topic_id(con, topic):
+    tid = _topic_ids.get(topic)
+    if tid is None:
+        con.execute("INSERT OR IGNORE INTO raw_topics(topic) VALUES(?)", (topic,))
+        tid = con.execute("SELECT id FROM raw_topics WHERE topic=?", (topic,)).fetchone()[0]
+        _topic_ids[topic] = tid
+    return tid
+
+def forget_topics():
+    """Drop interned ids, e.g. after a rollback of a transaction that created them."""
+    _topic_ids.clear()
+
+def store(con, rows):
+    """Store (ts_utc, topic, device_id, payload) rows according to MODE/POLICY."""
+    rows = [r for r in rows if keep(r[1])]
+    if not rows or MODE == "off":
+        return 0
+    if MODE == "compact":
+        con.executemany(
+            "INSERT INTO messages_archive(ts_utc, topic_id, device_id, payload, ts_ms) VALUES(?,?,?,?,?)",
+            [(ts, topic_id(con, topic), dev, pack(payload), timestamps.to_ms(ts))
+             for ts, topic, dev, payload in rows])
+    else:
+        con.executemany(
+            "INSERT INTO messages_raw(ts_utc, topic, device_id, payload, ts_ms) VALUES(?,?,?,?,?)",
+            [(*r, timestamps.to_ms(r[0])) for r in rows])
+    return len(rows)
+
+def _has_archive(con):
+    return con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='messages_archive'").fetchone() is not None
+
+def parse_cursor(cursor):
+    """'<raw id>.<archive id>' -> (raw, archive); 0 means that table is exhausted,
+    None unbounded. A missing archive part (legacy ?before_id=<raw id>) is unbounded."""
+    if not cursor:
+        return None, None
+    raw, _, arch = str(cursor).partition(".")
+    return int(raw), (int(arch) if arch else None)
+
+def page_messages(con, limit, cursor=None):
+    """Keyset page, newest first, merged from both tables by ts_utc.
+    Returns (rows, next_cursor); next_cursor is None on the last page."""
+    raw_before, arch_before = parse_cursor(cursor)
+    raw = []
+    if raw_before != 0:
+        raw = [("r", i, ts, topic, payload) for i, ts, topic, payload in con.execute("""
+            SELECT id, ts_utc, topic, payload FROM messages_raw
+             WHERE id < ? ORDER BY id DESC LIMIT ?
+        """, (raw_before or 2**63 - 1, limit + 1))]
+    arch = []
+    if arch_before != 0 and _has_archive(con):
+        arch = [("a", i, ts, topic, payload) for i, ts, topic, payload in con.execute("""
+            SELECT a.id, a.ts_utc, t.topic, a.payload
+              FROM messages_archive a JOIN raw_topics t ON t.id = a.topic_id
+             WHERE a.id < ? ORDER BY a.id DESC LIMIT ?
+        """, (arch_before or 2**63 - 1, limit + 1))]
+    merged = sorted(raw + arch, key=lambda r: r[2], reverse=True)
+    page = merged[:limit]
+    out = [{"ts_utc": ts, "topic": topic, "payload": unpack(payload) if src == "a" else payload}
+           for src, _, ts, topic, payload in page]
+    if len(merged) <= limit:
+        return out, None
+    # per table: continue below the last row taken, or stop if it is done
+    def bound(src, rows):
+        taken = [r[1] for r in page if r[0] == src]
+        if taken:
+            return min(taken)
+        return (rows[0][1] + 1) if rows else 0
+    return out, f"{bound('r', raw)}.{bound('a', arch)}"
+
+def count_messages(con, topic_like, start, end):
+    """COUNT of messages with topic LIKE topic_like and start <= ts_utc <= end
+    (either ts_utc spelling, compared as epoch ms)."""
+    start_ms, end_ms = timestamps.to_ms(start), timestamps.to_ms(end)
+    n = con.execute("""
+        SELECT COUNT(*) FROM messages_raw WHERE ts_ms BETWEEN ? AND ? AND topic LIKE ?
+    """, (start_ms, end_ms, topic_like)).fetchone()[0]
+    if _has_archive(con):
+        n += con.execute("""
+            SELECT COUNT(*) FROM messages_archive
+             WHERE topic_id IN (SELECT id FROM raw_topics WHERE topic LIKE ?)
+               AND ts_ms BETWEEN ? AND ?
+        """, (topic_like, start_ms, end_ms)).fetchone()[0]
+    return n
+
+def last_ts(con, topic):
+    ts = con.execute("SELECT MAX(ts_utc) FROM messages_raw WHERE topic = ?", (topic,)).fetchone()[0]
+    if _has_archive(con):
+        ts2 = con.execute("""
+            SELECT MAX(a.ts_utc) FROM messages_archive a
+             WHERE a.topic_id = (SELECT id FROM raw_topics WHERE topic = ?)
+        """, (topic,)).fetchone()[0]
+        if ts2 and (not ts or ts2 > ts):
+            ts = ts2
+    return ts
+
+def purge_before(con, cutoff):
+    """Delete archived rows older than cutoff (ISO text); returns row count."""
+    if not _has_archive(con):
+        return 0
+    return con.execute("DELETE FROM messages_archive WHERE ts_ms < ?", (timestamps.to_ms(cutoff),)).rowcount
@@ -0,0 +1,134 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from email.utils import formatdate, parsedate_to_datetime
+
+from flask import request, make_response
+
+import storage
+import prealert_config
+
+# Response cache for the read endpoints of app.py, keyed by endpoint +
+# sorted query args. An entry is valid while the database generation is
+# unchanged: PRAGMA data_version of one private probe connection (it never
+# writes, so it moves on every commit by any other connection, in this process
+# or another) plus the prealert_config.json stamp. Within RESPONSE_CACHE_TTL
+# seconds of the last check the generation is not even read, so a repeated
+# poll with a matching ETag / If-Modified-Since is answered 304 without
+# touching SQLite. Views whose output depends on the clock pass max_age.
+
+TTL = float(os.getenv("RESPONSE_CACHE_TTL", "1.0"))
+MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_ENTRIES", "256"))
+ENABLED = os.getenv("RESPONSE_CACHE", "1") != "0"
+
+_lock = threading.Lock()
+_entries = OrderedDict()   # key -> dict(gen, etag, body, mimetype, headers, modified, built, checked)
+_stats = {}                # endpoint -> {"hit", "not_modified", "revalidated", "miss"}
+_probe = None
+
+def generation():
+    global _probe
+    with _lock:
+        if _probe is None:
+            _probe = storage.connect_ro()
+        data_version = _probe.execute("PRAGMA data_version").fetchone()[0]
+    return data_version, prealert_config.config_stamp()
+
+def invalidate():
+    """Force a generation check on the next request (after a write by this API)."""
+    with _lock:
+        for entry in _entries.values():
+            entry["checked"] = 0.0
+
+def _count(endpoint, what):
+    with _lock:
+        st = _stats.setdefault(endpoint, {"hit": 0, "not_modified": 0, "revalidated": 0, "miss": 0})
+        st[what] += 1
+
+def stats():
+    with _lock:
+        per = {k: dict(v) for k, v in _stats.items()}
+        entries = len(_entries)
+    for st in per.values():
+        total = sum(st.values())
+        st["hit_rate"] = round((total - st["miss"]) / total, 3) if total else None
+    return {"enabled": ENABLED, "ttl_sec": TTL, "entries": entries, "endpoints": per}
+
+def _not_modified(entry):
+    inm = request.headers.get("If-None-Match")
+    if inm is not None:
+        return entry["etag"] in [t.strip() for t in inm.split(",")] or inm.strip() == "*"
+    ims = request.headers.get("If-Modified-Since")
+    if ims:
+        try:
+            return int(entry["modified"]) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def _respond(entry):
+    if _not_modified(entry):
+        resp = make_response("", 304)
+    else:
+        resp = make_response(entry["body"], 200)
+        resp.mimetype = entry["mimetype"]
+        resp.headers.extend(entry["headers"])
+    resp.headers["ETag"] = entry["etag"]
+    resp.headers["Last-Modified"] = formatdate(entry["modified"], usegmt=True)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+def cached(auth, max_age=None):
+    """Decorator for GET views; auth() runs first on every request, hit or not."""
+    def deco(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            auth()
+            if not ENABLED:
+                return view(*args, **kwargs)
+            endpoint = request.endpoint
+            key = (endpoint, tuple(sorted(kwargs.items())), tuple(sorted(request.args.items(multi=True))))
+            now = time.time()
+            with _lock:
+                entry = _entries.get(key)
+                if entry is not None:
+                    _entries.move_to_end(key)
+            if entry is not None and (max_age is None or now - entry["built"] < max_age):
+                if now - entry["checked"] < TTL:
+                    _count(endpoint, "not_modified" if _not_modified(entry) else "hit")
+                    return _respond(entry)
+                gen = generation()
+                if gen == entry["gen"]:
+                    entry["checked"] = now
+                    _count(endpoint, "revalidated")
+                    return _respond(entry)
+            else:
+                gen = generation()
+            _count(endpoint, "miss")
+            resp = make_response(view(*args, **kwargs))
+            if resp.status_code != 200:
+                return resp
+            body = resp.get_data()
+            old, entry = entry, {
+                "gen": gen,
+                "etag": '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"',
+                "body": body,
+                "mimetype": resp.mimetype,
+                "headers": [(k, v) for k, v in resp.headers.items()
+                            if k.lower() not in ("content-type", "content-length")],
+                "modified": now,
+                "built": now,
+                "checked": now,
+            }
+            if old is not None and old["etag"] == entry["etag"]:
+                entry["modified"] = old["modified"]  # same bytes: keep Last-Modified
+            with _lock:
+                _entries[key] = entry
+                while len(_entries) > MAX_ENTRIES:
+                    _entries.popitem(last=False)
+            return _respond(entry)
+        return wrapper
+    return deco
@@ -0,0 +1,145 @@
+from datetime import datetime, timedelta, UTC
+
+import motion_intervals
+import timestamps
+
+# Materialized per-room state, kept current by the logger at ingest time
+# (motion / heartbeat timestamps, hourly motion counts) and by triggers on
+# devices (device_count). /api/rooms and the rules engine read it with one
+# point read per room instead of aggregating the motion history. The history
+# backfill runs once, remembered in meta.room_state_built (the device triggers
+# create rows before it, so an empty table cannot be the signal).
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS room_state (
+  room TEXT PRIMARY KEY,
+  last_motion_utc TEXT,
+  last_hb_utc TEXT,
+  device_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS room_motion_hourly (
+  room TEXT NOT NULL,
+  hour TEXT NOT NULL,            -- 'YYYY-MM-DDTHH' (UTC)
+  count INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (room, hour)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+  key TEXT PRIMARY KEY,
+  value INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO meta(key, value) VALUES ('room_state_built', 0);
+
+CREATE TRIGGER IF NOT EXISTS trg_room_state_dev_ins AFTER INSERT ON devices
+WHEN NEW.room IS NOT NULL
+BEGIN
+  INSERT INTO room_state(room, device_count) VALUES (NEW.room, 1)
+  ON CONFLICT(room) DO UPDATE SET device_count = device_count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_room_state_dev_upd AFTER UPDATE OF room ON devices
+WHEN OLD.room IS NOT NEW.room
+BEGIN
+  UPDATE room_state SET device_count = MAX(0, device_count - 1) WHERE room = OLD.room;
+  INSERT INTO room_state(room, device_count) SELECT NEW.room, 1 WHERE NEW.room IS NOT NULL
+  ON CONFLICT(room) DO UPDATE SET device_count = device_count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_room_state_dev_del AFTER DELETE ON devices
+BEGIN
+  UPDATE room_state SET device_count = MAX(0, device_count - 1) WHERE room = OLD.room;
+END;
+"""
+
+HOURLY_KEEP_HOURS = 48
+
+def hour_key(ts_utc):
+    return ts_utc.replace(" ", "T")[:13]
+
+def ensure_schema(con):
+    con.executescript(SCHEMA)
+
+def rebuild(con, log=print):
+    """Fill room_state from history once (call motion_intervals.backfill first)."""
+    if con.execute("SELECT value FROM meta WHERE key = 'room_state_built'").fetchone()[0]:
+        return False
+    con.execute("""
+        INSERT OR IGNORE INTO room_state(room, device_count)
+        SELECT name, (SELECT COUNT(*) FROM devices d WHERE d.room = r.name) FROM rooms r
+    """)
+    con.execute("""
+        INSERT INTO room_state(room, device_count)
+        SELECT room, COUNT(*) FROM devices WHERE room IS NOT NULL GROUP BY room
+        ON CONFLICT(room) DO UPDATE SET device_count = excluded.device_count
+    """)
+    con.execute("""
+        UPDATE room_state SET last_motion_utc =
+          (SELECT MAX(end_utc) FROM motion_intervals i WHERE i.room = room_state.room)
+    """)
+    con.execute("""
+        UPDATE room_state SET last_hb_utc =
+          (SELECT MAX(replace(h.ts_utc, ' ', 'T')) FROM heartbeats h
+             JOIN devices d ON d.device_id = h.device_id
+            WHERE d.room = room_state.room)
+    """)
+    con.execute("""
+        INSERT OR REPLACE INTO room_motion_hourly(room, hour, count)
+        SELECT d.room, strftime('%Y-%m-%dT%H', m.ts_ms / 1000, 'unixepoch'), COUNT(*)
+          FROM motion_events m JOIN devices d ON d.device_id = m.device_id
+         WHERE m.ts_ms >= ? AND d.room IS NOT NULL
+      GROUP BY 1, 2
+    """, (timestamps.ago_ms(24 * 3600),))
+    con.execute("UPDATE meta SET value = 1 WHERE key = 'room_state_built'")
+    con.commit()
+    n = con.execute("SELECT COUNT(*) FROM room_state").fetchone()[0]
+    log(f"[ROOM_STATE] rebuilt room_state for {n} room(s)")
+    return True
+
+def apply(con, motion, hours, heartbeats):
+    """Fold one ingest batch in: motion/heartbeats are {room: max ts},
+    hours is {(room, 'YYYY-MM-DDTHH'): count}. Caller commits."""
+    if motion:
+        con.executemany("""
+            INSERT INTO room_state(room, last_motion_utc) VALUES (?, ?)
+            ON CONFLICT(room) DO UPDATE SET last_motion_utc =
+              MAX(COALESCE(last_motion_utc, ''), excluded.last_motion_utc)
+        """, list(motion.items()))
+    if hours:
+        con.executemany("""
+            INSERT INTO room_motion_hourly(room, hour, count) VALUES (?, ?, ?)
+            ON CONFLICT(room, hour) DO UPDATE SET count = count + excluded.count
+        """, [(room, hour, n) for (room, hour), n in hours.items()])
+    if heartbeats:
+        con.executemany("""
+            INSERT INTO room_state(room, last_hb_utc) VALUES (?, ?)
+            ON CONFLICT(room) DO UPDATE SET last_hb_utc =
+              MAX(COALESCE(last_hb_utc, ''), excluded.last_hb_utc)
+        """, list(heartbeats.items()))
+
+def purge_hourly(con, now=None):
+    cutoff = hour_key(motion_intervals.iso_utc((now or datetime.now(UTC)) - timedelta(hours=HOURLY_KEEP_HOURS)))
+    con.execute("DELETE FROM room_motion_hourly WHERE hour < ?", (cutoff,))
+
+def last_motion(con, room):
+    row = con.execute("SELECT last_motion_utc FROM room_state WHERE room = ?", (room,)).fetchone()
+    if row is None:
+        return None, False
+    return motion_intervals.parse_utc(row[0]), True
+
+def last_motion_all(con):
+    rows = con.execute("SELECT room, last_motion_utc FROM room_state WHERE last_motion_utc IS NOT NULL")
+    return {room: motion_intervals.parse_utc(ts) for room, ts in rows}
+
+def overview(con, now=None):
+    """Rows for /api/rooms: room, last_motion, motions_today, last_hb, device_count, active_now."""
+    day_ago = hour_key(motion_intervals.iso_utc((now or datetime.now(UTC)) - timedelta(hours=24)))
+    return con.execute("""
+        SELECT r.name AS room,
+               s.last_motion_utc AS last_motion,
+               s.last_hb_utc AS last_hb,
+               COALESCE(s.device_count, 0) AS device_count,
+               (SELECT COALESCE(SUM(h.count), 0) FROM room_motion_hourly h
+                 WHERE h.room = r.name AND h.hour >= ?) AS motions_today,
+               EXISTS(SELECT 1 FROM motion_intervals i
+                       WHERE i.is_open = 1 AND i.room = r.name) AS active_now
+          FROM rooms r
+     LEFT JOIN room_state s ON s.room = r.name
+      ORDER BY r.name
+    """, (day_ago,)).fetchall()
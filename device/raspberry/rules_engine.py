@@ -1,14 +1,29 @@
+import os
+import heapq
 import sqlite3
 import time
 import json
+import signal
+import socket
+import argparse
 import threading
-from datetime import datetime, UTC
+import multiprocessing
+from datetime import datetime, timedelta, UTC
 
 import paho.mqtt.client as mqtt
 
+import prealert_config
 from prealert_config import load_config, get_room_cfg, in_night_window
+import storage
+import motion_intervals
+import raw_archive
+import room_state
+import device_status
+import activity_window
+import pattern_baseline
+import leases
+import timestamps
 
-DB_PATH = "/home/pi/DYPLOM/device/raspberry/events.db"
 CHECK_INTERVAL = 15  # sec
 MQTT_HOST = "192.168.0.48"
 MQTT_PORT = 1883
@@ -16,9 +31,68 @@ MQTT_USER = "iot"
 MQTT_PASS = "iot"
 
 mqtt_client = None
-config_cache = load_config()
+CONFIG_POLL_SEC = float(os.getenv("RULES_CONFIG_POLL_SEC", "1"))  # config change pickup
 _last_prealert_sent = {}  # {room: ts_monotonic}
 
+# Event-driven mode: the engine subscribes to the motion/health topics, keeps
+# last motion per room and last heartbeat per device in memory (bootstrapped
+# from the DB) and re-evaluates only the touched rooms/devices right away.
+# A full DB sweep every RULES_SAFETY_INTERVAL stays as a safety net.
+EVENT_MODE = os.getenv("RULES_EVENT_MODE", "1") == "1"
+EVENT_TOPIC = "iot/eldercare/+/motion/#"
+_state_lock = threading.Lock()
+_last_motion = {}      # {room: datetime UTC}
+_last_start = {}       # {room: datetime UTC} of the last value=1 report
+_last_hb = {}          # {device_id: datetime UTC}
+_dirty_rooms = set()
+_dirty_devices = set()
+_wake = threading.Event()
+
+# Deadline scheduler: after a room/device is evaluated the next moment its
+# outcome can change (prealert window start, inactivity threshold, dwell
+# window end, heartbeat expiry) is pushed on a heap, and the loop sleeps until
+# the earliest one or until an event arrives. Superseded entries stay in the
+# heap and are skipped lazily. Only touched by the main loop thread.
+HB_TIMEOUT_SEC = 1800
+SAFETY_INTERVAL = int(os.getenv("RULES_SAFETY_INTERVAL", "300"))  # event mode full sweep
+_DEADLINE_EPS = 0.01
+_deadlines = []        # heap of (epoch, kind, key)
+_deadline_at = {}      # {(kind, key): epoch} of the live entry
+
+# Open alerts by (rule, "room"|"device", key) -> alert id. Loaded at start and
+# reloaded when meta.alerts_version (bumped by triggers on alerts) moved
+# because of a change made outside the engine, e.g. a close from the API.
+_open_alerts = {}
+_alerts_version = None
+_alert_changes = 0     # own inserts/status updates since the last commit
+_alerts_opened = 0     # own inserts since the last commit
+
+# After a cycle that opened alerts has committed, a UDP datagram wakes the
+# notifier right away instead of waiting for its next poll (0 disables).
+NOTIFY_WAKE_PORT = int(os.getenv("NOTIFY_WAKE_PORT", "47811"))
+_wake_sock = None
+
+# Dwell counters (event mode): {room: ActivityWindow} fed from motion/state
+# messages, seeded from motion_intervals on first use and whenever the
+# dwell.<room>_min / dwell.gap_min settings change. Guarded by _state_lock.
+# The seed query runs without the lock; reports arriving meanwhile are kept in
+# _seeding and folded in when the new window is installed.
+_windows = {}
+_seeding = {}          # {room: [(epoch, value)]} while its window is being seeded
+
+# Sharded mode (--shards N): rooms and devices are split over N shards by
+# crc32 and each engine process evaluates only the shards it holds a lease
+# for (see leases.py). --shard K names the shard a process normally owns;
+# without it the process is a standby. Free or expired shards are adopted
+# once the startup grace period (one lease TTL) is over, and handed back when
+# their preferred owner asks. One shard (the default) means no leases at all.
+SHARDS = 1
+LEASE_TTL = float(os.getenv("RULES_LEASE_TTL", "30"))
+_owner = None          # "<host>:<pid>", set in main()
+_preferred = None      # shard this process normally owns, None = standby
+_owned = {}            # {shard: lease generation}
+_started = None        # monotonic start of this process, set in main()
+
 def now_utc_str():
     return datetime.now(UTC).strftime("%Y-%m-%d %H:%M:%S")
 
@@ -31,18 +105,161 @@ def init_mqtt_once():
         return
     mqttc = mqtt.Client()
     mqttc.username_pw_set(MQTT_USER, MQTT_PASS)
+    if EVENT_MODE:
+        mqttc.on_connect = on_mqtt_connect
+        mqttc.on_message = on_mqtt_message
     mqttc.connect(MQTT_HOST, MQTT_PORT, 60)
     mqttc.loop_start()
     mqtt_client = mqttc
     log("[PREALERT] MQTT client connected and loop started")
 
-def get_settings():
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("SELECT key, value FROM rule_settings;")
-    settings = {k: v for k, v in cur.fetchall()}
-    con.close()
-    return settings
+def on_mqtt_connect(client, userdata, flags, rc):
+    client.subscribe(EVENT_TOPIC)
+    log(f"[EVENTS] subscribed to {EVENT_TOPIC} (rc={rc})")
+
+def on_mqtt_message(client, userdata, msg):
+    parts = msg.topic.split("/")
+    if len(parts) < 5:
+        return
+    room, kind = parts[2], parts[4]
+    now = datetime.now(UTC)
+    if kind == "state":
+        try:
+            data = json.loads(msg.payload.decode("utf-8", "ignore"))
+            value = parse_motion(data.get("motion")) if isinstance(data, dict) else 0
+        except (ValueError, TypeError):
+            value = 0
+        with _state_lock:
+            _last_motion[room] = now
+            if value:
+                _last_start[room] = now
+            _dirty_rooms.add(room)
+            w = _windows.get(room)
+            if w is not None:
+                w.add(now.timestamp(), value)
+            if room in _seeding:
+                _seeding[room].append((now.timestamp(), value))
+    elif kind == "health":
+        try:
+            data = json.loads(msg.payload.decode("utf-8", "ignore"))
+        except ValueError:
+            return
+        dev = data.get("device") if isinstance(data, dict) else None
+        if not dev:
+            return
+        with _state_lock:
+            _last_hb[dev] = now
+            _dirty_devices.add(dev)
+    else:
+        return
+    _wake.set()
+
+def parse_motion(raw):
+    if isinstance(raw, str):
+        return 1 if raw.lower() in ("1", "true", "on") else 0
+    return 1 if raw else 0
+
+def take_dirty():
+    with _state_lock:
+        rooms, devices = set(_dirty_rooms), set(_dirty_devices)
+        _dirty_rooms.clear()
+        _dirty_devices.clear()
+    return rooms, devices
+
+def remember(state, key, ts):
+    """Keep the newest timestamp for key in an in-memory state dict."""
+    if ts is None:
+        return state.get(key)
+    with _state_lock:
+        cur = state.get(key)
+        if cur is None or ts > cur:
+            state[key] = ts
+            return ts
+        return cur
+
+def parse_utc(ts):
+    try:
+        dt = datetime.fromisoformat(ts)
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=UTC)
+    return dt.astimezone(UTC)
+
+def bootstrap_state(con):
+    for room, ts in room_state.last_motion_all(con).items():
+        remember(_last_motion, room, ts)
+    heartbeat_state(con)
+    log(f"[EVENTS] state bootstrapped: rooms={len(_last_motion)}, devices={len(_last_hb)}")
+
+def schedule(kind, key, at):
+    if at is None:
+        _deadline_at.pop((kind, key), None)
+        return
+    if _deadline_at.get((kind, key)) == at:
+        return
+    _deadline_at[(kind, key)] = at
+    heapq.heappush(_deadlines, (at, kind, key))
+
+def pop_due(now):
+    rooms, devices = set(), set()
+    while _deadlines and _deadlines[0][0] <= now:
+        at, kind, key = heapq.heappop(_deadlines)
+        if _deadline_at.get((kind, key)) != at:
+            continue
+        del _deadline_at[(kind, key)]
+        (rooms if kind == "room" else devices).add(key)
+    return rooms, devices
+
+def next_deadline():
+    while _deadlines:
+        at, kind, key = _deadlines[0]
+        if _deadline_at.get((kind, key)) == at:
+            return at
+        heapq.heappop(_deadlines)
+    return None
+
+def schedule_room(settings, room, last_motion):
+    """Earliest future instant at which a room rule can flip for this last motion."""
+    cfg = get_room_cfg(room, load_config())
+    if last_motion is None:
+        schedule("room", room, None)
+        return
+    last = last_motion.timestamp()
+    candidates = []
+    if cfg.get("enabled", True):
+        inactivity = int(cfg.get("inactivity_sec", 30 * 60))
+        pre_offset = int(cfg.get("prealert_offset_sec", 5 * 60))
+        candidates += [last + inactivity - pre_offset, last + inactivity]
+    if room in critical_rooms(settings):
+        candidates.append(last + 60 * dwell_minutes(settings, room))
+    if has_open_alert_room(None, "NIGHT_ACTIVITY", room):
+        night = night_bounds(settings, datetime.now().astimezone())
+        if night:
+            candidates.append(night[1].timestamp())
+    now = time.time()
+    future = [t + _DEADLINE_EPS for t in candidates if t + _DEADLINE_EPS > now]
+    schedule("room", room, min(future) if future else None)
+
+def get_settings(con):
+    return prealert_config.rule_settings(con)
+
+def config_version(con):
+    """Changes when prealert_config.json or rule_settings changed."""
+    return prealert_config.config_stamp(), prealert_config.settings_version(con)
+
+def wait_for_work(con, timeout, version):
+    """Sleep until an event, the timeout or a config change; True on config change."""
+    end = time.monotonic() + max(0.0, timeout)
+    while True:
+        left = end - time.monotonic()
+        if _wake.wait(timeout=max(0.0, min(left, CONFIG_POLL_SEC))) or left <= 0:
+            return False
+        try:
+            if config_version(con) != version:
+                return True
+        except sqlite3.Error:
+            pass
 
 def get_rooms(con):
     cur = con.cursor()
@@ -55,104 +272,187 @@ def get_rooms(con):
 def get_last_motion(con, room: str):
     """
     Возвращает последний момент движения (datetime, UTC-aware) по комнате.
-    Сначала через devices (device->room), затем fallback по messages_raw topic.
+    Сначала room_state (точечное чтение), затем motion_intervals,
+    затем fallback по raw archive topic.
     """
-    cur = con.cursor()
-    cur.execute("""
-        SELECT MAX(m.ts_utc)
-          FROM motion_events m
-          JOIN devices d ON m.device_id = d.device_id
-         WHERE d.room = ?
-    """, (room,))
-    ts = cur.fetchone()[0]
-    if ts:
-        try:
-            dt = datetime.fromisoformat(ts)
-            if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=UTC)
-            return dt.astimezone(UTC)
-        except Exception:
-            pass
-
-    cur.execute("""
-        SELECT MAX(ts_utc)
-          FROM messages_raw
-         WHERE topic = ?
-    """, (f"iot/eldercare/{room}/motion/state",))
-    ts2 = cur.fetchone()[0]
+    last, known = room_state.last_motion(con, room)
+    if last:
+        return remember(_last_motion, room, last)
+    if not known:
+        last = motion_intervals.last_motion(con, room)
+        if last:
+            return remember(_last_motion, room, last)
+
+    ts2 = raw_archive.last_ts(con, f"iot/eldercare/{room}/motion/state")
     if ts2:
         try:
             dt2 = datetime.fromisoformat(ts2)
             if dt2.tzinfo is None:
                 dt2 = dt2.replace(tzinfo=UTC)
-            return dt2.astimezone(UTC)
+            return remember(_last_motion, room, dt2.astimezone(UTC))
         except Exception:
             pass
 
-    return None
-
-def open_alert(con, rule, room, details, severity="medium"):
-    cur = con.cursor()
-    cur.execute("""
-        INSERT INTO alerts (ts_utc, room, device_id, type, severity, details, status, rule, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
-    """, (now_utc_str(), room, f"{room}_dev", rule, severity, details, "open", rule, now_utc_str()))
-    con.commit()
-    log(f"⚠️  Opened alert {rule} for {room}: {details}")
-
-def close_alert(con, rule, room):
-    cur = con.cursor()
-    cur.execute("SELECT id FROM alerts WHERE room=? AND rule=? AND status='open';", (room, rule))
-    row = cur.fetchone()
-    if row:
-        cur.execute("UPDATE alerts SET status='closed', closed_at=? WHERE id=?;", (now_utc_str(), row[0]))
+    return _last_motion.get(room)
+
+ALERT_INDEX_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_alerts_rule_room_status ON alerts(rule, room, status);
+CREATE INDEX IF NOT EXISTS idx_alerts_rule_dev_status ON alerts(rule, device_id, status);
+CREATE TABLE IF NOT EXISTS meta (
+  key TEXT PRIMARY KEY,
+  value INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO meta(key, value) VALUES ('alerts_version', 0);
+CREATE TRIGGER IF NOT EXISTS trg_alerts_version_ins AFTER INSERT ON alerts
+BEGIN
+  UPDATE meta SET value = value + 1 WHERE key = 'alerts_version';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_alerts_version_upd AFTER UPDATE OF status ON alerts
+BEGIN
+  UPDATE meta SET value = value + 1 WHERE key = 'alerts_version';
+END;
+"""
+
+# One open alert per (rule, room, device). Created once: duplicates left by
+# older versions are closed first (all but the newest), each one logged.
+OPEN_ALERT_INDEX = """
+CREATE UNIQUE INDEX ux_alerts_open
+  ON alerts(COALESCE(rule, type), COALESCE(room, ''), COALESCE(device_id, '')) WHERE status = 'open'
+"""
+
+def ensure_alert_index(con):
+    con.executescript(ALERT_INDEX_SCHEMA)
+    if con.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ux_alerts_open'").fetchone():
+        return
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        if not con.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ux_alerts_open'").fetchone():
+            dupes = con.execute("""
+                SELECT id, COALESCE(rule, type), room, device_id FROM alerts
+                 WHERE status = 'open' AND id NOT IN (
+                   SELECT MAX(id) FROM alerts WHERE status = 'open'
+                    GROUP BY COALESCE(rule, type), COALESCE(room, ''), COALESCE(device_id, ''))
+            """).fetchall()
+            for alert_id, rule, room, device_id in dupes:
+                log(f"[ALERTS] closing duplicate open alert #{alert_id} {rule} room={room} device={device_id}")
+            con.executemany("UPDATE alerts SET status = 'closed', closed_at = COALESCE(closed_at, ?) WHERE id = ?",
+                            [(now_utc_str(), d[0]) for d in dupes])
+            con.execute(OPEN_ALERT_INDEX)
         con.commit()
-        log(f"✅ Closed alert {rule} for {room}")
+    except sqlite3.Error:
+        con.rollback()
+        raise
+
+def alert_key(rule, room, device_id):
+    return (rule, "room", room) if room is not None else (rule, "device", device_id)
+
+def alerts_version(con):
+    row = con.execute("SELECT value FROM meta WHERE key='alerts_version';").fetchone()
+    return row[0] if row else 0
+
+def load_open_alerts(con):
+    global _alerts_version, _alert_changes
+    _open_alerts.clear()
+    rows = con.execute("""
+        SELECT id, COALESCE(rule, type), room, device_id FROM alerts WHERE status='open' ORDER BY id;
+    """)
+    for alert_id, rule, room, device_id in rows:
+        _open_alerts[alert_key(rule, room, device_id)] = alert_id
+    _alerts_version = alerts_version(con)
+    _alert_changes = 0
+
+def sync_open_alerts(con):
+    """Reload the index if someone else (API close/ack, bulk close) changed alerts."""
+    if alerts_version(con) != _alerts_version:
+        load_open_alerts(con)
+        log(f"[ALERTS] open-alert index reloaded ({len(_open_alerts)} open)")
+
+def notify_wake():
+    global _wake_sock
+    if not NOTIFY_WAKE_PORT:
+        return
+    try:
+        if _wake_sock is None:
+            _wake_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        _wake_sock.sendto(b"alert", ("127.0.0.1", NOTIFY_WAKE_PORT))
+    except OSError as e:
+        log(f"[NOTIFY] wake signal failed: {e}")
+
+def commit_cycle(con):
+    """Commit every alert change of this evaluation cycle in one transaction."""
+    global _alerts_version, _alert_changes, _alerts_opened
+    if con.in_transaction:
+        con.commit()
+    if _alerts_opened:
+        _alerts_opened = 0
+        notify_wake()
+    if _alert_changes:
+        v = alerts_version(con)
+        if v == _alerts_version + _alert_changes:
+            _alerts_version = v  # only our own changes; otherwise next sync reloads
+        _alert_changes = 0
+
+def rollback_cycle(con):
+    global _alerts_opened
+    con.rollback()
+    _alerts_opened = 0
+    load_open_alerts(con)
+    pattern_baseline.forget()
+    if _owned:
+        _owned.clear()  # lease renewals were rolled back too; re-acquire next cycle
+        log("[SHARDS] cycle rolled back, re-acquiring leases")
+
+def _insert_alert(con, rule, room, device_id, details, severity):
+    global _alert_changes, _alerts_opened
+    # ux_alerts_open keeps one open alert per (rule, room, device): if another
+    # process got there first, adopt its row instead of opening a second one
+    cur = con.execute("""
+        INSERT OR IGNORE INTO alerts (ts_utc, room, device_id, type, severity, details, status, rule, created_at, ts_ms)
+        VALUES (?, ?, ?, ?, ?, ?, 'open', ?, ?, ?);
+    """, (now_utc_str(), room, device_id, rule, severity, details, rule, now_utc_str(), timestamps.now_ms()))
+    if cur.rowcount == 0:
+        row = con.execute("""
+            SELECT id FROM alerts
+             WHERE status = 'open' AND COALESCE(rule, type) = ?
+               AND COALESCE(room, '') = COALESCE(?, '') AND COALESCE(device_id, '') = COALESCE(?, '')
+        """, (rule, room, device_id)).fetchone()
+        if row:
+            _open_alerts[alert_key(rule, room, device_id)] = row[0]
+        return
+    _open_alerts[alert_key(rule, room, device_id)] = cur.lastrowid
+    _alert_changes += 1
+    _alerts_opened += 1
+
+def _close_alert(con, key):
+    global _alert_changes
+    alert_id = _open_alerts.pop(key, None)
+    if alert_id is None:
+        return False
+    con.execute("UPDATE alerts SET status='closed', closed_at=? WHERE id=? AND status='open';",
+                (now_utc_str(), alert_id))
+    _alert_changes += 1
+    return True
 
 def has_open_alert_room(con, rule, room):
-    cur = con.cursor()
-    cur.execute("SELECT COUNT(*) FROM alerts WHERE room=? AND rule=? AND status='open';", (room, rule))
-    return cur.fetchone()[0] > 0
+    return alert_key(rule, room, None) in _open_alerts
 
 def open_alert_room(con, rule, room, details, severity="medium"):
-    cur = con.cursor()
-    cur.execute("""
-        INSERT INTO alerts (ts_utc, room, device_id, type, severity, details, status, rule, created_at)
-        VALUES (?, ?, NULL, ?, ?, ?, 'open', ?, ?);
-    """, (now_utc_str(), room, rule, severity, details, rule, now_utc_str()))
-    con.commit()
+    _insert_alert(con, rule, room, None, details, severity)
     log(f"⚠️  Opened alert {rule} for room={room}: {details}")
 
 def close_alert_room(con, rule, room):
-    cur = con.cursor()
-    cur.execute("SELECT id FROM alerts WHERE room=? AND rule=? AND status='open';", (room, rule))
-    row = cur.fetchone()
-    if row:
-        cur.execute("UPDATE alerts SET status='closed', closed_at=? WHERE id=?;", (now_utc_str(), row[0]))
-        con.commit()
+    if _close_alert(con, alert_key(rule, room, None)):
         log(f"✅ Closed alert {rule} for room={room}")
 
 def has_open_alert_device(con, rule, device_id):
-    cur = con.cursor()
-    cur.execute("SELECT COUNT(*) FROM alerts WHERE device_id=? AND rule=? AND status='open';", (device_id, rule))
-    return cur.fetchone()[0] > 0
+    return alert_key(rule, None, device_id) in _open_alerts
 
 def open_alert_device(con, rule, device_id, details, severity="medium"):
-    cur = con.cursor()
-    cur.execute("""
-        INSERT INTO alerts (ts_utc, room, device_id, type, severity, details, status, rule, created_at)
-        VALUES (?, NULL, ?, ?, ?, ?, 'open', ?, ?);
-    """, (now_utc_str(), device_id, rule, severity, details, rule, now_utc_str()))
-    con.commit()
+    _insert_alert(con, rule, None, device_id, details, severity)
     log(f"⚠️  Opened alert {rule} for device={device_id}: {details}")
 
 def close_alert_device(con, rule, device_id):
-    cur = con.cursor()
-    cur.execute("SELECT id FROM alerts WHERE device_id=? AND rule=? AND status='open';", (device_id, rule))
-    row = cur.fetchone()
-    if row:
-        cur.execute("UPDATE alerts SET status='closed', closed_at=? WHERE id=?;", (now_utc_str(), row[0]))
-        con.commit()
+    if _close_alert(con, alert_key(rule, None, device_id)):
         log(f"✅ Closed alert {rule} for device={device_id}")
 
 def publish_prealert_start(room, ttl_sec=300):
@@ -168,7 +468,7 @@ def publish_prealert_stop(room):
     log(f"[PREALERT] publish stop  → {topic} {json.dumps(payload)}")
 
 def maybe_send_prealert(room: str, now_epoch: float, last_motion_epoch: float):
-    cfg = get_room_cfg(room, config_cache)
+    cfg = get_room_cfg(room, load_config())
     if not cfg.get("enabled", True):
         return
     if in_night_window(cfg):
@@ -189,20 +489,139 @@ def maybe_send_prealert(room: str, now_epoch: float, last_motion_epoch: float):
     publish_prealert_start(room, ttl_sec=ttl)
     _last_prealert_sent[room] = time.monotonic()
 
-def check_inactivity(con, settings, room):
-    cfg = get_room_cfg(room, config_cache)
+# Rule registry: every rule declares its scope ("room" or "device") and the
+# datasets it reads. Once per cycle the engine loads each dataset needed by at
+# least one rule, in bulk for all rooms/devices of the cycle, into a snapshot
+# dict and runs every rule against it. Open alerts are always available via
+# the in-memory index (has_open_alert_*).
+RULES = {}     # name -> (scope, needs, fn)
+DATASETS = {}  # name -> fn(con, snap, rooms, devices) -> {key: value}
+
+def rule(name, scope="room", needs=()):
+    def register(fn):
+        RULES[name] = (scope, tuple(needs), fn)
+        return fn
+    return register
+
+def dataset(name):
+    def register(fn):
+        DATASETS[name] = fn
+        return fn
+    return register
+
+@dataset("last_motion")
+def load_last_motion(con, snap, rooms, devices):
+    """Last motion per room: one room_state read merged with in-memory events."""
+    for room, ts in room_state.last_motion_all(con).items():
+        remember(_last_motion, room, ts)
+    with _state_lock:
+        last = {room: _last_motion.get(room) for room in rooms}
+    for room in rooms:
+        if last[room] is None:
+            last[room] = get_last_motion(con, room)
+    return last
+
+@dataset("dwell")
+def load_dwell(con, snap, rooms, devices):
+    """(motion reports, motion seconds) over the dwell window of each critical room."""
+    settings = snap["settings"]
+    critical = [r for r in rooms if r in critical_rooms(settings)]
+    minutes = {room: dwell_minutes(settings, room) for room in critical}
+    if EVENT_MODE:
+        return {room: dwell_totals(con, settings, room, minutes[room]) for room in critical}
+    if not critical:
+        return {}
+    # polling mode: one scan over the widest window, cut per room in Python
+    since = {room: motion_intervals.window_start(int(m)) for room, m in minutes.items()}
+    counts = {room: 0.0 for room in critical}
+    for room, start_utc, end_utc, samples in motion_intervals.samples_by_room(
+            con, motion_intervals.iso_utc(min(since.values()))):
+        if room in counts:
+            counts[room] += motion_intervals.samples_in(start_utc, end_utc, samples, since[room])
+    return {room: (round(n), 0.0) for room, n in counts.items()}
+
+@dataset("night_motion")
+def load_night_motion(con, snap, rooms, devices):
+    """Last value=1 report per night.rooms room since the night started; {} by day."""
+    watched = [r for r in rooms if r in night_rooms(snap["settings"])]
+    if not watched:
+        return {}
+    night = night_bounds(snap["settings"], snap["now"].astimezone())
+    if not night:
+        return {}
+    for room, ts in motion_intervals.last_start_by_room(con, night[0]).items():
+        remember(_last_start, room, ts)
+    with _state_lock:
+        return {room: _last_start[room] for room in watched
+                if room in _last_start and _last_start[room] >= night[0]}
+
+@dataset("heartbeats")
+def load_heartbeats(con, snap, rooms, devices):
+    if devices is None:
+        return {d: ts for d, ts in heartbeat_state(con).items() if owns_device(d)}
+    with _state_lock:
+        return {d: _last_hb[d] for d in devices if d in _last_hb}
+
+def pattern_shards():
+    """(meta key, shard) pairs of the baselines this process folds."""
+    if SHARDS == 1:
+        return [("baseline_hour", None)]
+    return [(f"baseline_hour.{shard}/{SHARDS}", shard) for shard in sorted(_owned)]
+
+def pattern_due():
+    return any(pattern_baseline.due(key) for key, _ in pattern_shards())
+
+@dataset("pattern")
+def load_pattern(con, snap, rooms, devices):
+    """z-scores of the last completed hour per room; folds new hours in when due."""
+    if pattern_due():
+        window_days = float(snap["settings"].get("pattern.window_days", 14))
+        all_rooms = get_rooms(con)
+        for key, shard in pattern_shards():
+            shard_rooms = [r for r in all_rooms if shard is None or leases.partition_of(r, SHARDS) == shard]
+            pattern_baseline.fold(con, shard_rooms, window_days, key)
+    return pattern_baseline.last_eval()
+
+def take_snapshot(con, settings, rooms, devices=None):
+    """Load every dataset the registered rules need, once; devices=None means all."""
+    snap = {"now": datetime.now(UTC), "settings": settings}
+    needs = set()
+    for scope, rule_needs, _ in RULES.values():
+        if scope == "room" and rooms or scope == "device" and devices != set():
+            needs.update(rule_needs)
+    for name in sorted(needs):
+        snap[name] = DATASETS[name](con, snap, rooms, devices)
+    return snap
+
+def run_rules(con, settings, rooms, devices=None):
+    """One cycle: snapshot, every room rule per room, every device rule per device."""
+    snap = take_snapshot(con, settings, rooms, devices)
+    for room in rooms:
+        for scope, _, fn in RULES.values():
+            if scope == "room":
+                fn(con, snap, room)
+        last = snap.get("last_motion", {}).get(room)
+        if last:
+            maybe_send_prealert(room, snap["now"].timestamp(), last.timestamp())
+        if EVENT_MODE:
+            schedule_room(settings, room, last)
+    for device in snap.get("heartbeats", {}):
+        for scope, _, fn in RULES.values():
+            if scope == "device":
+                fn(con, snap, device)
+
+@rule("INACTIVITY", needs=("last_motion",))
+def check_inactivity(con, snap, room):
+    cfg = get_room_cfg(room, load_config())
     if not cfg.get("enabled", True):
         return
 
-    last_motion = get_last_motion(con, room)
+    last_motion = snap["last_motion"].get(room)
     if not last_motion:
         log(f"[PREALERT] no motion record found for {room}")
         return
 
-    now = datetime.now(UTC)
-    if last_motion.tzinfo is None:
-        last_motion = last_motion.replace(tzinfo=UTC)
-    elapsed = (now - last_motion).total_seconds()
+    elapsed = (snap["now"] - last_motion).total_seconds()
 
     inactivity = int(cfg.get("inactivity_sec", 30 * 60))
     pre_offset = int(cfg.get("prealert_offset_sec", 5 * 60))
@@ -210,10 +629,6 @@ def check_inactivity(con, settings, room):
 
     log(f"[DEBUG] room={room} elapsed={elapsed:.1f}s (inactivity={inactivity}, prealert_offset={pre_offset})")
 
-    if start_window <= elapsed < inactivity and not in_night_window(cfg):
-        ttl = int(max(1, inactivity - elapsed))
-        publish_prealert_start(room, ttl_sec=ttl)
-
     if elapsed > inactivity and not has_open_alert_room(con, "INACTIVITY", room):
         minutes = elapsed / 60.0
         open_alert_room(con, "INACTIVITY", room, f"No motion for {minutes:.1f} min", "high")
@@ -222,74 +637,301 @@ def check_inactivity(con, settings, room):
         close_alert_room(con, "INACTIVITY", room)
         publish_prealert_stop(room)
 
-def check_dwell(con, settings, room):
-    critical_rooms = [r.strip() for r in settings.get("dwell.critical_rooms", "").split(",") if r.strip()]
-    if room not in critical_rooms:
+def critical_rooms(settings):
+    return [r.strip() for r in settings.get("dwell.critical_rooms", "").split(",") if r.strip()]
+
+def dwell_minutes(settings, room):
+    return float(settings.get(f"dwell.{room.lower()}_min", 20))
+
+@rule("DWELL_CRITICAL", needs=("dwell",))
+def check_dwell(con, snap, room):
+    if room not in snap["dwell"]:
         return
-    min_dwell = float(settings.get(f"dwell.{room.lower()}_min", 20))
-    cur = con.cursor()
-    cur.execute("""
-        SELECT COUNT(*)
-          FROM motion_events m
-          JOIN devices d ON m.device_id = d.device_id
-         WHERE d.room = ?
-           AND m.ts_utc >= datetime('now', ?);
-    """, (room, f"-{int(min_dwell)} minutes"))
-    count = cur.fetchone()[0]
-
-    if count > min_dwell and not has_open_alert_room(con, "DWELL_CRITICAL", room):
+    settings = snap["settings"]
+    min_dwell = dwell_minutes(settings, room)
+    count, seconds = snap["dwell"][room]
+    busy = EVENT_MODE and activity_window.continuous(seconds, min_dwell,
+                                                     60 * float(settings.get("dwell.gap_min", 5)))
+
+    if (count > min_dwell or busy) and not has_open_alert_room(con, "DWELL_CRITICAL", room):
         open_alert_room(con, "DWELL_CRITICAL", room, f"High activity for {int(min_dwell)} min", "medium")
-    elif count < 1 and has_open_alert_room(con, "DWELL_CRITICAL", room):
+    elif count < 1 and seconds <= 0 and has_open_alert_room(con, "DWELL_CRITICAL", room):
         close_alert_room(con, "DWELL_CRITICAL", room)
 
-def check_heartbeat(con):
-    cur = con.cursor()
-    cur.execute("SELECT device_id, MAX(ts_utc) FROM heartbeats GROUP BY device_id;")
-    rows = cur.fetchall()
-    for device, ts in rows:
-        if not ts:
-            continue
-        try:
-            last = datetime.fromisoformat(ts)
-            if last.tzinfo is None:
-                last = last.replace(tzinfo=UTC)
-            last = last.astimezone(UTC)
-        except Exception:
-            continue
-        delta = (datetime.now(UTC) - last).total_seconds()
-        if delta > 1800:
-            if not has_open_alert_device(con, "NO_HEARTBEAT", device):
-                open_alert_device(con, "NO_HEARTBEAT", device, f"No heartbeat for {int(delta)}s", "high")
+def dwell_totals(con, settings, room, minutes):
+    """(motion reports, motion seconds) of the room's dwell window, O(1) once seeded."""
+    gap_sec = 60 * float(settings.get("dwell.gap_min", 5))
+    now = datetime.now(UTC)
+    with _state_lock:
+        w = _windows.get(room)
+        if w is not None and (w.size, w.gap_sec) == (activity_window.window_size(minutes), gap_sec):
+            return w.totals(now.timestamp())
+        _seeding[room] = []
+    try:
+        rows = activity_window.seed_rows(con, room, minutes, now)
+    except sqlite3.Error:
+        with _state_lock:
+            _seeding.pop(room, None)
+        raise
+    w = activity_window.from_rows(rows, minutes, gap_sec, now)
+    with _state_lock:
+        w.catch_up(_seeding.pop(room, []))
+        _windows[room] = w
+        return w.totals(now.timestamp())
+
+NIGHT_WINDOW_DEFAULT = "23:00-06:00"
+_bad_night_specs = set()   # malformed night.window values already warned about
+
+def night_bounds(settings, now_local):
+    """(start, end) local datetimes of the night (rule_settings night.window)
+    that now_local falls into, or None during the day."""
+    spec = settings.get("night.window", NIGHT_WINDOW_DEFAULT)
+    try:
+        t_from, t_to = prealert_config.night_spec(spec)
+    except ValueError as e:
+        if spec not in _bad_night_specs:
+            _bad_night_specs.add(spec)
+            log(f"[WARN] night.window {e}, using {NIGHT_WINDOW_DEFAULT}")
+        t_from, t_to = prealert_config.night_spec(NIGHT_WINDOW_DEFAULT)
+    start = now_local.replace(hour=t_from.hour, minute=t_from.minute, second=0, microsecond=0)
+    if start > now_local:
+        start -= timedelta(days=1)
+    end = start.replace(hour=t_to.hour, minute=t_to.minute)
+    if end <= start:
+        end += timedelta(days=1)
+    return (start, end) if now_local < end else None
+
+def night_rooms(settings):
+    """Rooms watched by NIGHT_ACTIVITY (rule_settings night.rooms); none if unset."""
+    return [r.strip() for r in settings.get("night.rooms", "").split(",") if r.strip()]
+
+@rule("NIGHT_ACTIVITY", needs=("night_motion",))
+def check_night_activity(con, snap, room):
+    """Motion (a value=1 report) during the night window in one of night.rooms;
+    the alert closes when the night is over."""
+    settings = snap["settings"]
+    if room not in night_rooms(settings):
+        return
+    night = night_bounds(settings, snap["now"].astimezone())
+    last = snap["night_motion"].get(room)
+    if night and last:
+        if not has_open_alert_room(con, "NIGHT_ACTIVITY", room):
+            local = last.astimezone().strftime("%H:%M")
+            open_alert_room(con, "NIGHT_ACTIVITY", room, f"Motion at night ({local})", "low")
+    elif not night and has_open_alert_room(con, "NIGHT_ACTIVITY", room):
+        close_alert_room(con, "NIGHT_ACTIVITY", room)
+
+@rule("PATTERN_ANOMALY", needs=("pattern",))
+def check_pattern(con, snap, room):
+    ev = snap["pattern"].get(room)
+    if ev is None:
+        return
+    z, count, mean, std, hour = ev
+    threshold = float(snap["settings"].get("pattern.z_threshold", 2.5))
+    if abs(z) > threshold and not has_open_alert_room(con, "PATTERN_ANOMALY", room):
+        open_alert_room(con, "PATTERN_ANOMALY", room,
+                        f"{count} motion reports at {hour:02d}:00, usual {mean:.1f}±{std:.1f} (z={z:.1f})",
+                        "medium")
+    elif abs(z) <= threshold and has_open_alert_room(con, "PATTERN_ANOMALY", room):
+        close_alert_room(con, "PATTERN_ANOMALY", room)
+
+def heartbeat_state(con):
+    """Last heartbeat per device: device_status merged with in-memory events."""
+    for device, ts in device_status.last_seen_all(con).items():
+        remember(_last_hb, device, ts)
+    with _state_lock:
+        return dict(_last_hb)
+
+@rule("NO_HEARTBEAT", scope="device", needs=("heartbeats",))
+def check_heartbeat(con, snap, device):
+    last = snap["heartbeats"].get(device)
+    if last is None:
+        return
+    expiry = last.timestamp() + HB_TIMEOUT_SEC + _DEADLINE_EPS
+    schedule("device", device, expiry if expiry > time.time() else None)
+    delta = (snap["now"] - last).total_seconds()
+    if delta > HB_TIMEOUT_SEC:
+        if not has_open_alert_device(con, "NO_HEARTBEAT", device):
+            open_alert_device(con, "NO_HEARTBEAT", device, f"No heartbeat for {int(delta)}s", "high")
+    else:
+        if has_open_alert_device(con, "NO_HEARTBEAT", device):
+            close_alert_device(con, "NO_HEARTBEAT", device)
+
+def owns_room(room):
+    return SHARDS == 1 or leases.partition_of(room, SHARDS) in _owned
+
+def owns_device(device_id):
+    return SHARDS == 1 or leases.partition_of(device_id, SHARDS) in _owned
+
+def lease_step(con):
+    """Renew, hand back and take shard leases; the renewal is the first write of
+    the cycle transaction and raises LeaseLost if any shard was taken over.
+    Returns True when the set of owned shards changed."""
+    now = time.time()
+    before = set(_owned)
+    lost = leases.renew(con, _owned, _owner, LEASE_TTL, now)
+    if lost:
+        raise leases.LeaseLost(f"lost lease for shard(s) {sorted(lost)}")
+    for shard in leases.wanted(con, _owner):
+        if shard != _preferred and shard in _owned:
+            leases.release(con, shard, _owner, now)
+            _owned.pop(shard)
+            log(f"[SHARDS] handed shard {shard} back")
+    if _preferred is not None and _preferred not in _owned:
+        generation = leases.acquire(con, _preferred, _owner, LEASE_TTL, now)
+        if generation is None:
+            leases.want(con, _preferred, _owner)
         else:
-            if has_open_alert_device(con, "NO_HEARTBEAT", device):
-                close_alert_device(con, "NO_HEARTBEAT", device)
+            _owned[_preferred] = generation
+    if time.monotonic() - _started >= LEASE_TTL:
+        for shard in leases.expired(con, _owner, LEASE_TTL, now):
+            if shard not in _owned:
+                generation = leases.acquire(con, shard, _owner, LEASE_TTL, now)
+                if generation is not None:
+                    _owned[shard] = generation
+    if set(_owned) != before:
+        log(f"[SHARDS] {_owner} now owns shard(s) {sorted(_owned)} of {SHARDS}")
+        return True
+    return False
+
+def release_leases(con):
+    for shard in list(_owned):
+        leases.release(con, shard, _owner, 0)
+    _owned.clear()
+    con.commit()
 
-def main():
-    log("Rules Engine started.")
+def build_args(argv=None):
+    p = argparse.ArgumentParser(description="Eldercare rules engine")
+    p.add_argument("--shards", type=int, default=int(os.getenv("RULES_SHARDS", "1")),
+                   help="number of room/device shards shared by all engine processes")
+    p.add_argument("--shard", type=int, default=None,
+                   help="shard this process normally owns (default: standby, adopts expired shards)")
+    p.add_argument("--processes", type=int, default=0,
+                   help="spawn and supervise this many engine processes: one per shard, the rest standbys")
+    return p.parse_args(argv)
+
+def run_pool(shards, processes):
+    """Supervise engine processes; a crashed one is restarted while a standby covers its shard."""
+    procs = {}
+    stopping = threading.Event()
+
+    def spawn(i):
+        argv = ["--shards", str(shards)] + (["--shard", str(i)] if i < shards else [])
+        p = multiprocessing.Process(target=main, args=(argv,), name=f"rules-engine-{i}")
+        p.start()
+        procs[i] = p
+        log(f"[SHARDS] engine {i} started pid={p.pid}" + ("" if i < shards else " (standby)"))
+
+    def shutdown(signum, frame):
+        stopping.set()
+        for p in procs.values():
+            if p.is_alive():
+                p.terminate()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for i in range(processes):
+        spawn(i)
+    while not stopping.is_set():
+        for i, p in list(procs.items()):
+            p.join(timeout=0.5)
+            if p.exitcode is not None and not stopping.is_set():
+                log(f"[SHARDS] engine {i} exited with {p.exitcode}, restarting")
+                time.sleep(3)
+                spawn(i)
+    for p in procs.values():
+        p.join()
+
+def main(argv=None):
+    global SHARDS, _preferred, _owner, _started
+    _started = time.monotonic()  # per process: --processes children must not inherit it
+    args = build_args(argv)
+    SHARDS = max(1, args.shards)
+    if args.processes > 1:
+        run_pool(SHARDS, args.processes)
+        return
+    _preferred = args.shard if SHARDS > 1 else None
+    _owner = f"{socket.gethostname()}:{os.getpid()}"
+    log("Rules Engine started." + (f" shards={SHARDS} shard={_preferred} owner={_owner}" if SHARDS > 1 else ""))
     init_mqtt_once()
 
+    con = storage.get_conn()
+    timestamps.ensure_schema(con, log=log)
+    motion_intervals.ensure_schema(con)
+    motion_intervals.backfill(con, log=log)   # the engine may start before the logger
+    room_state.ensure_schema(con)
+    room_state.rebuild(con, log=log)
+    device_status.ensure_schema(con)
+    device_status.rebuild(con, log=log)
+    ensure_alert_index(con)
+    if SHARDS > 1:
+        leases.ensure_schema(con, SHARDS)
+    prealert_config.ensure_settings_schema(con)
+    pattern_baseline.ensure_schema(con)
+    pattern_baseline.rebuild(con, float(get_settings(con).get("pattern.window_days", 14)), log=log)
+    load_open_alerts(con)
+    if EVENT_MODE:
+        bootstrap_state(con)
+
+    def shutdown(signum, frame):
+        raise SystemExit(0)  # run the finally below: hand leases over right away
+
+    signal.signal(signal.SIGTERM, shutdown)
+    try:
+        run_loop(con)
+    finally:
+        if _owned:
+            release_leases(con)
+
+def run_loop(con):
+    last_full = 0.0
+    config_changed = False
     while True:
-        con = sqlite3.connect(DB_PATH)
+        full = (not EVENT_MODE or config_changed or pattern_due()
+                or time.monotonic() - last_full >= SAFETY_INTERVAL)
+        _wake.clear()
+        rooms_dirty, devices_dirty = take_dirty()
+        if EVENT_MODE:
+            rooms_due, devices_due = pop_due(time.time())
+            rooms_dirty |= rooms_due
+            devices_dirty |= devices_due
         try:
-            settings = get_settings()
-            rooms = get_rooms(con)
-
-            for room in rooms:
-                check_inactivity(con, settings, room)
-                check_dwell(con, settings, room)
-
-                last = get_last_motion(con, room)
-                if last:
-                    now_epoch = time.time()
-                    last_epoch = last.timestamp()
-                    maybe_send_prealert(room, now_epoch, last_epoch)
-
-            check_heartbeat(con)
-        finally:
-            con.close()
-
-        log("Cycle completed. Sleeping...\n")
-        time.sleep(CHECK_INTERVAL)
+            if SHARDS > 1 and lease_step(con):
+                full = True
+                pattern_baseline.forget()
+            version = config_version(con)
+            sync_open_alerts(con)
+            settings = get_settings(con)
+            rooms = [r for r in (get_rooms(con) if full else sorted(rooms_dirty)) if owns_room(r)]
+            run_rules(con, settings, rooms, None if full else {d for d in devices_dirty if owns_device(d)})
+            commit_cycle(con)
+        except leases.LeaseLost as e:
+            log(f"[SHARDS] {e}")
+            rollback_cycle(con)
+            version = None
+        except sqlite3.Error as e:
+            rollback_cycle(con)
+            version = None
+            log(f"[ERROR] DB error in cycle: {e}")
+
+        if not EVENT_MODE:
+            log("Cycle completed. Sleeping...\n")
+            time.sleep(CHECK_INTERVAL)
+            continue
+        if full:
+            last_full = time.monotonic()
+            log("Cycle completed. Waiting for events/deadlines...\n")
+        timeout = SAFETY_INTERVAL - (time.monotonic() - last_full)
+        nd = next_deadline()
+        if nd is not None:
+            timeout = min(timeout, nd - time.time())
+        timeout = min(timeout, pattern_baseline.next_fold_at() - time.time())
+        if SHARDS > 1:
+            timeout = min(timeout, LEASE_TTL / 3)
+        config_changed = wait_for_work(con, timeout, version)
+        if config_changed:
+            log("[CONFIG] configuration changed, re-evaluating all rooms")
 
 if __name__ == "__main__":
     main()
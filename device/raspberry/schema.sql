@@ -26,6 +26,20 @@ CREATE INDEX IF NOT EXISTS idx_raw_topic ON messages_raw(topic);
 CREATE INDEX IF NOT EXISTS idx_raw_dev_ts ON messages_raw(device_id, ts_utc);
 CREATE INDEX IF NOT EXISTS idx_devices_room on devices(room);
 
+-- compact raw archive (RAW_ARCHIVE_MODE=compact, see raw_archive.py)
+CREATE TABLE IF NOT EXISTS raw_topics (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  topic TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages_archive (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  ts_utc TEXT NOT NULL,
+  topic_id INTEGER NOT NULL REFERENCES raw_topics(id),
+  device_id TEXT,
+  payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_archive_topic_ts ON messages_archive(topic_id, ts_utc);
+
 CREATE TABLE IF NOT EXISTS heartbeats (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   ts_utc TEXT NOT NULL,
@@ -43,6 +57,50 @@ CREATE TABLE IF NOT EXISTS motion_events (
 );
 CREATE INDEX IF NOT EXISTS idx_motion_dev_ts ON motion_events(device_id, ts_utc);
 
+CREATE TABLE IF NOT EXISTS motion_intervals (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  device_id TEXT NOT NULL,
+  room TEXT,
+  start_utc TEXT NOT NULL,
+  end_utc TEXT NOT NULL,
+  is_open INTEGER NOT NULL DEFAULT 1,
+  samples INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_intervals_room_end ON motion_intervals(room, end_utc);
+CREATE INDEX IF NOT EXISTS idx_intervals_open ON motion_intervals(device_id) WHERE is_open = 1;
+CREATE INDEX IF NOT EXISTS idx_intervals_open_room ON motion_intervals(room) WHERE is_open = 1;
+
+-- materialized per-room state (see room_state.py); device_count is kept by triggers
+CREATE TABLE IF NOT EXISTS room_state (
+  room TEXT PRIMARY KEY,
+  last_motion_utc TEXT,
+  last_hb_utc TEXT,
+  device_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS room_motion_hourly (
+  room TEXT NOT NULL,
+  hour TEXT NOT NULL,
+  count INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (room, hour)
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS trg_room_state_dev_ins AFTER INSERT ON devices
+WHEN NEW.room IS NOT NULL
+BEGIN
+  INSERT INTO room_state(room, device_count) VALUES (NEW.room, 1)
+  ON CONFLICT(room) DO UPDATE SET device_count = device_count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_room_state_dev_upd AFTER UPDATE OF room ON devices
+WHEN OLD.room IS NOT NEW.room
+BEGIN
+  UPDATE room_state SET device_count = MAX(0, device_count - 1) WHERE room = OLD.room;
+  INSERT INTO room_state(room, device_count) SELECT NEW.room, 1 WHERE NEW.room IS NOT NULL
+  ON CONFLICT(room) DO UPDATE SET device_count = device_count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_room_state_dev_del AFTER DELETE ON devices
+BEGIN
+  UPDATE room_state SET device_count = MAX(0, device_count - 1) WHERE room = OLD.room;
+END;
+
 CREATE TABLE IF NOT EXISTS alerts (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   ts_utc TEXT NOT NULL,
@@ -85,6 +143,7 @@ INSERT OR IGNORE INTO rule_settings (key, value) VALUES
 ('inactive.threshold_day_min', '45'),
 ('inactive.threshold_night_min', '180'),
 ('night.window', '23:00-06:00'),
+('night.rooms', 'Bedroom,Hallway,Kitchen'),
 ('pattern.window_days', '14'),
 ('pattern.z_threshold', '2.5'),
 ('dwell.critical_rooms', 'Bathroom,Kitchen'),
@@ -101,3 +160,118 @@ CREATE TABLE IF NOT EXISTS notifications_log (
     details TEXT,
     FOREIGN KEY(alert_id) REFERENCES alerts(id)
 );
+
+CREATE INDEX IF NOT EXISTS idx_alerts_rule_room_status ON alerts(rule, room, status);
+CREATE INDEX IF NOT EXISTS idx_alerts_rule_dev_status ON alerts(rule, device_id, status);
+
+-- change counters read by the services (alerts_version: open-alert index of rules_engine)
+CREATE TABLE IF NOT EXISTS meta (
+  key TEXT PRIMARY KEY,
+  value INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO meta(key, value) VALUES ('alerts_version', 0);
+INSERT OR IGNORE INTO meta(key, value) VALUES ('room_state_built', 0);
+CREATE TRIGGER IF NOT EXISTS trg_alerts_version_ins AFTER INSERT ON alerts
+BEGIN
+  UPDATE meta SET value = value + 1 WHERE key = 'alerts_version';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_alerts_version_upd AFTER UPDATE OF status ON alerts
+BEGIN
+  UPDATE meta SET value = value + 1 WHERE key = 'alerts_version';
+END;
+
+-- rule_settings cache invalidation (see prealert_config.py)
+INSERT OR IGNORE INTO meta(key, value) VALUES ('rule_settings_version', 0);
+CREATE TRIGGER IF NOT EXISTS trg_rule_settings_version_ins AFTER INSERT ON rule_settings
+BEGIN
+  UPDATE meta SET value = value + 1 WHERE key = 'rule_settings_version';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_rule_settings_version_upd AFTER UPDATE ON rule_settings
+BEGIN
+  UPDATE meta SET value = value + 1 WHERE key = 'rule_settings_version';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_rule_settings_version_del AFTER DELETE ON rule_settings
+BEGIN
+  UPDATE meta SET value = value + 1 WHERE key = 'rule_settings_version';
+END;
+
+-- latest heartbeat per device (see device_status.py); heartbeats itself is downsampled
+CREATE TABLE IF NOT EXISTS device_status (
+  device_id TEXT PRIMARY KEY,
+  last_seen_utc TEXT NOT NULL,
+  last_ip TEXT,
+  last_uptime_ms INTEGER,
+  boot_utc TEXT,
+  reboots INTEGER NOT NULL DEFAULT 0,
+  last_kept_utc TEXT
+);
+
+-- PATTERN_ANOMALY baseline: Welford mean/variance of motion reports per hour (see pattern_baseline.py)
+CREATE TABLE IF NOT EXISTS room_baseline (
+  room TEXT NOT NULL,
+  weekday INTEGER NOT NULL,
+  hour INTEGER NOT NULL,
+  n INTEGER NOT NULL DEFAULT 0,
+  mean REAL NOT NULL DEFAULT 0,
+  m2 REAL NOT NULL DEFAULT 0,
+  PRIMARY KEY (room, weekday, hour)
+) WITHOUT ROWID;
+INSERT OR IGNORE INTO meta(key, value) VALUES ('baseline_hour', 0);
+
+-- one open alert per (rule, room, device), also across sharded engine processes;
+-- on a database that already has duplicates rules_engine closes them (logged) first
+CREATE UNIQUE INDEX IF NOT EXISTS ux_alerts_open
+  ON alerts(COALESCE(rule, type), COALESCE(room, ''), COALESCE(device_id, '')) WHERE status = 'open';
+
+-- rules engine shard leases (see leases.py)
+CREATE TABLE IF NOT EXISTS engine_leases (
+  shard INTEGER PRIMARY KEY,
+  owner TEXT,
+  expires_at REAL NOT NULL DEFAULT 0,
+  generation INTEGER NOT NULL DEFAULT 0,
+  wanted_by TEXT
+);
+
+-- per-channel notification retry queue (see dispatch.py)
+CREATE TABLE IF NOT EXISTS notification_queue (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  alert_id INTEGER NOT NULL,
+  channel TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_at REAL NOT NULL,
+  last_error TEXT,
+  delivered TEXT,
+  UNIQUE (alert_id, channel)
+);
+CREATE INDEX IF NOT EXISTS idx_queue_pending ON notification_queue(next_at) WHERE status = 'pending';
+
+-- UTC epoch milliseconds next to ts_utc, for index range scans (see timestamps.py)
+ALTER TABLE motion_events ADD COLUMN ts_ms INTEGER;
+ALTER TABLE heartbeats ADD COLUMN ts_ms INTEGER;
+ALTER TABLE messages_raw ADD COLUMN ts_ms INTEGER;
+ALTER TABLE alerts ADD COLUMN ts_ms INTEGER;
+CREATE INDEX IF NOT EXISTS idx_motion_events_ts_ms ON motion_events(ts_ms);
+CREATE INDEX IF NOT EXISTS idx_heartbeats_ts_ms ON heartbeats(ts_ms);
+CREATE INDEX IF NOT EXISTS idx_messages_raw_ts_ms ON messages_raw(ts_ms);
+CREATE INDEX IF NOT EXISTS idx_alerts_ts_ms ON alerts(ts_ms);
+CREATE TRIGGER IF NOT EXISTS trg_motion_events_ts_ms AFTER INSERT ON motion_events WHEN NEW.ts_ms IS NULL
+BEGIN
+  UPDATE motion_events SET ts_ms = CAST(strftime('%s', NEW.ts_utc) AS INTEGER) * 1000 WHERE rowid = NEW.rowid;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_heartbeats_ts_ms AFTER INSERT ON heartbeats WHEN NEW.ts_ms IS NULL
+BEGIN
+  UPDATE heartbeats SET ts_ms = CAST(strftime('%s', NEW.ts_utc) AS INTEGER) * 1000 WHERE rowid = NEW.rowid;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_messages_raw_ts_ms AFTER INSERT ON messages_raw WHEN NEW.ts_ms IS NULL
+BEGIN
+  UPDATE messages_raw SET ts_ms = CAST(strftime('%s', NEW.ts_utc) AS INTEGER) * 1000 WHERE rowid = NEW.rowid;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_alerts_ts_ms AFTER INSERT ON alerts WHEN NEW.ts_ms IS NULL
+BEGIN
+  UPDATE alerts SET ts_ms = CAST(strftime('%s', NEW.ts_utc) AS INTEGER) * 1000 WHERE rowid = NEW.rowid;
+END;
+UPDATE motion_events SET ts_ms = CAST(strftime('%s', ts_utc) AS INTEGER) * 1000 WHERE ts_ms IS NULL;
+UPDATE heartbeats SET ts_ms = CAST(strftime('%s', ts_utc) AS INTEGER) * 1000 WHERE ts_ms IS NULL;
+UPDATE messages_raw SET ts_ms = CAST(strftime('%s', ts_utc) AS INTEGER) * 1000 WHERE ts_ms IS NULL;
+UPDATE alerts SET ts_ms = CAST(strftime('%s', ts_utc) AS INTEGER) * 1000 WHERE ts_ms IS NULL;
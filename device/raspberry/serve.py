@@ -0,0 +1,84 @@
+import os
+import argparse
+
+# Production entry point for the API (app.py's app.run is the development
+# server). With gunicorn installed it runs --workers processes with --threads
+# threads each (gthread worker, app imported per worker so every process gets
+# its own read pool and writer); without it, a threaded WSGI server from
+# werkzeug in one process. GET requests read through storage.read_pool()
+# (SQLITE_READ_POOL, keep it >= threads), writes go through storage.writer().
+#
+# Every open /api/stream (SSE) client holds one request thread for as long as it
+# is connected, and a dashboard tab opens two EventSources. With the default
+# 2 workers x 8 threads, 8 open tabs leave no thread for ordinary requests: size
+# --threads for (tabs x 2 / workers) plus the threads the API itself needs.
+#
+# Throughput target, measured with bench_api.py against a copy of the Pi
+# database (see that file): >= 300 req/s at p99 <= 100 ms for the dashboard
+# mix with 16 concurrent clients, with the ingest logger writing at the same time.
+# Measured on a 1-core x86 VM (2 workers x 8 threads, 200 rows/s written
+# alongside): 851 req/s p99 49 ms with ETags, 815 req/s p99 45 ms without.
+
+HOST = os.getenv("API_HOST", "0.0.0.0")
+PORT = int(os.getenv("API_PORT", "5000"))
+WORKERS = int(os.getenv("API_WORKERS", "2"))
+THREADS = int(os.getenv("API_THREADS", "8"))
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # optional, falls back to a single threaded process
+    BaseApplication = None
+
+def log(msg):
+    print(f"[SERVE] {msg}", flush=True)
+
+def build_args(argv=None):
+    p = argparse.ArgumentParser(description="Serve the Eldercare API")
+    p.add_argument("--host", default=HOST)
+    p.add_argument("--port", type=int, default=PORT)
+    p.add_argument("--workers", type=int, default=WORKERS, help="processes (gunicorn only)")
+    p.add_argument("--threads", type=int, default=THREADS, help="request threads per process")
+    return p.parse_args(argv)
+
+def run_gunicorn(args):
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in {
+                "bind": f"{args.host}:{args.port}",
+                "workers": args.workers,
+                "threads": args.threads,
+                "worker_class": "gthread",
+                "preload_app": False,   # connections must not cross fork()
+                "timeout": 60,
+                "graceful_timeout": 10,
+                "keepalive": 5,
+                "accesslog": None,
+            }.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from app import app
+            return app
+
+    Server().run()
+
+def run_threaded(args):
+    from werkzeug.serving import make_server
+    from app import app
+    if args.workers > 1:
+        log("gunicorn not installed: running one process, --workers ignored")
+    server = make_server(args.host, args.port, app, threaded=True)
+    log(f"listening on {args.host}:{args.port} (threaded)")
+    server.serve_forever()
+
+def main(argv=None):
+    args = build_args(argv)
+    os.environ.setdefault("SQLITE_READ_POOL", str(args.threads))
+    if BaseApplication is not None:
+        log(f"gunicorn on {args.host}:{args.port}, {args.workers} worker(s) x {args.threads} thread(s)")
+        run_gunicorn(args)
+    else:
+        run_threaded(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+from datetime import datetime, UTC
+
+# Append-only on-disk spool for ingest records that could not be written to
+# SQLite in time. Records go to numbered JSONL segments; the logger replays
+# sealed segments oldest-first and deletes them once they are committed.
+# status.json next to the segments shows the backlog to operators.
+# A crash in the middle of append() can leave a torn last line; it is logged
+# and cut off when the segment is read, the records before it are kept.
+
+SEGMENT_MAX = int(os.getenv("SPOOL_SEGMENT_MAX", "5000"))
+
+def default_dir(db_path):
+    return os.getenv("SPOOL_DIR", os.path.join(os.path.dirname(db_path) or ".", "spool"))
+
+class Spool:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._fh = None
+        self._active = None
+        self._active_count = 0
+        self.depth = 0
+        self.oldest_ts = None
+        for name in self.segments():
+            records = self.read(name)
+            if records and self.oldest_ts is None:
+                self.oldest_ts = records[0].get("ts")
+            self.depth += len(records)
+        self.write_status()
+
+    def segments(self):
+        return sorted(n for n in os.listdir(self.path) if n.endswith(".jsonl"))
+
+    def pending(self):
+        return self.depth > 0
+
+    def append(self, records):
+        """Append records durably (fsync) to the active segment."""
+        if self._fh is None or self._active_count >= SEGMENT_MAX:
+            self.seal()
+            self._active = f"{time.time_ns():020d}.jsonl"
+            self._fh = open(os.path.join(self.path, self._active), "a", encoding="utf-8")
+            self._active_count = 0
+        self._fh.write("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records))
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        if self.depth == 0:
+            self.oldest_ts = records[0].get("ts")
+        self._active_count += len(records)
+        self.depth += len(records)
+        self.write_status()
+
+    def seal(self):
+        """Close the active segment so it can be replayed."""
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+            self._active = None
+
+    def read(self, name):
+        """Records of one sealed segment. A last line without its newline was torn
+        by a crash: it is dropped and truncated away; other bad lines are skipped."""
+        path = os.path.join(self.path, name)
+        with open(path, "rb") as f:
+            data = f.read()
+        records = []
+        pos = 0
+        for raw in data.splitlines(keepends=True):
+            if raw.strip():
+                try:
+                    records.append(json.loads(raw))
+                except ValueError:
+                    if not raw.endswith(b"\n"):
+                        print(f"[SPOOL] {name}: torn last line dropped: {raw[:200]!r}", flush=True)
+                        with open(path, "r+b") as f:
+                            f.truncate(pos)
+                            os.fsync(f.fileno())
+                        break
+                    print(f"[SPOOL] {name}: undecodable line skipped: {raw[:200]!r}", flush=True)
+            pos += len(raw)
+        return records
+
+    def remove(self, name, count):
+        os.remove(os.path.join(self.path, name))
+        self.depth = max(0, self.depth - count)
+        self.oldest_ts = None
+        rest = self.segments()
+        if rest and self.depth:
+            records = self.read(rest[0])
+            if records:
+                self.oldest_ts = records[0].get("ts")
+        self.write_status()
+
+    def age_sec(self):
+        if not self.oldest_ts:
+            return 0
+        try:
+            oldest = datetime.fromisoformat(self.oldest_ts).replace(tzinfo=UTC)
+        except ValueError:
+            return 0
+        return max(0, int((datetime.now(UTC) - oldest).total_seconds()))
+
+    def status(self):
+        return {"depth": self.depth, "segments": len(self.segments()),
+                "oldest_ts": self.oldest_ts, "age_sec": self.age_sec(),
+                "updated": datetime.now(UTC).replace(tzinfo=None).isoformat(timespec="seconds")}
+
+    def write_status(self):
+        tmp = os.path.join(self.path, "status.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.status(), f)
+        os.replace(tmp, os.path.join(self.path, "status.json"))
+
+    def close(self):
+        self.seal()
+        self.write_status()
+
+def read_status(path):
+    """Spool status for other processes (API); sums worker-* spools of a pool."""
+    workers = sorted(n for n in os.listdir(path) if n.startswith("worker-")) if os.path.isdir(path) else []
+    if workers:
+        parts = [_read_one(os.path.join(path, w)) for w in workers]
+        oldest = [p["oldest_ts"] for p in parts if p.get("depth") and p.get("oldest_ts")]
+        return {"depth": sum(p.get("depth", 0) for p in parts),
+                "segments": sum(p.get("segments", 0) for p in parts),
+                "oldest_ts": min(oldest) if oldest else None,
+                "age_sec": max((p.get("age_sec", 0) for p in parts), default=0),
+                "workers": dict(zip(workers, parts))}
+    return _read_one(path)
+
+def _read_one(path):
+    try:
+        with open(os.path.join(path, "status.json"), encoding="utf-8") as f:
+            st = json.load(f)
+    except (OSError, ValueError):
+        return {"depth": 0, "segments": 0, "oldest_ts": None, "age_sec": 0, "updated": None}
+    if st.get("depth") and st.get("oldest_ts"):
+        try:
+            oldest = datetime.fromisoformat(st["oldest_ts"]).replace(tzinfo=UTC)
+            st["age_sec"] = max(0, int((datetime.now(UTC) - oldest).total_seconds()))
+        except ValueError:
+            pass
+    return st
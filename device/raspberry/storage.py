@@ -0,0 +1,141 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_PATH = os.getenv("EVENTS_DB", "/home/pi/DYPLOM/device/raspberry/events.db")
+
+# One place for connection tuning; every component connects through here.
+# Values can be overridden per service with SQLITE_<NAME> env variables.
+PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", "10000")),      # ms
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-8000")),          # negative = KiB
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024))),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))
+
+# API serving: GET requests borrow a read-only connection (mode=ro +
+# query_only) from a per-process pool of SQLITE_READ_POOL; all API writes go
+# through writer(), one connection behind a lock. In WAL mode readers never
+# wait for the writer, the logger or the rules engine.
+READ_POOL = int(os.getenv("SQLITE_READ_POOL", "8"))
+
+_local = threading.local()
+_pool = None
+_pool_lock = threading.Lock()
+_writer = None
+_write_lock = threading.Lock()
+
+def apply_pragmas(con, pragmas=None):
+    for name, value in (pragmas or PRAGMAS).items():
+        con.execute(f"PRAGMA {name}={value}")
+
+def connect(path=None, busy_timeout=None, row_factory=sqlite3.Row):
+    """Open a new tuned connection. Prefer get_conn() for long-lived use."""
+    pragmas = dict(PRAGMAS)
+    if busy_timeout is not None:
+        pragmas["busy_timeout"] = int(busy_timeout)
+    con = sqlite3.connect(path or DB_PATH,
+                          timeout=pragmas["busy_timeout"] / 1000.0,
+                          cached_statements=STATEMENT_CACHE,
+                          check_same_thread=False)
+    con.row_factory = row_factory
+    apply_pragmas(con, pragmas)
+    return con
+
+def connect_ro(path=None, row_factory=sqlite3.Row):
+    """Open a read-only connection; journal mode and synchronous are left to the writers."""
+    pragmas = {k: v for k, v in PRAGMAS.items() if k not in ("journal_mode", "synchronous")}
+    con = sqlite3.connect(f"file:{path or DB_PATH}?mode=ro", uri=True,
+                          timeout=pragmas["busy_timeout"] / 1000.0,
+                          cached_statements=STATEMENT_CACHE,
+                          check_same_thread=False)
+    con.row_factory = row_factory
+    apply_pragmas(con, pragmas)
+    con.execute("PRAGMA query_only=1")
+    return con
+
+class ReadPool:
+    """Up to size read-only connections, opened on demand and reused LIFO."""
+
+    def __init__(self, size):
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.opened < self.size:
+                self.opened += 1
+                return connect_ro()
+        return self.idle.get()
+
+    def release(self, con):
+        if con.in_transaction:
+            con.rollback()
+        self.idle.put(con)
+
+def read_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ReadPool(READ_POOL)
+    return _pool
+
+@contextmanager
+def writer():
+    """The process-wide write connection, serialized; commits on success."""
+    global _writer
+    with _write_lock:
+        if _writer is None:
+            _writer = connect()
+        try:
+            yield _writer
+            _writer.commit()
+        except Exception:
+            _writer.rollback()
+            raise
+
+def write(sql, args=()):
+    """writer() for a single statement; returns (rowcount, lastrowid)."""
+    with writer() as con:
+        cur = con.execute(sql, args)
+    return cur.rowcount, cur.lastrowid
+
+def get_conn():
+    """Per-thread connection that is opened once and then reused."""
+    con = getattr(_local, "con", None)
+    if con is None:
+        con = connect()
+        _local.con = con
+    return con
+
+def close_conn():
+    con = getattr(_local, "con", None)
+    if con is not None:
+        _local.con = None
+        con.close()
+
+def query(sql, args=(), one=False):
+    rows = get_conn().execute(sql, args).fetchall()
+    return (rows[0] if rows else None) if one else rows
+
+def execute(sql, args=()):
+    """Run one write statement and commit; returns (rowcount, lastrowid)."""
+    con = get_conn()
+    try:
+        cur = con.execute(sql, args)
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    return cur.rowcount, cur.lastrowid
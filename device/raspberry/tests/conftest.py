@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The Pi services are flat modules run from device/raspberry; make them importable.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
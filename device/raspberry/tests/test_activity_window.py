@@ -0,0 +1,62 @@
+import sqlite3
+from datetime import datetime, timedelta, UTC
+
+import activity_window as aw
+import motion_intervals
+
+def test_continuous_needs_motion_and_a_window_longer_than_the_gap():
+    assert not aw.continuous(0.0, 5, 300)       # dwell <= gap, no motion at all
+    assert not aw.continuous(120.0, 5, 300)     # dwell <= gap: undefined, never busy
+    assert not aw.continuous(0.0, 20, 300)
+    assert aw.continuous(900.0, 20, 300)
+    assert not aw.continuous(899.0, 20, 300)
+
+def test_event_mode_counts_every_report():
+    w = aw.ActivityWindow(10, 300)
+    t = 1_700_000_000.0
+    for i, value in enumerate((1, 0, 1, 0)):
+        w.add(t + 30 * i, value)
+    assert w.totals(t + 120)[0] == 4
+
+def test_seed_matches_polling_count():
+    con = sqlite3.connect(":memory:")
+    motion_intervals.ensure_schema(con)
+    open_map = {}
+    now = datetime(2025, 10, 26, 22, 0, tzinfo=UTC)
+    # one report per minute for the last 60 minutes, closed by a 0
+    for m in range(60, -1, -1):
+        ts = motion_intervals.iso_utc(now - timedelta(minutes=m))
+        motion_intervals.apply_edge(con, open_map, ts, "dev_k", "Kitchen", 1 if m else 0)
+    since = now - timedelta(minutes=20)
+    w = aw.seed(con, "Kitchen", 20, 300, now)
+    # equal up to one bucket of resolution at the window's old end
+    assert abs(w.totals(now.timestamp())[0] - motion_intervals.samples_since(con, "Kitchen", since)) <= 1
+
+def _seed_and_live(reports, now, minutes=20, gap_sec=300):
+    """Seeded window and live-fed window over the same (datetime, value) reports."""
+    con = sqlite3.connect(":memory:")
+    motion_intervals.ensure_schema(con)
+    open_map = {}
+    live = aw.ActivityWindow(minutes, gap_sec)
+    for ts, value in reports:
+        motion_intervals.apply_edge(con, open_map, motion_intervals.iso_utc(ts), "dev_k", "Kitchen", value)
+        live.add(ts.timestamp(), value)
+    seeded = aw.seed(con, "Kitchen", minutes, gap_sec, now)
+    return seeded.totals(now.timestamp()), live.totals(now.timestamp())
+
+def test_seed_ignores_spans_with_reports_further_apart_than_the_gap():
+    now = datetime(2025, 10, 26, 22, 0, tzinfo=UTC)
+    reports = [(now - timedelta(minutes=19), 1), (now - timedelta(seconds=5), 1)]
+    (s_reports, s_sec), (l_reports, l_sec) = _seed_and_live(reports, now)
+    assert s_sec == l_sec == 0.0
+    assert s_reports == l_reports == 2
+    assert not aw.continuous(s_sec, 20, 300)
+
+def test_seed_equals_live_for_dense_reports():
+    now = datetime(2025, 10, 26, 22, 0, tzinfo=UTC)
+    reports = [(now - timedelta(minutes=m), 1) for m in range(40, 10, -1)]
+    reports.append((now - timedelta(minutes=10), 0))
+    (s_reports, s_sec), (l_reports, l_sec) = _seed_and_live(reports, now)
+    # -20..-10 min is motion; the window's oldest bucket starts at -19 min
+    assert s_sec == l_sec == 540.0
+    assert abs(s_reports - l_reports) <= 1
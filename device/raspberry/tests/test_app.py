@@ -0,0 +1,39 @@
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("flask")
+import storage
+
+SCHEMA_SQL = Path(__file__).resolve().parent.parent / "schema.sql"
+
+@pytest.fixture(scope="module")
+def api(tmp_path_factory):
+    path = tmp_path_factory.mktemp("api") / "events.db"
+    con = sqlite3.connect(path)
+    con.executescript(SCHEMA_SQL.read_text())
+    con.close()
+    storage.DB_PATH = str(path)
+    import app
+    app.API_TOKEN = "k"
+    return app
+
+def test_stream_token_expires_and_is_bound_to_the_api_token(api):
+    token = api.stream_token(now=1000)
+    assert api.stream_token_valid(token, now=1000)
+    assert not api.stream_token_valid(token, now=1000 + api.STREAM_TOKEN_TTL + 1)
+    exp, sig = token.split(".")
+    assert not api.stream_token_valid(f"{int(exp) + 3600}.{sig}", now=1000)
+
+def test_stream_refuses_the_api_token_in_the_url(api):
+    client = api.app.test_client()
+    assert client.get("/api/stream?token=k").status_code == 401
+    token = client.post("/api/stream/token", headers={"X-API-Key": "k"}).json["token"]
+    assert api.stream_token_valid(token)
+
+def test_rule_settings_refuse_a_bad_night_window(api):
+    client = api.app.test_client()
+    headers = {"X-API-Key": "k"}
+    assert client.put("/api/rule-settings", json={"night.window": "23-6"}, headers=headers).status_code == 400
+    assert client.put("/api/rule-settings", json={"night.window": "22:30-06:00"}, headers=headers).status_code == 200
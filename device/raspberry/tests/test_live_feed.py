@@ -0,0 +1,36 @@
+import live_feed
+
+def test_event_id_round_trip():
+    chunk = live_feed.format_event(42, "motion", {})
+    event_id = chunk.split("\n")[0][len("id: "):]
+    assert live_feed.parse_event_id(event_id) == 42
+
+def test_event_id_of_another_process_is_rejected():
+    # another gunicorn worker started in the same second
+    boot_sec = live_feed.BOOT.split(".")[0]
+    assert live_feed.parse_event_id(f"{boot_sec}-42") is None
+    assert live_feed.parse_event_id(f"{boot_sec}.1.deadbeef-42") is None
+
+def test_motion_comes_from_intervals_without_motion_events():
+    import sqlite3
+    import motion_intervals
+    con = sqlite3.connect(":memory:")
+    con.row_factory = sqlite3.Row
+    motion_intervals.ensure_schema(con)
+    open_map = {}
+    last_id, open_ivs = 0, {}
+
+    def step(ts, value):
+        nonlocal last_id
+        if ts:
+            motion_intervals.apply_edge(con, open_map, ts, "dev_k", "Kitchen", value)
+        events, last_id = live_feed._interval_changes(con, last_id, open_ivs)
+        return [(e["ts_utc"], e["value"]) for e in events]
+
+    assert step("2025-10-26T22:00:00", 1) == [("2025-10-26T22:00:00", 1)]
+    assert step("2025-10-26T22:00:30", 1) == [("2025-10-26T22:00:30", 1)]
+    assert step(None, None) == []
+    assert step("2025-10-26T22:01:00", 0) == [("2025-10-26T22:01:00", 0)]
+    # an episode opened and closed between two polls
+    motion_intervals.apply_edge(con, open_map, "2025-10-26T22:05:00", "dev_k", "Kitchen", 1)
+    assert step("2025-10-26T22:06:00", 0) == [("2025-10-26T22:05:00", 1), ("2025-10-26T22:06:00", 0)]
@@ -0,0 +1,47 @@
+import sqlite3
+from datetime import datetime, timedelta, UTC
+
+import motion_intervals as mi
+
+def _con():
+    con = sqlite3.connect(":memory:")
+    mi.ensure_schema(con)
+    return con
+
+def test_zero_without_open_interval_is_skipped():
+    con = _con()
+    open_map = {}
+    mi.apply_edge(con, open_map, "2025-10-26T22:00:00", "dev_k", "Kitchen", 0)
+    assert mi.recent(con) == []
+    mi.apply_edge(con, open_map, "2025-10-26T22:01:00", "dev_k", "Kitchen", 1)
+    mi.apply_edge(con, open_map, "2025-10-26T22:02:00", "dev_k", "Kitchen", 0)
+    assert [r[4] for r in mi.recent(con)] == [0]
+
+def test_samples_since_prorates_long_episodes():
+    con = _con()
+    open_map = {}
+    # 61 reports, one per minute from 21:00 to 22:00
+    for minute in range(61):
+        mi.apply_edge(con, open_map, f"2025-10-26T{21 + minute // 60:02d}:{minute % 60:02d}:00",
+                      "dev_k", "Kitchen", 1)
+    since = datetime(2025, 10, 26, 21, 50, tzinfo=UTC)
+    assert mi.samples_since(con, "Kitchen", since) == 11   # 21:50 .. 22:00, like COUNT(*)
+    assert mi.samples_since(con, "Kitchen", datetime(2025, 10, 26, 20, 0, tzinfo=UTC)) == 61
+    assert mi.samples_since(con, "Kitchen", datetime(2025, 10, 26, 23, 0, tzinfo=UTC)) == 0
+
+def test_straddling_episode_counts_its_end_report_exactly():
+    con = sqlite3.connect(":memory:")
+    mi.ensure_schema(con)
+    con.execute("CREATE TABLE motion_events (ts_utc TEXT, room TEXT, value INTEGER)")
+    now = datetime(2025, 10, 26, 22, 0, tzinfo=UTC)
+    open_map = {}
+    # a sparse episode: one report long before the window, the next one inside it
+    for minutes, value in ((60, 1), (1, 1)):
+        ts = mi.iso_utc(now - timedelta(minutes=minutes))
+        mi.apply_edge(con, open_map, ts, "dev_bed", "Bedroom", value)
+        con.execute("INSERT INTO motion_events VALUES (?, 'Bedroom', ?)", (ts, value))
+    for minutes in (10, 30, 59):
+        since = now - timedelta(minutes=minutes)
+        exact = con.execute("SELECT COUNT(*) FROM motion_events WHERE ts_utc >= ?",
+                            (mi.iso_utc(since),)).fetchone()[0]
+        assert mi.samples_since(con, "Bedroom", since) == exact == 1
@@ -0,0 +1,100 @@
+import sqlite3
+import threading
+
+import pytest
+
+pytest.importorskip("paho.mqtt.client")
+import mqtt_logger
+
+def _record(topic="iot/eldercare/Kitchen/motion/state"):
+    return mqtt_logger.parse_record("2025-10-26T22:27:00", topic, '{"device": "dev_k", "motion": 1}')
+
+def _flush_in_thread(conn, batch):
+    t = threading.Thread(target=mqtt_logger.flush, args=(conn, batch), daemon=True)
+    t.start()
+    t.join(5)
+    return not t.is_alive()
+
+def test_db_busy_only_for_lock_errors():
+    assert mqtt_logger.db_busy(sqlite3.OperationalError("database is locked"))
+    assert mqtt_logger.db_busy(sqlite3.OperationalError("database table is locked"))
+    assert not mqtt_logger.db_busy(sqlite3.OperationalError("no such table: motion_intervals"))
+    assert not mqtt_logger.db_busy(sqlite3.OperationalError("attempt to write a readonly database"))
+    assert not mqtt_logger.db_busy(ValueError("locked"))
+
+def test_flush_without_spool_does_not_retry_schema_errors(monkeypatch):
+    monkeypatch.setattr(mqtt_logger, "_spool", None)
+    mqtt_logger.invalidate_registry()
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    assert _flush_in_thread(conn, [_record()])
+
+def test_flush_does_not_spool_schema_errors(monkeypatch, tmp_path):
+    import spool
+    sp = spool.Spool(str(tmp_path / "spool"))
+    monkeypatch.setattr(mqtt_logger, "_spool", sp)
+    mqtt_logger.invalidate_registry()
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    try:
+        assert _flush_in_thread(conn, [_record()])
+        assert not sp.pending()
+    finally:
+        sp.close()
+
+def _capture(path, devices=8, per_device=50):
+    """JSONL capture: alternating 1/0 reports, interleaved across devices and rooms."""
+    import json
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(per_device):
+            for d in range(devices):
+                f.write(json.dumps({
+                    "topic": f"iot/eldercare/room{d % 5}/motion/state",
+                    "payload": {"device": f"dev{d}", "motion": (i + 1) % 2},
+                    "ts": f"2026-10-18T10:{i // 60:02d}:{i % 60:02d}",
+                }) + "\n")
+
+def test_worker_pool_replay_keeps_every_row_and_per_device_order(tmp_path):
+    import os
+    import subprocess
+    import sys
+    db = tmp_path / "events.db"
+    con = sqlite3.connect(db)
+    con.executescript("""
+        CREATE TABLE rooms (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE NOT NULL);
+        CREATE TABLE devices (id INTEGER PRIMARY KEY AUTOINCREMENT, device_id TEXT UNIQUE NOT NULL,
+                              room_id INTEGER, room TEXT);
+    """)
+    con.close()
+    capture = tmp_path / "capture.jsonl"
+    _capture(capture)
+    env = dict(os.environ, EVENTS_DB=str(db), LOGGER_VERBOSE="0", SPOOL_DIR=str(tmp_path / "spool"))
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "mqtt_logger.py", "--workers", "4", "--replay", str(capture)],
+                   cwd=here, env=env, check=True, timeout=120, capture_output=True)
+
+    con = sqlite3.connect(db)
+    assert con.execute("SELECT COUNT(*) FROM messages_raw").fetchone()[0] == 400
+    assert con.execute("SELECT COUNT(*) FROM motion_events").fetchone()[0] == 400
+    for (dev,) in con.execute("SELECT DISTINCT device_id FROM motion_events"):
+        ts = [r[0] for r in con.execute("SELECT ts_utc FROM motion_events WHERE device_id = ? ORDER BY id", (dev,))]
+        assert ts == sorted(ts)
+    # 25 episodes per device (each 1 closed by the following 0), none left open
+    assert con.execute("SELECT COUNT(*) FROM motion_intervals").fetchone()[0] == 8 * 25
+    assert con.execute("SELECT COUNT(*) FROM motion_intervals WHERE is_open = 1").fetchone()[0] == 0
+
+def test_replay_survives_a_torn_spool_segment(monkeypatch, tmp_path):
+    import json
+    import spool
+    path = tmp_path / "spool"
+    path.mkdir()
+    (path / "01.jsonl").write_text(json.dumps(_record()) + "\n" + '{"ts":"2025-10-26T22:2')
+    sp = spool.Spool(str(path))
+    monkeypatch.setattr(mqtt_logger, "_spool", sp)
+    written = []
+    monkeypatch.setattr(mqtt_logger, "write_batch", lambda conn, records: written.extend(records))
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE spool_replayed (segment TEXT PRIMARY KEY)")
+    try:
+        assert mqtt_logger.replay_spool(conn)
+        assert written == [_record()] and not sp.pending()
+    finally:
+        sp.close()
@@ -0,0 +1,145 @@
+import queue
+import socket
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import notifier
+
+def _socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.setblocking(False)
+    return sock
+
+def test_wait_for_alerts_keeps_ready_callable_across_idle_steps(monkeypatch):
+    monkeypatch.setattr(notifier, "WATCH_SEC", 0.02)
+    conn = sqlite3.connect(":memory:")
+    sock = _socket()
+    calls = []
+    try:
+        reason = notifier.wait_for_alerts(conn, sock, 0.1, [None, None],
+                                          lambda: calls.append(1) and False)
+    finally:
+        sock.close()
+    assert reason == "timeout"
+    assert len(calls) > 1
+
+def test_wait_for_alerts_wakes_on_datagram(monkeypatch):
+    monkeypatch.setattr(notifier, "WATCH_SEC", 0.02)
+    conn = sqlite3.connect(":memory:")
+    sock = _socket()
+    try:
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM).sendto(b"x", sock.getsockname())
+        reason = notifier.wait_for_alerts(conn, sock, 1.0, [None, None], lambda: False)
+    finally:
+        sock.close()
+    assert reason == "signal"
+
+class _Session:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, to, msg):
+        self.sent.append(to)
+
+ALERT = {"id": 1, "rule": "INACTIVITY", "room": "Kitchen", "ts_utc": "2025-10-26 22:00:00",
+         "severity": "high", "details": "No motion"}
+
+def test_send_without_recipients_fails():
+    for cfg_value in (None, "", " , "):
+        cfg = {"ALERT_EMAIL": cfg_value, "SMTP_USER": "pi@example.org"}
+        session = _Session()
+        assert notifier.send_email(ALERT, cfg, session) == (False, "ALERT_EMAIL not set")
+        assert notifier.send_digest([ALERT], cfg, session) == (False, "ALERT_EMAIL not set")
+        assert session.sent == []
+
+def test_send_to_every_recipient():
+    cfg = {"ALERT_EMAIL": "a@example.org, b@example.org", "SMTP_USER": "pi@example.org"}
+    session = _Session()
+    ok, _ = notifier.send_email(ALERT, cfg, session)
+    assert ok and session.sent == ["a@example.org", "b@example.org"]
+
+def test_sender_refused_is_not_retried_as_a_dropped_session():
+    import smtplib
+
+    class Server:
+        calls = 0
+
+        def sendmail(self, *args):
+            Server.calls += 1
+            raise smtplib.SMTPSenderRefused(553, b"sender rejected", "pi@example.org")
+
+        def quit(self):
+            pass
+
+    session = notifier.SmtpSession({"SMTP_USER": "pi@example.org"})
+    session.server = Server()
+    session._open = lambda: (_ for _ in ()).throw(AssertionError("reconnected"))
+    with pytest.raises(smtplib.SMTPSenderRefused):
+        session.send("a@example.org", notifier.build_message("s", "b", {"SMTP_USER": "pi@example.org"}, "a"))
+    assert Server.calls == 1
+
+def _queue_db():
+    import dispatch
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.executescript("""
+        CREATE TABLE alerts (id INTEGER PRIMARY KEY, ts_utc TEXT, room TEXT, device_id TEXT, type TEXT,
+                             rule TEXT, severity TEXT, details TEXT, status TEXT, channels TEXT,
+                             notified_at TEXT);
+        CREATE TABLE notifications_log (id INTEGER PRIMARY KEY, alert_id INTEGER, channel TEXT,
+                                        ok INTEGER, details TEXT);
+        INSERT INTO alerts VALUES (1, '2025-10-26 22:00:00', 'Kitchen', NULL, 'INACTIVITY', 'INACTIVITY',
+                                   'high', 'No motion', 'open', 'email', NULL);
+    """)
+    dispatch.ensure_schema(conn)
+    return conn
+
+def _dispatch_once(disp, conn, now):
+    disp.submit_due(conn, now)
+    disp.pools["email"].shutdown(wait=True)  # wait for the send, then a fresh pool for the next round
+    disp.pools["email"] = ThreadPoolExecutor(1)
+    disp.drain(conn, now)
+    return conn.execute("SELECT status, attempts, delivered FROM notification_queue").fetchone()
+
+def test_email_retry_skips_recipients_already_reached():
+    import smtplib
+    import dispatch
+
+    class Session:
+        sent = []
+        fail_b = True
+
+        def send(self, to, msg):
+            if to == "b@example.org" and Session.fail_b:
+                Session.fail_b = False
+                raise smtplib.SMTPRecipientsRefused({to: (451, b"try later")})
+            Session.sent.append(to)
+
+    cfg = {"ALERT_EMAIL": "a@example.org,b@example.org", "SMTP_USER": "pi@example.org"}
+    sessions = queue.Queue()
+    sessions.put(Session())
+    conn = _queue_db()
+    disp = dispatch.Dispatcher({"email": notifier.email_sender(cfg, sessions)})
+    disp.enqueue_new(conn, now=100)
+    assert tuple(_dispatch_once(disp, conn, 100)) == ("pending", 1, "a@example.org")
+    assert tuple(_dispatch_once(disp, conn, 10_000)) == ("sent", 2, "a@example.org,b@example.org")
+    assert Session.sent == ["a@example.org", "b@example.org"]
+
+def test_permanently_refused_recipient_is_not_retried():
+    import smtplib
+    import dispatch
+
+    class Session:
+        def send(self, to, msg):
+            raise smtplib.SMTPRecipientsRefused({to: (550, b"no such user")})
+
+    cfg = {"ALERT_EMAIL": "gone@example.org", "SMTP_USER": "pi@example.org"}
+    sessions = queue.Queue()
+    sessions.put(Session())
+    conn = _queue_db()
+    disp = dispatch.Dispatcher({"email": notifier.email_sender(cfg, sessions)})
+    disp.enqueue_new(conn, now=100)
+    assert tuple(_dispatch_once(disp, conn, 100)) == ("failed", 1, None)
@@ -0,0 +1,18 @@
+import pattern_baseline as pb
+
+def test_memory_never_below_min_samples():
+    for window_days in (1, 7, 14, 15, 30):
+        assert pb.memory(window_days) >= pb.MIN_SAMPLES
+
+def test_weekday_slot_used_with_default_window(monkeypatch):
+    cap = pb.memory(14)
+    slot = (0, 0.0, 0.0)
+    for x in (4, 6, 5, 5, 4):     # five Mondays 10:00
+        slot = pb.update(*slot, x, cap)
+    other = (0, 0.0, 0.0)
+    for x in (40, 40, 40):        # Tuesdays 10:00, much busier
+        other = pb.update(*other, x, cap)
+    monkeypatch.setattr(pb, "_stats", {("Kitchen", 0, 10): list(slot), ("Kitchen", 1, 10): list(other)})
+    n, mean, _ = pb._expected("Kitchen", 0, 10)
+    assert n >= pb.MIN_SAMPLES
+    assert 4 <= mean <= 6         # the Monday slot, not pooled with Tuesdays
@@ -0,0 +1,21 @@
+import multiprocessing
+
+import prealert_config
+
+def _bump(room, n):
+    for _ in range(n):
+        prealert_config.update_config(lambda cfg: cfg.setdefault(room, {}).update(
+            inactivity_sec=cfg.get(room, {}).get("inactivity_sec", 0) + 1))
+
+def test_concurrent_updates_of_different_rooms_are_all_kept(monkeypatch, tmp_path):
+    monkeypatch.setattr(prealert_config, "CONFIG_PATH", tmp_path / "prealert_config.json")
+    prealert_config.load_config()
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_bump, args=(f"room{i}", 25)) for i in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(30)
+    assert [p.exitcode for p in procs] == [0] * 4
+    cfg = prealert_config.load_config()
+    assert [cfg[f"room{i}"]["inactivity_sec"] for i in range(4)] == [25] * 4
@@ -0,0 +1,45 @@
+import sqlite3
+
+import raw_archive
+
+def archive_db():
+    con = sqlite3.connect(":memory:")
+    con.execute("""
+        CREATE TABLE messages_raw (id INTEGER PRIMARY KEY AUTOINCREMENT, ts_utc TEXT,
+                                   topic TEXT, device_id TEXT, payload TEXT, ts_ms INTEGER)
+    """)
+    raw_archive.ensure_schema(con)
+    raw_archive.forget_topics()
+    tid = raw_archive.topic_id(con, "t")
+    for i in range(3):  # archived rows are the older ones
+        con.execute("INSERT INTO messages_archive(ts_utc, topic_id, payload) VALUES (?, ?, ?)",
+                    (f"2025-01-01T00:00:0{i}", tid, raw_archive.pack(f"a{i}")))
+    for i in range(3):
+        con.execute("INSERT INTO messages_raw(ts_utc, topic, payload) VALUES (?, 't', ?)",
+                    (f"2025-01-02T00:00:0{i}", f"r{i}"))
+    return con
+
+def test_legacy_before_id_keeps_the_archive():
+    con = archive_db()
+    rows, _ = raw_archive.page_messages(con, 10, "2")
+    assert [r["payload"] for r in rows] == ["r0", "a2", "a1", "a0"]
+    rows, _ = raw_archive.page_messages(con, 10, "2.")
+    assert [r["payload"] for r in rows] == ["r0", "a2", "a1", "a0"]
+
+def test_cursor_pages_cover_both_tables():
+    con = archive_db()
+    seen, cursor = [], None
+    while True:
+        rows, cursor = raw_archive.page_messages(con, 2, cursor)
+        seen += [r["payload"] for r in rows]
+        if cursor is None:
+            break
+    assert seen == ["r2", "r1", "r0", "a2", "a1", "a0"]
+
+def test_count_messages_mixes_timestamp_spellings(monkeypatch):
+    con = archive_db()
+    monkeypatch.setattr(raw_archive, "MODE", "compact")
+    raw_archive.store(con, [("2025-10-26T22:25:00", "iot/eldercare/Kitchen/prealert", "dev_k", "{}")])
+    topic = "iot/eldercare/Kitchen/prealert"
+    assert raw_archive.count_messages(con, topic, "2025-10-26T22:22:00", "2025-10-26 22:27:00") == 1
+    assert raw_archive.count_messages(con, topic, "2025-10-26T22:26:00", "2025-10-26 22:27:00") == 0
@@ -0,0 +1,35 @@
+import sqlite3
+
+import motion_intervals
+import room_state
+import timestamps
+
+def _con():
+    con = sqlite3.connect(":memory:")
+    con.executescript("""
+        CREATE TABLE rooms (name TEXT PRIMARY KEY);
+        CREATE TABLE devices (device_id TEXT PRIMARY KEY, room TEXT);
+        CREATE TABLE heartbeats (id INTEGER PRIMARY KEY, ts_utc TEXT, device_id TEXT, ts_ms INTEGER);
+        CREATE TABLE motion_events (id INTEGER PRIMARY KEY, ts_utc TEXT, device_id TEXT, value INTEGER,
+                                    ts_ms INTEGER);
+    """)
+    con.execute("INSERT INTO rooms VALUES ('Kitchen')")
+    con.execute("INSERT INTO devices VALUES ('dev_k', 'Kitchen')")
+    con.execute("INSERT INTO motion_events(ts_utc, device_id, value, ts_ms) VALUES (?, 'dev_k', 1, ?)",
+                ("2025-10-26T22:00:00", timestamps.to_ms("2025-10-26T22:00:00")))
+    con.execute("INSERT INTO heartbeats(ts_utc, device_id) VALUES ('2025-10-26T22:05:00', 'dev_k')")
+    con.commit()
+    motion_intervals.ensure_schema(con)
+    motion_intervals.backfill(con, log=lambda m: None)
+    return con
+
+def test_rebuild_runs_after_device_triggers_created_rows():
+    con = _con()
+    room_state.ensure_schema(con)
+    con.execute("INSERT INTO devices VALUES ('dev_k2', 'Kitchen')")   # trigger creates the row
+    con.commit()
+    assert room_state.rebuild(con, log=lambda m: None)
+    row = con.execute("SELECT last_motion_utc, last_hb_utc, device_count FROM room_state "
+                      "WHERE room = 'Kitchen'").fetchone()
+    assert row == ("2025-10-26T22:00:00", "2025-10-26T22:05:00", 2)
+    assert not room_state.rebuild(con, log=lambda m: None)
@@ -0,0 +1,79 @@
+import sqlite3
+
+import pytest
+
+pytest.importorskip("paho.mqtt.client")
+import leases
+import rules_engine
+
+def _alerts_con():
+    con = sqlite3.connect(":memory:")
+    con.executescript("""
+        CREATE TABLE alerts (id INTEGER PRIMARY KEY AUTOINCREMENT, ts_utc TEXT, room TEXT, device_id TEXT,
+                             type TEXT, severity TEXT, details TEXT, status TEXT DEFAULT 'open',
+                             rule TEXT, closed_at TEXT);
+        INSERT INTO alerts(room, type, rule) VALUES ('Kitchen', 'INACTIVITY', 'INACTIVITY');
+        INSERT INTO alerts(room, type, rule) VALUES ('Kitchen', 'INACTIVITY', 'INACTIVITY');
+        INSERT INTO alerts(room, type, rule) VALUES ('Bathroom', 'INACTIVITY', 'INACTIVITY');
+    """)
+    con.commit()
+    return con
+
+def test_duplicate_open_alerts_closed_once_and_logged(monkeypatch):
+    logged = []
+    monkeypatch.setattr(rules_engine, "log", logged.append)
+    con = _alerts_con()
+    rules_engine.ensure_alert_index(con)
+    assert con.execute("SELECT id FROM alerts WHERE status = 'open' ORDER BY id").fetchall() == [(2,), (3,)]
+    assert len(logged) == 1 and "#1" in logged[0]
+
+    # later starts leave open alerts alone, duplicates cannot reappear
+    rules_engine.ensure_alert_index(con)
+    assert len(logged) == 1
+    with pytest.raises(sqlite3.IntegrityError):
+        con.execute("INSERT INTO alerts(room, type, rule) VALUES ('Bathroom', 'INACTIVITY', 'INACTIVITY')")
+
+def test_lost_lease_aborts_the_cycle(monkeypatch):
+    con = sqlite3.connect(":memory:")
+    leases.ensure_schema(con, 2)
+    monkeypatch.setattr(rules_engine, "SHARDS", 2)
+    monkeypatch.setattr(rules_engine, "_owner", "a")
+    monkeypatch.setattr(rules_engine, "_preferred", 0)
+    monkeypatch.setattr(rules_engine, "_started", 0.0)
+    monkeypatch.setattr(rules_engine, "_owned", {})
+    rules_engine.lease_step(con)
+    assert 0 in rules_engine._owned
+    con.execute("UPDATE engine_leases SET owner = 'b', generation = generation + 1 WHERE shard = 0")
+    with pytest.raises(leases.LeaseLost):
+        rules_engine.lease_step(con)
+
+def test_night_activity_needs_a_motion_start_in_a_watched_room(monkeypatch):
+    import motion_intervals
+    from datetime import datetime
+    monkeypatch.setattr(rules_engine, "_last_start", {})
+    con = sqlite3.connect(":memory:")
+    motion_intervals.ensure_schema(con)
+    utc = lambda h, m: motion_intervals.iso_utc(datetime(2025, 1, 1, h, m).astimezone())
+    open_map = {}
+    # Kitchen: motion from before the night, stopped (a 0) after it started
+    motion_intervals.apply_edge(con, open_map, utc(22, 50), "k1", "Kitchen", 1)
+    motion_intervals.apply_edge(con, open_map, utc(23, 5), "k1", "Kitchen", 0)
+    # Hall: motion at night, but the room is not watched
+    motion_intervals.apply_edge(con, open_map, utc(23, 10), "h1", "Hall", 1)
+    settings = {"night.window": "23:00-06:00", "night.rooms": "Kitchen"}
+    snap = {"now": datetime(2025, 1, 1, 23, 30).astimezone(), "settings": settings}
+    assert rules_engine.load_night_motion(con, snap, ["Kitchen", "Hall"], None) == {}
+
+    motion_intervals.apply_edge(con, open_map, utc(23, 20), "k1", "Kitchen", 1)
+    night = rules_engine.load_night_motion(con, snap, ["Kitchen", "Hall"], None)
+    assert list(night) == ["Kitchen"]
+
+def test_bad_night_window_falls_back_to_the_default(monkeypatch):
+    from datetime import datetime
+    logged = []
+    monkeypatch.setattr(rules_engine, "log", logged.append)
+    now = datetime(2025, 1, 1, 23, 30).astimezone()
+    night = rules_engine.night_bounds({"night.window": "23-6"}, now)
+    assert night == rules_engine.night_bounds({}, now)
+    rules_engine.night_bounds({"night.window": "23-6"}, now)
+    assert len(logged) == 1
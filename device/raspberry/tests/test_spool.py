@@ -0,0 +1,27 @@
+import json
+import os
+
+import spool
+
+def _segment(path, name, text):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, name), "w", encoding="utf-8") as f:
+        f.write(text)
+
+def test_torn_last_line_is_dropped_and_truncated(tmp_path):
+    path = str(tmp_path / "spool")
+    good = json.dumps({"ts": "2025-10-26T22:20:00", "topic": "t"}) + "\n"
+    _segment(path, "01.jsonl", good + '{"ts":"2025-10-26T22:2')
+    sp = spool.Spool(path)
+    assert sp.depth == 1 and sp.oldest_ts == "2025-10-26T22:20:00"
+    assert sp.read("01.jsonl") == [json.loads(good)]
+    with open(os.path.join(path, "01.jsonl"), encoding="utf-8") as f:
+        assert f.read() == good
+    sp.close()
+
+def test_torn_first_line_does_not_break_startup(tmp_path):
+    path = str(tmp_path / "spool")
+    _segment(path, "01.jsonl", '{"ts":"2025-10-26T22:2')
+    sp = spool.Spool(path)
+    assert sp.depth == 0 and sp.read("01.jsonl") == []
+    sp.close()
@@ -0,0 +1,75 @@
+import time
+from datetime import datetime, UTC
+
+# Integer timestamps. ts_utc is TEXT in two spellings ('2025-10-26T22:27:00'
+# from the logger, '2025-10-26 22:27:00' from the rules engine and the API),
+# which compare wrongly as strings, and filters like datetime(ts_utc) >= ...
+# cannot use an index. motion_events, heartbeats, messages_raw, messages_archive
+# and alerts get a ts_ms column (UTC epoch milliseconds) with an index; writers
+# fill it, and a trigger fills it for writers that don't (simulators, the
+# sqlite3 CLI).
+# Time-range filters compare ts_ms against values from the helpers below.
+
+TABLES = ("motion_events", "heartbeats", "messages_raw", "messages_archive", "alerts")
+BACKFILL_BATCH = 50000
+
+# SQL expression for the same value, used by the backfill and the triggers
+TS_MS_SQL = "CAST(strftime('%s', {col}) AS INTEGER) * 1000"
+
+def to_ms(value):
+    """ts_utc string (either spelling, optional offset) or datetime -> epoch ms; None if unparsable."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=UTC)
+    return int(value.timestamp() * 1000)
+
+def now_ms():
+    return int(time.time() * 1000)
+
+def ago_ms(seconds, now=None):
+    """Epoch ms `seconds` before now (for '>= cutoff' filters)."""
+    return (now_ms() if now is None else now) - int(seconds * 1000)
+
+def _columns(con, table):
+    return {r[1] for r in con.execute(f"PRAGMA table_info({table})")}
+
+def ensure_schema(con, log=print):
+    """Add ts_ms + index + fill trigger to every table, backfilling existing rows in batches."""
+    for table in TABLES:
+        cols = _columns(con, table)
+        if not cols:
+            continue
+        if "ts_ms" not in cols:
+            con.execute(f"ALTER TABLE {table} ADD COLUMN ts_ms INTEGER")
+            con.commit()
+        con.executescript(f"""
+            CREATE INDEX IF NOT EXISTS idx_{table}_ts_ms ON {table}(ts_ms);
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_ts_ms AFTER INSERT ON {table}
+            WHEN NEW.ts_ms IS NULL
+            BEGIN
+              UPDATE {table} SET ts_ms = {TS_MS_SQL.format(col="NEW.ts_utc")} WHERE rowid = NEW.rowid;
+            END;
+        """)
+        backfill(con, table, log)
+
+def backfill(con, table, log=print):
+    """Fill ts_ms where it is NULL, one rowid range per transaction."""
+    lo, hi = con.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {table} WHERE ts_ms IS NULL").fetchone()
+    if lo is None:
+        return 0
+    n = 0
+    for start in range(lo, hi + 1, BACKFILL_BATCH):
+        cur = con.execute(f"""
+            UPDATE {table} SET ts_ms = {TS_MS_SQL.format(col="ts_utc")}
+             WHERE rowid >= ? AND rowid < ? AND ts_ms IS NULL
+        """, (start, start + BACKFILL_BATCH))
+        con.commit()
+        n += cur.rowcount
+    log(f"[TS_MS] backfilled {n} row(s) of {table}")
+    return n
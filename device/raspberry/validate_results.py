@@ -1,8 +1,11 @@
 import argparse
 import csv
-import sqlite3
 from datetime import datetime, timedelta
 
+import storage
+import raw_archive
+import timestamps
+
 ISO = "%Y-%m-%dT%H:%M:%S"
 
 def parse_iso(s: str) -> datetime:
@@ -16,44 +19,39 @@ def fetch_alerts(con, room: str, since_iso: str):
     q = """
       SELECT id, ts_utc, room, rule, status, details
         FROM alerts
-       WHERE room = ? AND ts_utc >= ?
-       ORDER BY ts_utc ASC
+       WHERE room = ? AND ts_ms >= ?
+       ORDER BY ts_ms ASC
     """
-    return con.execute(q, (room, since_iso)).fetchall()
+    return con.execute(q, (room, timestamps.to_ms(since_iso))).fetchall()
 
 def last_motion_before(con, room: str, ts_iso: str):
     q = """
-      SELECT ts_utc FROM motion_events
-       WHERE room = ? AND ts_utc <= ?
-       ORDER BY ts_utc DESC
+      SELECT MIN(end_utc, ?) FROM motion_intervals
+       WHERE room = ? AND start_utc <= ?
+       ORDER BY end_utc DESC
        LIMIT 1
     """
-    row = con.execute(q, (room, ts_iso)).fetchone()
+    ts_iso = ts_iso.replace(" ", "T")
+    row = con.execute(q, (ts_iso, room, ts_iso)).fetchone()
     return row[0] if row else None
 
 def last_hb_before(con, device: str, ts_iso: str):
     q = """
       SELECT ts_utc FROM heartbeats
-       WHERE device = ? AND ts_utc <= ?
-       ORDER BY ts_utc DESC
+       WHERE device_id = ? AND ts_ms <= ?
+       ORDER BY ts_ms DESC
        LIMIT 1
     """
-    row = con.execute(q, (device, ts_iso)).fetchone()
+    row = con.execute(q, (device, timestamps.to_ms(ts_iso))).fetchone()
     return row[0] if row else None
 
 def prealert_messages_between(con, room: str, start_iso: str, end_iso: str):
     if not exists_table(con, "messages_raw"):
         return 0
-    q = """
-      SELECT COUNT(*) FROM messages_raw
-       WHERE ts_utc BETWEEN ? AND ?
-         AND topic LIKE '%' || ? || '/cmd/prealert%'
-    """
-    return con.execute(q, (start_iso, end_iso, room)).fetchone()[0]
+    return raw_archive.count_messages(con, f"%{room}/cmd/prealert%", start_iso, end_iso)
 
 def summarize(args):
-    con = sqlite3.connect(args.db)
-    con.row_factory = sqlite3.Row
+    con = storage.connect(args.db)
     rows = fetch_alerts(con, args.room, args.since)
     results = []
     pass_all = True
@@ -0,0 +1,60 @@
+    import { useEffect, useRef } from 'react';
+    import { apiBase, apiPost } from '@/lib/api';
+
+    // One EventSource on /api/stream; handlers is { motion, room, alert, reset }.
+    // The browser reconnects on its own and resends Last-Event-ID, so missed
+    // events are replayed; "reset" means the server could not, refetch instead.
+    // The API token never goes into the URL: a short-lived stream token is
+    // fetched first (?st=). Once it expired the server refuses the browser's
+    // reconnect and the source closes; then a fresh token is fetched and the
+    // last seen event id is passed along, so the replay still works.
+    export default function useEventStream(handlers, enabled = true) {
+    const ref = useRef(handlers);
+    ref.current = handlers;
+
+    useEffect(() => {
+        if (!enabled || typeof EventSource === 'undefined') return;
+        const kinds = ['motion', 'room', 'alert', 'reset'];
+        let es = null;
+        let timer = null;
+        let lastId = '';
+        let stopped = false;
+
+        const retry = () => {
+        if (!stopped) timer = setTimeout(connect, 5000);
+        };
+
+        async function connect() {
+        let token;
+        try {
+            ({ token } = await apiPost('/api/stream/token'));
+        } catch {
+            retry();
+            return;
+        }
+        if (stopped) return;
+        const qs = new URLSearchParams({ st: token });
+        if (lastId) qs.set('last_event_id', lastId);
+        es = new EventSource(`${apiBase()}/api/stream?${qs}`);
+        kinds.forEach((kind) => {
+            es.addEventListener(kind, (e) => {
+            if (e.lastEventId) lastId = e.lastEventId;
+            const h = ref.current[kind];
+            if (h) h(JSON.parse(e.data));
+            });
+        });
+        es.onerror = () => {
+            if (es.readyState !== EventSource.CLOSED) return;
+            es.close();
+            retry();
+        };
+        }
+
+        connect();
+        return () => {
+        stopped = true;
+        clearTimeout(timer);
+        if (es) es.close();
+        };
+    }, [enabled]);
+    }
@@ -5,6 +5,7 @@ import {
 } from "react-icons/fi";
 import { apiGet, apiPost } from "@/lib/api";
 import usePolling from "@/hooks/usePolling";
+import useEventStream from "@/hooks/useEventStream";
 import Pagination from "@/components/Pagination.jsx";
 import Drawer from "@/components/Drawer.jsx";
 import Spinner from "@/components/Spinner.jsx";
@@ -128,34 +129,63 @@ export default function Alerts() {
   const [pageSize, setPageSize] = React.useState(25);
   const [selected, setSelected] = React.useState(null);
   const [refreshing, setRefreshing] = React.useState(false);
+  const [nextCursor, setNextCursor] = React.useState(null);
   const toast = useToast();
   const showBulkClose = type === "NO_HEARTBEAT" && status !== "closed";
 
+  const query = React.useCallback((cursor) => {
+    const params = new URLSearchParams();
+    if (status !== "All") params.set("status", status);
+    if (type !== "All") params.set("type", type);
+    if (roomLike) params.set("room", roomLike);
+    if (Number(lastMin) > 0) params.set("last_minutes", lastMin);
+    params.set("limit", "500");
+    params.set("envelope", "1");
+    if (cursor) params.set("before_id", cursor);
+    return apiGet(`/api/alerts?${params.toString()}`);
+  }, [status, type, roomLike, lastMin]);
+
+  // true once "Load older" appended pages; a refresh must not drop them
+  const olderLoaded = React.useRef(false);
+
   const load = React.useCallback(async (opts = {}) => {
     setLoading(!opts.silent);
     try {
-      const params = new URLSearchParams();
-      if (status !== "All") params.set("status", status);
-      if (type !== "All") params.set("type", type);
-      if (roomLike) params.set("room", roomLike);
-      if (Number(lastMin) > 0) params.set("last_minutes", lastMin);
-      params.set("limit", "1000");
-      const data = await apiGet(`/api/alerts?${params.toString()}`);
-      setItems(data);
+      const data = await query();
+      if (opts.merge && olderLoaded.current && data.next_cursor && data.items.length) {
+        // swap in the refreshed first page, keep the older rows below it;
+        // nextCursor still points below the oldest of those
+        const floor = Math.min(...data.items.map((a) => a.id));
+        setItems((prev) => [...data.items, ...prev.filter((a) => a.id < floor)]);
+      } else {
+        olderLoaded.current = false;
+        setItems(data.items);
+        setNextCursor(data.next_cursor);
+      }
     } finally {
       setLoading(false);
       setRefreshing(false);
     }
-  }, [status, type, roomLike, lastMin]);
+  }, [query]);
+
+  const loadOlder = async () => {
+    if (!nextCursor) return;
+    const data = await query(nextCursor);
+    olderLoaded.current = true;
+    setItems((prev) => [...prev, ...data.items]);
+    setNextCursor(data.next_cursor);
+  };
 
   React.useEffect(() => { load(); }, []);
   React.useEffect(() => { setPage(1); load(); }, [status, type, roomLike, lastMin, load]);
-  usePolling(() => live && load({ silent: true }), 10000);
+  const reload = React.useCallback(() => load({ silent: true, merge: true }), [load]);
+  useEventStream({ alert: reload, reset: reload }, live);
+  usePolling(() => live && reload(), 60000); // fallback if the stream is down
 
   const ack = async (id) => {
     try {
       await apiPost(`/api/alerts/${id}/ack`, { by: "web" });
-      load({ silent: true });
+      reload();
     } catch {
       toast.push("err", "Ack failed");
     }
@@ -163,7 +193,7 @@ export default function Alerts() {
   const close = async (id) => {
     try {
       await apiPost(`/api/alerts/${id}/close`);
-      load({ silent: true });
+      reload();
     } catch {
       toast.push("err", "Close failed");
     }
@@ -181,7 +211,7 @@ export default function Alerts() {
     try {
       await apiPost(`/api/alerts/purge?older_than_days=7`);
       toast.push("ok", "Purged alerts older than 7 days");
-      load({ silent: true });
+      reload();
     } catch {
       toast.push("err", "Purge endpoint not available");
     }
@@ -346,6 +376,9 @@ export default function Alerts() {
       </div>
 
       <div className="pt-2">
+        {nextCursor && (
+          <button onClick={loadOlder} className="pagination-btn">Load older</button>
+        )}
         <Pagination page={page} pageSize={pageSize} total={filtered.length} setPage={setPage}/>
       </div>
 
@@ -109,7 +109,7 @@ export default function Dashboard() {
   const fetchStats = React.useCallback(async () => {
     setLoading(true);
     try {
-      const alerts = await apiGet("/api/alerts?status=open&limit=1000");
+      const alerts = await apiGet("/api/alerts?status=open&limit=500");
       const devices = await apiGet("/api/devices");
       const msgs = await apiGet("/api/messages?limit=10");
       setStats({
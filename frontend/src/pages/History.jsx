@@ -5,7 +5,7 @@ import Spinner from "@/components/Spinner.jsx";
 import { timeAgo } from "@/utils/health";
 
 const TABS = [
-  { key: "raw", label: "Raw MQTT", icon: FiMessageSquare, endpoint: "/api/messages?limit=1000" },
+  { key: "raw", label: "Raw MQTT", icon: FiMessageSquare, endpoint: "/api/messages?limit=500" },
   { key: "hb",  label: "Heartbeats", icon: FiHeart,        endpoint: "/api/heartbeats?limit=1000" }
 ];
 
@@ -1,5 +1,6 @@
 import React from "react";
 import { FiActivity, FiMapPin } from "react-icons/fi";
+import useEventStream from "@/hooks/useEventStream";
 
 function LegendItem({ colorClass, label }) {
   return (
@@ -15,6 +16,15 @@ export default function RoomsMap({ onSelect, title = "Rooms activity" }) {
   const [eventsByRoom, setEventsByRoom] = React.useState({});
   const [active, setActive] = React.useState(null);
 
+  const loadEvents = React.useCallback(() => {
+    fetch("http://192.168.0.48:5000/api/events/recent", {
+      headers: { "X-API-Key": "iotkey" },
+    })
+      .then((res) => res.json())
+      .then((data) => setEventsByRoom(data))
+      .catch(() => {});
+  }, []);
+
   React.useEffect(() => {
     fetch("http://192.168.0.48:5000/api/rooms", {
       headers: { "X-API-Key": "iotkey" },
@@ -36,13 +46,31 @@ export default function RoomsMap({ onSelect, title = "Rooms activity" }) {
       })
       .catch((err) => console.error("Failed to fetch rooms:", err));
 
-    fetch("http://192.168.0.48:5000/api/events/recent", {
-      headers: { "X-API-Key": "iotkey" },
-    })
-      .then((res) => res.json())
-      .then((data) => setEventsByRoom(data))
-      .catch(() => {});
-  }, []);
+    loadEvents();
+  }, [loadEvents]);
+
+  // live updates mirror /api/events/recent (one row per interval): a start
+  // opens a row unless the device already has an open one, a stop closes it
+  useEventStream({
+    motion: (m) => {
+      const room = m.room || "Unknown";
+      const device = m.device_id;
+      setEventsByRoom((prev) => {
+        const list = prev[room] || [];
+        const open = list.findIndex((e) => e.end === null && e.device === device);
+        if (Number(m.value) === 1) {
+          if (open !== -1) return prev;
+          const row = { ts: m.ts_utc, end: null, text: `Motion (${device})`, device };
+          return { ...prev, [room]: [row, ...list].slice(0, 20) };
+        }
+        if (open === -1) return prev;
+        const next = list.slice();
+        next[open] = { ...list[open], end: m.ts_utc };
+        return { ...prev, [room]: next };
+      });
+    },
+    reset: loadEvents,
+  });
 
   const activeRoom = rooms.find((r) => r.key === active);
 
@@ -16,6 +16,7 @@ const RULE_FIELDS = [
   { key: "inactive.threshold_day_min", label: "Inactive (day, min)" },
   { key: "inactive.threshold_night_min", label: "Inactive (night, min)" },
   { key: "night.window", label: "Night window" },
+  { key: "night.rooms", label: "Night activity rooms" },
   { key: "dwell.critical_rooms", label: "Critical rooms" },
   { key: "dwell.bathroom_min", label: "Bathroom min dwell" },
   { key: "dwell.kitchen_min", label: "Kitchen min dwell" },